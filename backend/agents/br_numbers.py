@@ -0,0 +1,35 @@
+"""Number parsing for values stored in extracted_data.
+
+The LLM and the regex fallbacks store amounts as floats or as strings in either format
+('1.234,56', '1234.56', 'R$ 10,00'). `to_num` reads both with the separator rules of
+main.compute_aggregates.to_num. The analytics frames (api/analytics.py) and the export
+(reporting_agent.py) both use it, so a value is the same number everywhere.
+"""
+import re
+from typing import Optional
+
+
+def to_num(x) -> Optional[float]:
+    """`x` as a float, or None when it is empty or not a number."""
+    try:
+        if x is None or isinstance(x, bool):
+            return None
+        if isinstance(x, (int, float)):
+            return float(x)
+        s = str(x).strip()
+        if not s:
+            return None
+        s = re.sub(r"[^0-9\.,-]", "", s)
+        if '.' in s and ',' in s:
+            s = s.replace('.', '').replace(',', '.')
+        elif ',' in s:
+            s = s.replace('.', '').replace(',', '.')
+        elif '.' in s:
+            parts = s.split('.')
+            if not (len(parts) == 2 and len(parts[1]) == 2):
+                s = s.replace('.', '')
+        if s in ['', '-', ',', '.']:
+            return None
+        return float(s)
+    except Exception:
+        return None
@@ -0,0 +1,113 @@
+"""Decoder for the 44-digit chave de acesso of NF-e / NFC-e / CF-e SAT.
+
+The key encodes the emission data, so a valid key settles several fields without searching the
+text or asking the LLM:
+
+    cUF(2) AAMM(4) CNPJ emitente(14) modelo(2) serie(3) nNF(9) tpEmis(1) cNF(8) cDV(1)   (55, 65)
+    cUF(2) AAMM(4) CNPJ emitente(14) modelo(2) serie SAT(9) nCF(6) cNF(6) cDV(1)         (59)
+
+A key is accepted only when its check digit (mod 11, weights 2..9 from the right) matches and the
+UF code, month and model are plausible. That rejects OCR misreads and random 44-digit runs
+(barcodes, protocol numbers), so the decoded values can override conflicting LLM/regex values.
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+UF_CODES = {
+    '11': 'RO', '12': 'AC', '13': 'AM', '14': 'RR', '15': 'PA', '16': 'AP', '17': 'TO',
+    '21': 'MA', '22': 'PI', '23': 'CE', '24': 'RN', '25': 'PB', '26': 'PE', '27': 'AL', '28': 'SE', '29': 'BA',
+    '31': 'MG', '32': 'ES', '33': 'RJ', '35': 'SP',
+    '41': 'PR', '42': 'SC', '43': 'RS',
+    '50': 'MS', '51': 'MT', '52': 'GO', '53': 'DF',
+}
+MODELOS = {'55': 'NF-e', '65': 'NFC-e', '59': 'CF-e SAT'}
+
+# digit runs that may be split by single spaces, dots or dashes (DANFE prints the key in groups of 4)
+_DIGIT_RUN_RE = re.compile(r'\d(?:[ .\-]?\d)*')
+
+
+def check_digit(digits43: str) -> int:
+    """Mod-11 check digit of the first 43 digits of a key."""
+    total, weight = 0, 2
+    for ch in reversed(digits43):
+        total += int(ch) * weight
+        weight = 2 if weight == 9 else weight + 1
+    r = total % 11
+    return 0 if r < 2 else 11 - r
+
+
+def cnpj_is_valid(cnpj: str) -> bool:
+    """CNPJ check digits (the emitente in a key can also be a zero-padded CPF)."""
+    if not cnpj or len(cnpj) != 14 or not cnpj.isdigit() or cnpj == cnpj[0] * 14:
+        return False
+    for n in (12, 13):
+        weights = list(range(n - 7, 1, -1)) + list(range(9, 1, -1))
+        total = sum(int(d) * w for d, w in zip(cnpj[:n], weights))
+        r = total % 11
+        if int(cnpj[n]) != (0 if r < 2 else 11 - r):
+            return False
+    return True
+
+
+def decode(chave: Any) -> Optional[Dict[str, Any]]:
+    """Fields of a valid key, or None when `chave` is not a valid 44-digit key."""
+    digits = re.sub(r'\D', '', str(chave or ''))
+    if len(digits) != 44:
+        return None
+    if check_digit(digits[:43]) != int(digits[43]):
+        return None
+    cuf, yy, mm, modelo = digits[0:2], digits[2:4], digits[4:6], digits[20:22]
+    if cuf not in UF_CODES or modelo not in MODELOS or not 1 <= int(mm) <= 12:
+        return None
+    out = {
+        'chave': digits,
+        'uf': UF_CODES[cuf],
+        'ano': 2000 + int(yy),
+        'mes': int(mm),
+        'cnpj': digits[6:20],
+        'cnpj_valido': cnpj_is_valid(digits[6:20]),
+        'modelo': modelo,
+        'tipo': MODELOS[modelo],
+    }
+    if modelo == '59':
+        out.update(serie=digits[22:31], numero=str(int(digits[31:37])), codigo=digits[37:43])
+    else:
+        out.update(serie=str(int(digits[22:25])), numero=str(int(digits[25:34])), tp_emis=digits[34], codigo=digits[35:43])
+    return out
+
+
+def candidates(text: str) -> List[str]:
+    """Every 44-digit window of the digit runs in `text` (runs longer than 44 are slid over)."""
+    out = []
+    for m in _DIGIT_RUN_RE.finditer(text or ''):
+        digits = re.sub(r'\D', '', m.group(0))
+        for i in range(len(digits) - 43):
+            out.append(digits[i:i + 44])
+    return out
+
+
+def find_valid(*texts: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Decoded first valid key found in `texts` (checked in order), or None."""
+    for text in texts:
+        if not text:
+            continue
+        for cand in candidates(str(text)):
+            decoded = decode(cand)
+            if decoded:
+                return decoded
+    return None
+
+
+def matches_date(decoded: Dict[str, Any], date: Optional[str]) -> Optional[bool]:
+    """Whether a YYYY-MM-DD or DD/MM/YYYY date falls in the key's emission month (None when it
+    cannot be parsed)."""
+    s = str(date or '')
+    m = re.match(r'(\d{4})-(\d{2})', s)
+    if m:
+        year, month = m.group(1), m.group(2)
+    else:
+        m = re.match(r'\d{2}/(\d{2})/(\d{4})', s)
+        if not m:
+            return None
+        month, year = m.group(1), m.group(2)
+    return int(year) == decoded['ano'] and int(month) == decoded['mes']
@@ -2,15 +2,21 @@
 Enrichment agent: heuristics to locate missing fiscal fields in OCR/raw extracted text.
 
 Provides:
-- enrich_record(record): returns (updated_extracted_dict, report)
+- enrich_record(record, ctx=None, deadline=None): returns (updated_extracted_dict, report)
+- apply_chave(record, extracted, ...): fill/cross-check fields from a valid chave de acesso
 - compute_aggregates(extracted): same semantics as main.compute_aggregates (minimal duplicate)
 
 This module intentionally avoids importing main to prevent circular imports.
 """
 import re
-import json
 from typing import Tuple, Dict, Any, Optional
 
+try:
+    from . import chave_acesso, llm_fanout, text_context
+except ImportError:
+    # loaded as a standalone module (scripts/apply_enrich_single.py)
+    from backend.agents import chave_acesso, llm_fanout, text_context
+
 try:
     from . import specialist_agent
 except Exception:
@@ -18,28 +24,7 @@ except Exception:
 
 
 def _to_text_sources(record: Dict[str, Any]) -> str:
-    parts = []
-    if isinstance(record.get('raw_extracted'), dict):
-        try:
-            parts.append(json.dumps(record.get('raw_extracted'), ensure_ascii=False))
-        except Exception:
-            parts.append(str(record.get('raw_extracted')))
-    elif record.get('raw_extracted'):
-        parts.append(str(record.get('raw_extracted')))
-
-    if record.get('ocr_text'):
-        parts.append(record.get('ocr_text'))
-
-    if record.get('raw_file'):
-        parts.append(str(record.get('raw_file')))
-
-    if record.get('extracted_data') and isinstance(record.get('extracted_data'), dict):
-        try:
-            parts.append(json.dumps(record.get('extracted_data'), ensure_ascii=False))
-        except Exception:
-            parts.append(str(record.get('extracted_data')))
-
-    return "\n".join([p for p in parts if p])
+    return text_context.build_text_sources(record)
 
 
 def find_cnpj(text: str) -> Optional[str]:
@@ -104,15 +89,21 @@ def find_numero_nota(text: str) -> Optional[str]:
     return None
 
 
-def find_natureza_operacao(text: str) -> Optional[str]:
-    """Extract natureza da operacao - LLM first, then regex fallback."""
+def find_natureza_operacao(text: str, llm_result: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Extract natureza da operacao - LLM first, then regex fallback.
+
+    `llm_result` is an already collected extract_field_with_llm result (see llm_fanout); when
+    omitted the LLM is called here.
+    """
     if not text:
         return None
     
     # Try LLM first
     try:
-        from . import llm_helper
-        result = llm_helper.extract_field_with_llm('natureza_operacao', text)
+        result = llm_result
+        if result is None:
+            from . import llm_helper
+            result = llm_helper.extract_field_with_llm('natureza_operacao', text)
         if result.get('ok') and result.get('value') and result.get('confidence', 0) >= 0.6:
             return result.get('value')
     except Exception:
@@ -135,15 +126,17 @@ def find_natureza_operacao(text: str) -> Optional[str]:
     return None
 
 
-def find_forma_pagamento(text: str) -> Optional[str]:
-    """Extract forma de pagamento - LLM first, then regex fallback."""
+def find_forma_pagamento(text: str, llm_result: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Extract forma de pagamento - LLM first, then regex fallback (`llm_result` as in find_natureza_operacao)."""
     if not text:
         return None
     
     # Try LLM first
     try:
-        from . import llm_helper
-        result = llm_helper.extract_field_with_llm('forma_pagamento', text)
+        result = llm_result
+        if result is None:
+            from . import llm_helper
+            result = llm_helper.extract_field_with_llm('forma_pagamento', text)
         if result.get('ok') and result.get('value') and result.get('confidence', 0) >= 0.6:
             return result.get('value')
     except Exception:
@@ -175,15 +168,17 @@ def find_forma_pagamento(text: str) -> Optional[str]:
     return None
 
 
-def find_aliquota_icms(text: str) -> Optional[float]:
-    """Extract ICMS aliquota - LLM first, then regex fallback."""
+def find_aliquota_icms(text: str, llm_result: Optional[Dict[str, Any]] = None) -> Optional[float]:
+    """Extract ICMS aliquota - LLM first, then regex fallback (`llm_result` as in find_natureza_operacao)."""
     if not text:
         return None
     
     # Try LLM first
     try:
-        from . import llm_helper
-        result = llm_helper.extract_field_with_llm('aliquota_icms', text)
+        result = llm_result
+        if result is None:
+            from . import llm_helper
+            result = llm_helper.extract_field_with_llm('aliquota_icms', text)
         if result.get('ok') and result.get('value') is not None and result.get('confidence', 0) >= 0.6:
             try:
                 return float(result.get('value'))
@@ -445,9 +440,117 @@ def compute_aggregates(extracted: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+def _start_llm_lookups(ctx: text_context.RecordTextContext, extracted: Dict[str, Any]) -> None:
+    """Submit this record's independent LLM lookups to the shared pool (see llm_fanout).
+
+    Only lookups whose field is still missing are started; the specialist lookups (fiscal codes,
+    items) always run. Without an API key nothing is submitted and the find_* helpers keep their
+    sequential behaviour (which returns 'no_key' immediately). When the document budget is too
+    small every lookup answers 'budget' and the regex fallbacks are used. With EXTRACTION_MODE=heuristic
+    or deferred every lookup answers 'offline', so not even the sequential calls are attempted.
+    """
+    if llm_fanout.offline():
+        ctx.llm = llm_fanout.LLMFanout.skipped('offline')
+        return
+    if not llm_fanout.llm_configured() or not ctx.text:
+        return
+    try:
+        from . import llm_helper
+    except ImportError:
+        from backend.agents import llm_helper
+    if ctx.deadline is not None and not ctx.deadline.allows('enrich_llm'):
+        ctx.deadline.skip('enrich_llm')
+        ctx.llm = llm_fanout.LLMFanout.skipped('budget')
+        return
+    text = ctx.text
+    fan = llm_fanout.LLMFanout(
+        None if ctx.deadline is None else min(llm_fanout.ENRICH_DEADLINE_SECONDS, ctx.deadline.remaining())
+    )
+    ctx.llm = fan
+    for field in ('natureza_operacao', 'forma_pagamento'):
+        if not extracted.get(field):
+            fan.submit(field, llm_helper.extract_field_with_llm, field, text)
+    try:
+        aliquota = extracted['impostos']['icms']['aliquota']
+    except Exception:
+        aliquota = None
+    if not aliquota:
+        fan.submit('aliquota_icms', llm_helper.extract_field_with_llm, 'aliquota_icms', text)
+    if specialist_agent:
+        for code_name in ('ncm', 'cfop', 'cst', 'csosn'):
+            fan.submit(code_name, llm_helper.extract_field_with_llm, code_name, text)
+        fan.submit('itens', llm_helper.extract_items_with_llm, text)
+
+
+def apply_chave(record: Dict[str, Any], extracted: Dict[str, Any], ctx: Optional[text_context.RecordTextContext] = None,
+                report: Optional[Dict[str, Any]] = None, decoded: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Fill or cross-check numero_nota, emitente.cnpj and data_emissao (in `extracted`, in place)
+    from a valid chave de acesso.
+
+    The key is `decoded` (chave_acesso.decode output) when given, else extracted['chave_acesso'],
+    else the first valid key in the record's text sources or file name. Values that disagree with
+    the key are replaced (the key passed its mod-11 check, the LLM and regex values did not) and
+    noted in the report. The key only has the emission month, so data_emissao is replaced only by
+    a date in the text that falls in that month. Fields settled here skip their regex lookups in
+    enrich_record. Returns the decoded key (also in report['chave']).
+    """
+    if report is None:
+        report = {'filled': {}, 'notes': []}
+    ctx = text_context.RecordTextContext.for_record(record, ctx)
+    decoded = decoded or chave_acesso.decode(extracted.get('chave_acesso')) or chave_acesso.find_valid(ctx.text, record.get('filename'))
+    if not decoded:
+        return None
+    if not isinstance(extracted.get('emitente'), dict):
+        extracted['emitente'] = {'razao_social': None, 'cnpj': None, 'inscricao_estadual': None, 'endereco': None}
+    report['chave'] = {k: decoded.get(k) for k in ('tipo', 'uf', 'ano', 'mes', 'serie', 'numero', 'cnpj')}
+
+    def _settle(path, current, value):
+        if current in (None, ''):
+            report['filled'][path] = value
+        else:
+            report['notes'].append(f"{path} {current!r} replaced by {value!r} from the chave de acesso")
+
+    current = extracted.get('chave_acesso')
+    if re.sub(r'\D', '', str(current or '')) != decoded['chave']:
+        _settle('chave_acesso', current, decoded['chave'])
+    extracted['chave_acesso'] = decoded['chave']
+
+    current = extracted.get('numero_nota')
+    digits = re.sub(r'\D', '', str(current or ''))
+    if not digits or int(digits) != int(decoded['numero']):
+        _settle('numero_nota', current, decoded['numero'])
+        extracted['numero_nota'] = decoded['numero']
+
+    if decoded['cnpj_valido']:
+        current = extracted['emitente'].get('cnpj')
+        if re.sub(r'\D', '', str(current or '')) != decoded['cnpj']:
+            _settle('emitente.cnpj', current, decoded['cnpj'])
+            extracted['emitente']['cnpj'] = decoded['cnpj']
+
+    current = extracted.get('data_emissao')
+    if not chave_acesso.matches_date(decoded, current):
+        for h in ctx.scan.all('date_br') + ctx.scan.all('date_iso'):
+            if chave_acesso.matches_date(decoded, h['v']):
+                value = h['v']
+                if '/' in value:
+                    dd, mm, yyyy = value.split('/')
+                    value = f"{yyyy}-{mm}-{dd}"
+                _settle('data_emissao', current, value)
+                extracted['data_emissao'] = value
+                break
+        else:
+            if current:
+                report['notes'].append(f"data_emissao {current!r} is outside the chave de acesso month {decoded['ano']}-{decoded['mes']:02d}")
+    return decoded
+
+
+def enrich_record(record: Dict[str, Any], ctx: Optional[text_context.RecordTextContext] = None, deadline=None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     """Try to fill missing/null extracted fields using heuristics on available text.
 
+    `ctx` is an optional RecordTextContext for `record`; it is created when missing and handed on
+    to specialist_agent so the text sources are only assembled and scanned once. `deadline` is the
+    document's api.budget.Deadline (if any): LLM steps are skipped once it runs low.
+
     Returns (new_extracted_dict, report) where report contains fields filled and confidence notes.
     """
     report = {'filled': {}, 'notes': []}
@@ -459,7 +562,14 @@ def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any
     else:
         extracted = {}
 
-    text = _to_text_sources(record)
+    ctx = text_context.RecordTextContext.for_record(record, ctx)
+    if deadline is not None:
+        ctx.deadline = deadline
+    text = ctx.text
+    # fire the independent LLM lookups now; the heuristics below collect them when needed
+    _start_llm_lookups(ctx, extracted)
+    # one pass over the text collects the candidates for every regex-based field below
+    scanned = ctx.scan
 
     # Deep-scan raw_extracted JSON (if present) for address-like keys and chave
     raw = record.get('raw_extracted')
@@ -485,16 +595,22 @@ def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any
     if 'destinatario' not in extracted or not isinstance(extracted.get('destinatario'), dict):
         extracted['destinatario'] = {'razao_social': None, 'cnpj': None, 'inscricao_estadual': None, 'endereco': None}
 
+    # a valid chave de acesso settles numero_nota, emitente.cnpj and the emission month
+    try:
+        apply_chave(record, extracted, ctx, report)
+    except Exception as e:
+        report['notes'].append(f"chave de acesso check failed: {e}")
+
     # Try to find CNPJ for emitente if missing
     if not extracted['emitente'].get('cnpj'):
-        c = find_cnpj(text)
+        c = scanned.cnpj()
         if c:
             extracted['emitente']['cnpj'] = c
             report['filled']['emitente.cnpj'] = c
 
     # Extract valor_total_impostos
     if not extracted.get('valor_total_impostos'):
-        imp = find_total_impostos(text)
+        imp = scanned.total_impostos()
         if imp is not None:
             extracted['valor_total_impostos'] = imp
             report['filled']['valor_total_impostos'] = imp
@@ -502,7 +618,7 @@ def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any
     # Try deeper OCR scanning for address lines if endereco missing
     if not extracted['emitente'].get('endereco') and text:
         try:
-            lines = [l.strip() for l in text.splitlines() if l.strip()]
+            lines = scanned.lines
             for i, ln in enumerate(lines):
                 if re.search(r'ENDEREC[OÕ]|ENDERE[CÇ]O|LOGRADOURO|AV\.|RUA|AVENIDA', ln, re.IGNORECASE):
                     # take this line and a following token as address
@@ -521,7 +637,7 @@ def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any
     # Try to find CNPJ for destinatario if missing (rare), search for second occurrence
     if not extracted['destinatario'].get('cnpj'):
         # locate all cnpjs and pick second if exists
-        all_cnpjs = re.findall(r'(?:\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}|\d{14})', text)
+        all_cnpjs = scanned.all_cnpjs()
         if len(all_cnpjs) >= 2:
             cand = re.sub(r'\D', '', all_cnpjs[1])
             extracted['destinatario']['cnpj'] = cand
@@ -529,7 +645,7 @@ def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any
 
     # razao_social heuristics: try first non-empty line if missing
     if not extracted['emitente'].get('razao_social'):
-        lines = [l.strip() for l in text.splitlines() if l.strip()]
+        lines = scanned.lines
         if lines:
             # pick first reasonably long line
             for ln in lines[:8]:
@@ -540,43 +656,43 @@ def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any
 
     # --- top-level fields
     if not extracted.get('chave_acesso'):
-        ch = find_chave(text)
+        ch = scanned.chave()
         if ch:
             extracted['chave_acesso'] = ch
             report['filled']['chave_acesso'] = ch
 
     if not extracted.get('numero_nota'):
-        n = find_numero_nota(text)
+        n = scanned.numero_nota()
         if n:
             extracted['numero_nota'] = n
             report['filled']['numero_nota'] = n
 
     if not extracted.get('data_emissao'):
-        d = find_date(text)
+        d = scanned.date()
         if d:
             extracted['data_emissao'] = d
             report['filled']['data_emissao'] = d
 
     if not extracted.get('valor_total'):
-        v = find_money(text)
+        v = scanned.money()
         if v is not None:
             extracted['valor_total'] = v
             report['filled']['valor_total'] = v
 
     if not extracted.get('valor_total_impostos'):
-        vti = find_valor_total_impostos(text)
+        vti = scanned.valor_total_impostos()
         if vti is not None:
             extracted['valor_total_impostos'] = vti
             report['filled']['valor_total_impostos'] = vti
 
     if not extracted.get('natureza_operacao'):
-        nat = find_natureza_operacao(text)
+        nat = find_natureza_operacao(text, llm_result=ctx.llm.result('natureza_operacao') if ctx.llm else None)
         if nat:
             extracted['natureza_operacao'] = nat
             report['filled']['natureza_operacao'] = nat
 
     if not extracted.get('forma_pagamento'):
-        forma = find_forma_pagamento(text)
+        forma = find_forma_pagamento(text, llm_result=ctx.llm.result('forma_pagamento') if ctx.llm else None)
         if forma:
             extracted['forma_pagamento'] = forma
             report['filled']['forma_pagamento'] = forma
@@ -584,7 +700,7 @@ def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any
     # itens: if empty and we can find simple lines with currency, add a single inferred item
     if not extracted.get('itens'):
         # look for lines with description followed by money in next line
-        lines = [l.strip() for l in text.splitlines() if l.strip()]
+        lines = scanned.lines
         any_money_re = re.compile(r'R?\$\s*([0-9]+[\.,][0-9]{2})')
         candidate_item = None
         for i, ln in enumerate(lines[:-1]):
@@ -607,17 +723,13 @@ def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any
     # quick search for 'ICMS' value
     try:
         if not (extracted.get('impostos') or {}).get('icms', {}).get('valor'):
-            m = re.search(r'ICMS\s*[:\-]?\s*R?\$?\s*([0-9]+[\.,][0-9]{2})', text, re.IGNORECASE)
-            if m:
-                try:
-                    v = float(m.group(1).replace('.', '').replace(',', '.'))
-                    extracted['impostos']['icms']['valor'] = v
-                    report['filled']['impostos.icms.valor'] = v
-                except Exception:
-                    pass
+            v = scanned.icms_valor()
+            if v is not None:
+                extracted['impostos']['icms']['valor'] = v
+                report['filled']['impostos.icms.valor'] = v
         # try to find ICMS aliquota
         if not (extracted.get('impostos') or {}).get('icms', {}).get('aliquota'):
-            aliq = find_aliquota_icms(text)
+            aliq = find_aliquota_icms(text, llm_result=ctx.llm.result('aliquota_icms') if ctx.llm else None)
             if aliq is not None:
                 extracted['impostos']['icms']['aliquota'] = aliq
                 report['filled']['impostos.icms.aliquota'] = aliq
@@ -669,7 +781,7 @@ def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any
     # run specialist agent if available to further refine items and codes
     if specialist_agent:
         try:
-            refined, notes = specialist_agent.refine_extracted(record, extracted)
+            refined, notes = specialist_agent.refine_extracted(record, extracted, ctx=ctx)
             # merge refined into extracted
             if isinstance(refined, dict):
                 extracted = refined
@@ -719,7 +831,20 @@ def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any
                         context_text = record.get('ocr_text') or None
                     except Exception:
                         context_text = None
-                    llm_resp = llm_helper.verify_total_with_llm(items, top_after, context_text=context_text)
+                    # depends on the items, so it runs after refine_extracted; bounded by the deadline
+                    if ctx.llm is None:
+                        llm_resp = llm_helper.verify_total_with_llm(items, top_after, context_text=context_text)
+                    elif ctx.llm.skip_reason == 'offline':
+                        # EXTRACTION_MODE=heuristic / deferred: not a budget skip
+                        llm_resp = {'ok': False, 'reason': 'offline'}
+                    elif ctx.llm.skip_reason or (ctx.deadline is not None and not ctx.deadline.allows('verify_total')):
+                        if ctx.deadline is not None:
+                            ctx.deadline.skip('verify_total')
+                        llm_resp = {'ok': False, 'reason': ctx.llm.skip_reason or 'budget'}
+                    elif ctx.llm.remaining() > 0:
+                        llm_resp = llm_helper.verify_total_with_llm(items, top_after, context_text=context_text, timeout=max(1, min(8, int(ctx.llm.remaining()))))
+                    else:
+                        llm_resp = {'ok': False, 'reason': 'deadline'}
                     if llm_resp.get('ok'):
                         decision = (llm_resp.get('decision') or '').lower() if llm_resp.get('decision') else None
                         llm_total = llm_resp.get('llm_total')
@@ -763,4 +888,7 @@ def enrich_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any
     except Exception:
         pass
 
+    if ctx.llm is not None:
+        ctx.llm.cancel_pending()
+
     return extracted, {'report': report, 'aggregates': ag}
@@ -0,0 +1,239 @@
+"""Single-pass field scanner used by enrichment_agent.
+
+`enrich_record` used to call the find_* helpers one by one on the concatenated text (CNPJ, chave,
+date, numero, money, tax totals, ICMS, all CNPJs) and split the text into lines three separate
+times. Most of that time went to the keyword-led patterns (valor/total/tributos/impostos/ICMS/
+IPI/PIS/COFINS/R$): they are case-insensitive, which stops the regex engine from skipping ahead
+to a literal prefix, so each of the sixteen scans tried a match at every position of the text.
+
+`scan(text)` returns a `ScanResult` that:
+
+- walks the text ONCE with `_ANCHOR`, which finds every position where one of those keywords
+  starts, and tries there only the patterns that can start with that keyword (`_KEYWORDS`); the
+  hits of every keyword-led field are collected in that one pass, the first time any of them is
+  asked for,
+- runs the digit-led patterns (CNPJ, chave, dates, decimals) and numero as plain precompiled
+  scans, on first use, since the engine already skips non-digit positions for them,
+- splits the text into lines once (`lines`).
+
+The patterns and selection rules are those of enrichment_agent.find_*, so every accessor returns
+what its legacy helper returns (scripts/benchmark_field_scanner.py checks this on the stored
+documents). The find_* helpers are kept for other callers.
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+# value sub-groups are named (?P<v>...) / (?P<w>...); without them the whole match is the value
+_PATTERNS = {
+    # find_cnpj (the formatted pattern also matches 14 plain digits, so it covers the fallback)
+    'cnpj': re.compile(r'\d{2}[\.\s]?\d{3}[\.\s]?\d{3}[\/\s]?\d{4}[-\s]?\d{2}'),
+    # re.findall used for the destinatario CNPJ
+    'cnpj_all': re.compile(r'(?:\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}|\d{14})'),
+    # find_chave: 44 digits possibly separated by single non-digit chars
+    'chave': re.compile(r'(?:(?:\d\D?){44})'),
+    # find_date
+    'date_br': re.compile(r'\d{2}/\d{2}/\d{4}'),
+    'date_iso': re.compile(r'\d{4}-\d{2}-\d{2}'),
+    # find_numero_nota
+    'numero': re.compile(r'(?:n\s*[ºo]?\s*[:\-]?|nota\s*[:\-]?|nf\s*[:\-]?|n[:\-]\s*)(?P<v>\d{1,10})', re.IGNORECASE),
+    'numero_alt': re.compile(r'numero\s*(?P<v>\d{1,10})', re.IGNORECASE),
+    # find_money (priority order)
+    'money_nota': re.compile(r'valor\s+total\s+da\s+nota[:\s]*(?:r\$\s*)?(?P<v>[0-9]+[\.,][0-9]{2})', re.IGNORECASE),
+    'money_total': re.compile(r'(?:valor\s+total|total.*nota|total)\s*[:\-]?\s*R?\$?\s*(?P<v>[0-9]+[\.,][0-9]{2})', re.IGNORECASE),
+    'money_rs': re.compile(r'R\$\s*(?P<v>[0-9]+[\.,][0-9]{2})'),
+    'money_dec': re.compile(r'[0-9]{1,3}(?:\.[0-9]{3})*[,][0-9]{2}'),
+    # find_total_impostos: explicit totals (first valid per pattern, in order) ...
+    'tax_total0': re.compile(r'(?:vlr\s+aprox\s+dos\s+tributos?|valor\s+aproximado\s+dos\s+tributos?|total\s+tributos?)\s*:?\s*R?\$?\s*(?P<v>[0-9]+[,\.][0-9]{2})', re.IGNORECASE),
+    'tax_total1': re.compile(r'(?:impostos?\s+totais?|total\s+de\s+impostos?)\s*:?\s*R?\$?\s*(?P<v>[0-9]+[,\.][0-9]{2})', re.IGNORECASE),
+    'tax_total2': re.compile(r'R\$\s*(?P<v>[0-9]+[,\.][0-9]{2})\s+(?:federal|estadual|municipal)', re.IGNORECASE),
+    # ... then the sum of individual components
+    'tax_federal': re.compile(r'R\$\s*(?P<v>[0-9]+[,\.][0-9]{2})\s+federal', re.IGNORECASE),
+    'tax_estadual': re.compile(r'R\$\s*(?P<v>[0-9]+[,\.][0-9]{2})\s+estadual', re.IGNORECASE),
+    'tax_municipal': re.compile(r'R\$\s*(?P<v>[0-9]+[,\.][0-9]{2})\s+municipal', re.IGNORECASE),
+    'tax_icms': re.compile(r'icms\s*:?\s*R?\$?\s*(?P<v>[0-9]+[,\.][0-9]{2})', re.IGNORECASE),
+    'tax_ipi': re.compile(r'ipi\s*:?\s*R?\$?\s*(?P<v>[0-9]+[,\.][0-9]{2})', re.IGNORECASE),
+    'tax_pis': re.compile(r'pis\s*:?\s*R?\$?\s*(?P<v>[0-9]+[,\.][0-9]{2})', re.IGNORECASE),
+    'tax_cofins': re.compile(r'cofins\s*:?\s*R?\$?\s*(?P<v>[0-9]+[,\.][0-9]{2})', re.IGNORECASE),
+    # find_valor_total_impostos
+    'tributos_split': re.compile(r'(?:vlr\s+aprox\s+dos\s+tributos|valor\s+aprox\s+tributos|tributos)[:\s]*(?:r\$\s*)?(?P<v>[0-9]+[,\.][0-9]{2})\s*federal\s*[/]\s*(?:r\$\s*)?(?P<w>[0-9]+[,\.][0-9]{2})\s*estadual', re.IGNORECASE),
+    'tributos_single': re.compile(r'(?:vlr\s+aprox\s+dos\s+tributos|valor.*tributos)[:\s]*(?:r\$\s*)?(?P<v>[0-9]+[,\.][0-9]{2})', re.IGNORECASE),
+    # ICMS value used directly by enrich_record
+    'icms_valor': re.compile(r'ICMS\s*[:\-]?\s*R?\$?\s*(?P<v>[0-9]+[\.,][0-9]{2})', re.IGNORECASE),
+}
+
+# every match of a keyword-led pattern starts with one of these words (any case), so trying the
+# pattern only where `_ANCHOR` finds the word gives the same hits as scanning every position
+_KEYWORDS = {
+    'vlr': ('tax_total0', 'tributos_split', 'tributos_single'),
+    'valor': ('money_nota', 'money_total', 'tax_total0', 'tributos_split', 'tributos_single'),
+    'total': ('money_total', 'tax_total0', 'tax_total1'),
+    'imposto': ('tax_total1',),
+    'impostos': ('tax_total1',),
+    'tributos': ('tributos_split',),
+    'icms': ('tax_icms', 'icms_valor'),
+    'ipi': ('tax_ipi',),
+    'pis': ('tax_pis',),
+    'cofins': ('tax_cofins',),
+    'r$': ('money_rs', 'tax_total2', 'tax_federal', 'tax_estadual', 'tax_municipal'),
+}
+_KEYWORD_FIELDS = tuple(dict.fromkeys(name for names in _KEYWORDS.values() for name in names))
+# the leading class lets the engine skip to the few candidate letters before trying the words
+_ANCHOR = re.compile(r'(?=[vtipcr])(?=(vlr|valor|total|impostos?|tributos|icms|ipi|pis|cofins|r\$))', re.IGNORECASE)
+
+_TAX_TOTALS = ('tax_total0', 'tax_total1', 'tax_total2')
+_TAX_COMPONENTS = ('tax_federal', 'tax_estadual', 'tax_municipal', 'tax_icms', 'tax_ipi', 'tax_pis', 'tax_cofins')
+
+
+def _hit(m: 're.Match') -> Dict[str, Any]:
+    groups = m.groupdict()
+    return {'start': m.start(), 'end': m.end(), 'match': m.group(0), 'v': groups.get('v', m.group(0)), 'w': groups.get('w')}
+
+
+def _to_float(value: str) -> Optional[float]:
+    try:
+        return float(value.replace('.', '').replace(',', '.'))
+    except Exception:
+        return None
+
+
+class ScanResult:
+    """Field candidates of one text, searched on first use, plus the text's lines."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self._first: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._all: Dict[str, List[Dict[str, Any]]] = {}
+        self._lines: Optional[List[str]] = None
+
+    @property
+    def lines(self) -> List[str]:
+        """Stripped, non-empty lines (what enrich_record used to rebuild three times)."""
+        if self._lines is None:
+            self._lines = [l.strip() for l in self.text.splitlines() if l.strip()]
+        return self._lines
+
+    # --- raw access --------------------------------------------------------------------
+
+    def _scan_keywords(self) -> None:
+        """The single pass: hits of every keyword-led field, non-overlapping per field."""
+        text = self.text
+        hits: Dict[str, List[Dict[str, Any]]] = {name: [] for name in _KEYWORD_FIELDS}
+        ends = dict.fromkeys(_KEYWORD_FIELDS, 0)
+        for anchor in _ANCHOR.finditer(text):
+            pos = anchor.start()
+            # a case variant that lower() does not map back (e.g. a dotted capital I) tries them all
+            for name in _KEYWORDS.get(anchor.group(1).lower(), _KEYWORD_FIELDS):
+                if pos < ends[name]:
+                    continue
+                m = _PATTERNS[name].match(text, pos)
+                if m:
+                    hits[name].append(_hit(m))
+                    ends[name] = m.end()
+        self._all.update(hits)
+
+    def first(self, name: str) -> Optional[Dict[str, Any]]:
+        """Leftmost hit of field `name` (re.search)."""
+        if name in self._all or name in _KEYWORD_FIELDS:
+            hits = self.all(name)
+            return hits[0] if hits else None
+        if name not in self._first:
+            m = _PATTERNS[name].search(self.text) if self.text else None
+            self._first[name] = _hit(m) if m else None
+        return self._first[name]
+
+    def all(self, name: str) -> List[Dict[str, Any]]:
+        """Every non-overlapping hit of field `name` (re.findall)."""
+        if name not in self._all:
+            if name in _KEYWORD_FIELDS:
+                self._scan_keywords()
+            else:
+                self._all[name] = [_hit(m) for m in _PATTERNS[name].finditer(self.text)] if self.text else []
+        return self._all[name]
+
+    # --- field accessors (same selection rules as enrichment_agent.find_*) -------------
+
+    def cnpj(self) -> Optional[str]:
+        h = self.first('cnpj')
+        return re.sub(r'\D', '', h['v']) if h else None
+
+    def all_cnpjs(self) -> List[str]:
+        return [h['match'] for h in self.all('cnpj_all')]
+
+    def chave(self) -> Optional[str]:
+        # every (\d\D?) repetition holds one digit, so a match always has the 44 digits
+        h = self.first('chave')
+        return re.sub(r'\D', '', h['match']) if h else None
+
+    def date(self) -> Optional[str]:
+        h = self.first('date_br')
+        if h:
+            dd, mm, yyyy = h['v'].split('/')
+            return f"{yyyy}-{mm}-{dd}"
+        h = self.first('date_iso')
+        return h['v'] if h else None
+
+    def numero_nota(self) -> Optional[str]:
+        h = self.first('numero') or self.first('numero_alt')
+        return h['v'] if h else None
+
+    def money(self) -> Optional[float]:
+        for name in ('money_nota', 'money_total', 'money_rs'):
+            h = self.first(name)
+            val = _to_float(h['v']) if h else None
+            if val is None:
+                continue
+            if name == 'money_nota':
+                if 0 < val < 10_000_000:
+                    return val
+            elif val <= 10_000_000:
+                return val
+        text = self.text
+        for h in reversed(self.all('money_dec')):
+            cand = h['v']
+            span_index = text.rfind(cand)
+            context_before = text[max(0, span_index-30): span_index]
+            context_after = text[span_index+len(cand): span_index+len(cand)+30]
+            full_context = context_before + cand + context_after
+            if any(keyword in full_context.lower() for keyword in ['cnpj', 'cpf', 'inscr', 'codigo', 'chave']):
+                continue
+            if '/' in full_context or '-' in context_after:
+                continue
+            val = _to_float(cand)
+            if val is None or val > 10_000_000:
+                continue
+            return val
+        return None
+
+    def total_impostos(self) -> Optional[float]:
+        for name in _TAX_TOTALS:
+            for h in self.all(name):
+                val = _to_float(h['v'])
+                if val is not None and 0 < val < 100000:
+                    return val
+        components = [val for name in _TAX_COMPONENTS for val in (_to_float(h['v']) for h in self.all(name))
+                      if val is not None and 0 < val < 100000]
+        return sum(components) if components else None
+
+    def valor_total_impostos(self) -> Optional[float]:
+        h = self.first('tributos_split')
+        if h:
+            try:
+                return float(h['v'].replace(',', '.')) + float(h['w'].replace(',', '.'))
+            except Exception:
+                pass
+        h = self.first('tributos_single')
+        if h:
+            try:
+                return float(h['v'].replace(',', '.'))
+            except Exception:
+                pass
+        return None
+
+    def icms_valor(self) -> Optional[float]:
+        h = self.first('icms_valor')
+        return _to_float(h['v']) if h else None
+
+
+def scan(text: str) -> ScanResult:
+    """Field scanner of `text` (see module docstring)."""
+    return ScanResult(text or '')
@@ -0,0 +1,103 @@
+"""Concurrent LLM lookups for one document.
+
+The enrichment LLM calls (natureza_operacao, forma_pagamento, aliquota_icms, the four fiscal
+codes and item extraction) do not depend on each other, yet each one can block for its whole HTTP
+timeout (8-12 s). `LLMFanout` submits them to a shared thread pool up front and hands out the
+results when the heuristics need them. Only `verify_total_with_llm` depends on another result
+(the items), so it still runs after the items are in.
+
+Every document gets a deadline (ENRICH_DEADLINE_SECONDS, default 25 s). A lookup that has not
+finished by then yields {'ok': False, 'reason': 'deadline'}, and the caller falls back to its
+regex heuristics. The shared pool (ENRICH_LLM_WORKERS, default 8 threads) bounds the number of
+in-flight requests across documents.
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Optional
+
+ENRICH_LLM_WORKERS = int(os.environ.get('ENRICH_LLM_WORKERS', '8'))
+ENRICH_DEADLINE_SECONDS = float(os.environ.get('ENRICH_DEADLINE_SECONDS', '25'))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def llm_configured() -> bool:
+    try:
+        from . import llm_helper
+    except Exception:
+        return False
+    return llm_helper.unavailable_reason() is None
+
+
+def offline() -> bool:
+    """EXTRACTION_MODE=heuristic / deferred: the document is processed without any LLM request."""
+    try:
+        from . import llm_helper
+    except Exception:
+        return False
+    return llm_helper.EXTRACTION_MODE in ('heuristic', 'deferred')
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, ENRICH_LLM_WORKERS), thread_name_prefix='enrich-llm')
+    return _executor
+
+
+class LLMFanout:
+    """Futures of one document's LLM lookups, keyed by name, bounded by a shared deadline."""
+
+    def __init__(self, deadline_seconds: Optional[float] = None):
+        budget = ENRICH_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds
+        self.deadline = time.monotonic() + max(0.0, budget)
+        self.futures: Dict[str, Future] = {}
+        self.skip_reason: Optional[str] = None
+
+    @classmethod
+    def skipped(cls, reason: str) -> 'LLMFanout':
+        """A fan-out that submits nothing and answers every lookup with {'ok': False, 'reason': reason}."""
+        fan = cls(0)
+        fan.skip_reason = reason
+        return fan
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def submit(self, key: str, fn: Callable[..., Dict[str, Any]], *args, **kwargs) -> None:
+        """Start `fn(*args, **kwargs)` in the pool unless `key` was already submitted."""
+        if key in self.futures or self.skip_reason:
+            return
+        try:
+            self.futures[key] = executor().submit(fn, *args, **kwargs)
+        except Exception as e:
+            print(f"[LLM] could not submit {key}: {e}", file=sys.stderr)
+
+    def result(self, key: str) -> Optional[Dict[str, Any]]:
+        """Result of `key`, waiting at most until the deadline.
+
+        Returns None when `key` was never submitted (the caller then makes the call itself).
+        """
+        if self.skip_reason:
+            return {'ok': False, 'reason': self.skip_reason}
+        fut = self.futures.get(key)
+        if fut is None:
+            return None
+        try:
+            return fut.result(timeout=self.remaining())
+        except FutureTimeout:
+            fut.cancel()
+            return {'ok': False, 'reason': 'deadline'}
+        except Exception as e:
+            return {'ok': False, 'reason': 'exception', 'error': str(e)}
+
+    def cancel_pending(self) -> None:
+        """Drop lookups nobody collected (running requests finish in the background)."""
+        for fut in self.futures.values():
+            fut.cancel()
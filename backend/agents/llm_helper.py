@@ -3,15 +3,51 @@ to verify numeric totals when there's a mismatch between LLM-parsed top-level an
 
 This module uses simple HTTP requests so it doesn't depend on langchain. It is best-effort:
 - If OPENROUTER_API_KEY is not set, it returns {'ok': False, 'reason': 'no_key'}.
+- With EXTRACTION_MODE=heuristic it returns {'ok': False, 'reason': 'offline'} without any request.
+- Every request takes a token from the shared rate limiter (rate_limiter.py) first. When none frees
+  up within the call's timeout it returns {'ok': False, 'reason': 'rate_limited'} without sending it.
 - It expects the OpenRouter-compatible chat completions endpoint.
 """
 import os
 import json
 import requests
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, List, Optional
+
+try:
+    from . import rate_limiter
+except ImportError:
+    from backend.agents import rate_limiter
 
 OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY') or os.environ.get('OPENROUTER_KEY')
 OPENROUTER_DEFAULT_MODEL = os.environ.get('OPENROUTER_MODEL') or 'minimax/minimax-m2:free'
+OPENROUTER_BASE_URL = (os.environ.get('OPENROUTER_BASE_URL') or 'https://openrouter.ai/api/v1').rstrip('/')
+# 'heuristic': no LLM request at all; 'deferred': no LLM while processing uploads, only the
+# refinement worker calls it; 'auto' (default) / 'llm': call the LLM when a key is set
+EXTRACTION_MODE = os.environ.get('EXTRACTION_MODE', 'auto').lower()
+
+
+def unavailable_reason() -> Optional[str]:
+    """Why no LLM request may be made ('offline' / 'no_key'), or None."""
+    if EXTRACTION_MODE == 'heuristic':
+        return 'offline'
+    if not OPENROUTER_API_KEY:
+        return 'no_key'
+    return None
+
+
+def _post(url: str, headers: Dict[str, str], body: Dict[str, Any], timeout: float):
+    """POST a chat completion once the shared rate limiter (rate_limiter.py) has a token for the
+    model, waiting at most `timeout` seconds for it. Returns None when no token freed up in time.
+    The request gets what is left of `timeout` after the wait."""
+    model = body.get('model')
+    t0 = time.monotonic()
+    # keep at least a second of the budget for the request itself
+    if not rate_limiter.acquire(model, OPENROUTER_API_KEY, timeout=max(0.0, timeout - 1)):
+        return None
+    r = requests.post(url, headers=headers, json=body, timeout=max(1.0, timeout - (time.monotonic() - t0)))
+    rate_limiter.observe(model, OPENROUTER_API_KEY, r.status_code, r.headers, r.text[:500] if r.status_code == 429 else None)
+    return r
 
 
 def _build_prompt(items: list, reported_total: Optional[float], context_text: Optional[str] = None) -> str:
@@ -42,12 +78,13 @@ def verify_total_with_llm(items: list, reported_total: Optional[float], context_
     """Ask the LLM to verify totals. Returns a dict with keys: ok, decision, llm_total, confidence, explanation.
     If no API key or the call fails, returns ok=False and reason.
     """
-    if not OPENROUTER_API_KEY:
-        return {'ok': False, 'reason': 'no_key'}
+    reason = unavailable_reason()
+    if reason:
+        return {'ok': False, 'reason': reason}
 
     model_to_use = model or OPENROUTER_DEFAULT_MODEL
     prompt = _build_prompt(items, reported_total, context_text)
-    url = "https://openrouter.ai/api/v1/chat/completions"
+    url = f"{OPENROUTER_BASE_URL}/chat/completions"
     headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
     body = {
         "model": model_to_use,
@@ -59,7 +96,9 @@ def verify_total_with_llm(items: list, reported_total: Optional[float], context_
         "temperature": 0.0
     }
     try:
-        r = requests.post(url, headers=headers, json=body, timeout=timeout)
+        r = _post(url, headers, body, timeout)
+        if r is None:
+            return {'ok': False, 'reason': 'rate_limited'}
         if r.status_code != 200:
             return {'ok': False, 'reason': f'http_{r.status_code}', 'text': r.text[:1000]}
         data = r.json()
@@ -122,8 +161,9 @@ def extract_field_with_llm(field_name: str, context_text: str, field_description
     """Ask the LLM to extract a specific field from text. Returns a dict with keys: ok, value, confidence, explanation.
     If no API key or the call fails, returns ok=False and reason.
     """
-    if not OPENROUTER_API_KEY:
-        return {'ok': False, 'reason': 'no_key'}
+    reason = unavailable_reason()
+    if reason:
+        return {'ok': False, 'reason': reason}
 
     model_to_use = model or OPENROUTER_DEFAULT_MODEL
     
@@ -142,48 +182,46 @@ def extract_field_with_llm(field_name: str, context_text: str, field_description
     prompt = f"""Você é um especialista em documentos fiscais brasileiros. Extraia {field_description} do texto fornecido.
 
 Texto do documento:
-        try:
-            parsed = json.loads(txt)
-        except Exception:
-            # try to find first { ... }
-            f = txt.find('{')
-            l = txt.rfind('}')
-            if f != -1 and l != -1 and l > f:
-                try:
-                    parsed = json.loads(txt[f:l+1])
-                except Exception:
-                    parsed = None
-            else:
-                parsed = None
+{context_text}
 
-        if not parsed or not isinstance(parsed, dict):
-            return {'ok': False, 'reason': 'parse_failed', 'raw_text': txt[:2000]}
+Instruções:
+- Retorne um JSON com as chaves: value (o valor extraído ou null), confidence (0.0-1.0), explanation (breve explicação)
+- Se não encontrar o campo, retorne value: null e confidence: 0.0
+- Para códigos (CST, CSOSN, CFOP, NCM), retorne apenas os dígitos
+- Para alíquotas, retorne apenas o número (ex: 18 para 18%)
+
+Responda apenas em JSON:"""
+
+    url = f"{OPENROUTER_BASE_URL}/chat/completions"
+    headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
+    body = {
+        "model": model_to_use,
+        "messages": [
+            {"role": "system", "content": "Você é um especialista rigoroso em documentos fiscais brasileiros."},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": 200,
+        "temperature": 0.0
+    }
+
+    try:
+        r = _post(url, headers, body, timeout)
+        if r is None:
+            return {'ok': False, 'reason': 'rate_limited'}
+        if r.status_code != 200:
+            return {'ok': False, 'reason': f'http_{r.status_code}', 'text': r.text[:1000]}
+
+        data = r.json()
+        content = None
+        if isinstance(data, dict):
+            try:
+                content = data.get('choices', [])[0].get('message', {}).get('content')
+            except Exception:
+                content = None
+
+        if not content:
+            return {'ok': False, 'reason': 'no_content', 'raw': data}
 
-        # normalize fields
-        decision = parsed.get('decision') or parsed.get('action') or None
-        llm_total = parsed.get('llm_total') if 'llm_total' in parsed else parsed.get('total') if 'total' in parsed else None
-        confidence = parsed.get('confidence') if 'confidence' in parsed else None
-        explanation = parsed.get('explanation') or parsed.get('reason') or ''
-        value = parsed.get('value')
-        # Post-process for valor_total: reject implausible values (e.g., CNPJ-like numbers)
-        try:
-            if value is not None:
-                value = float(value)
-                if field_name == 'valor_total' and value > 10_000_000:
-                    value = None
-            elif llm_total is not None:
-                llm_total = float(llm_total)
-                if field_name == 'valor_total' and llm_total > 10_000_000:
-                    llm_total = None
-        except Exception:
-            value = parsed.get('value')
-        return {
-            'ok': True,
-            'value': value if value is not None else llm_total,
-            'confidence': confidence,
-            'explanation': explanation,
-            'raw': parsed
-        }
         # extract JSON from content
         txt = content.strip()
         try:
@@ -206,7 +244,15 @@ Texto do documento:
         value = parsed.get('value')
         confidence = parsed.get('confidence', 0.0)
         explanation = parsed.get('explanation', '')
-        
+
+        # Post-process for valor_total: reject implausible values (e.g., CNPJ-like numbers)
+        if field_name == 'valor_total' and value is not None:
+            try:
+                if float(value) > 10_000_000:
+                    value = None
+            except Exception:
+                pass
+
         try:
             if confidence is not None:
                 confidence = float(confidence)
@@ -222,8 +268,9 @@ def extract_items_with_llm(context_text: str, model: Optional[str] = None, timeo
     """Ask the LLM to extract items from text. Returns a dict with keys: ok, items, confidence, explanation.
     If no API key or the call fails, returns ok=False and reason.
     """
-    if not OPENROUTER_API_KEY:
-        return {'ok': False, 'reason': 'no_key'}
+    reason = unavailable_reason()
+    if reason:
+        return {'ok': False, 'reason': reason}
 
     model_to_use = model or OPENROUTER_DEFAULT_MODEL
     
@@ -249,7 +296,7 @@ Exemplo de formato de retorno:
 
 Responda apenas em JSON:"""
 
-    url = "https://openrouter.ai/api/v1/chat/completions"
+    url = f"{OPENROUTER_BASE_URL}/chat/completions"
     headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
     body = {
         "model": model_to_use,
@@ -262,7 +309,9 @@ Responda apenas em JSON:"""
     }
     
     try:
-        r = requests.post(url, headers=headers, json=body, timeout=timeout)
+        r = _post(url, headers, body, timeout)
+        if r is None:
+            return {'ok': False, 'reason': 'rate_limited'}
         if r.status_code != 200:
             return {'ok': False, 'reason': f'http_{r.status_code}', 'text': r.text[:1000]}
         
@@ -309,3 +358,78 @@ Responda apenas em JSON:"""
         return {'ok': True, 'items': items, 'confidence': confidence, 'explanation': explanation, 'raw': parsed}
     except Exception as e:
         return {'ok': False, 'reason': 'exception', 'error': str(e)}
+
+
+def refine_documents_with_llm(documents: List[Dict[str, Any]], model: Optional[str] = None, timeout: int = 30) -> Dict[str, Any]:
+    """Ask for the listed fields of several documents in one request (deferred refinement).
+    `documents` is a list of {'id', 'text', 'fields'}. Returns {'ok': True, 'results': {id: {...}}}
+    (documents missing from the answer are absent from results), or ok=False and reason.
+    """
+    reason = unavailable_reason()
+    if reason:
+        return {'ok': False, 'reason': reason}
+    if not documents:
+        return {'ok': True, 'results': {}}
+
+    model_to_use = model or OPENROUTER_DEFAULT_MODEL
+    blocks = []
+    for doc in documents:
+        blocks.append(f"<documento id=\"{doc['id']}\">\nCampos: {', '.join(doc['fields'])}\nTexto:\n{doc['text']}\n</documento>")
+    prompt = (
+        "Você é um especialista em documentos fiscais brasileiros. Documentos para refinamento: para cada documento abaixo, "
+        "extraia apenas os campos pedidos em 'Campos'.\n"
+        "Retorne um JSON no formato {\"documentos\": {\"<id>\": {<campos>}}}, com uma entrada para cada id.\n"
+        "- Use a estrutura aninhada do esquema (ex: \"emitente.cnpj\" vira {\"emitente\": {\"cnpj\": ...}}).\n"
+        "- itens é um array de objetos com descricao, quantidade, unidade, valor_unitario, valor_total, ncm, cfop, cst.\n"
+        "- Valores monetários em decimal com ponto (ex: 42.50), datas em YYYY-MM-DD, CNPJ só com dígitos.\n"
+        "- Campo não encontrado no texto: null. Não invente valores.\n\n"
+        + "\n\n".join(blocks)
+        + "\n\nResponda apenas em JSON:"
+    )
+    url = f"{OPENROUTER_BASE_URL}/chat/completions"
+    headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
+    body = {
+        "model": model_to_use,
+        "messages": [
+            {"role": "system", "content": "Você é um especialista rigoroso em documentos fiscais brasileiros."},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": 600 * len(documents),
+        "temperature": 0.0
+    }
+
+    try:
+        r = _post(url, headers, body, timeout)
+        if r is None:
+            return {'ok': False, 'reason': 'rate_limited'}
+        if r.status_code != 200:
+            return {'ok': False, 'reason': f'http_{r.status_code}', 'text': r.text[:1000]}
+        data = r.json()
+        content = None
+        if isinstance(data, dict):
+            try:
+                content = data.get('choices', [])[0].get('message', {}).get('content')
+            except Exception:
+                content = None
+        if not content:
+            return {'ok': False, 'reason': 'no_content', 'raw': data}
+
+        txt = content.strip()
+        try:
+            parsed = json.loads(txt)
+        except Exception:
+            f = txt.find('{')
+            l = txt.rfind('}')
+            try:
+                parsed = json.loads(txt[f:l+1]) if f != -1 and l > f else None
+            except Exception:
+                parsed = None
+        if not parsed or not isinstance(parsed, dict):
+            return {'ok': False, 'reason': 'parse_failed', 'raw_text': txt[:2000]}
+
+        docs = parsed.get('documentos') if isinstance(parsed.get('documentos'), dict) else parsed
+        ids = {str(doc['id']) for doc in documents}
+        results = {k: v for k, v in docs.items() if k in ids and isinstance(v, dict)}
+        return {'ok': True, 'results': results}
+    except Exception as e:
+        return {'ok': False, 'reason': 'exception', 'error': str(e)}
@@ -0,0 +1,168 @@
+"""Native parser for NF-e / NFC-e (procNFe, NFe) and CF-e SAT (CFe) XML files.
+
+The XML already carries every field the extraction prompt asks for, so it is mapped directly to
+the extraction schema (the same shape normalize_extracted produces). No LLM, merge or enrichment
+is needed:
+
+    ide/nNF, ide/dhEmi|dEmi, ide/natOp, emit, dest, det/prod + det/imposto, total/ICMSTot, pag/detPag
+
+`parse(source)` takes a path, bytes, a string or an already parsed root element. It returns None
+when the file is not an NF-e/CF-e document (any other XML), so the caller can fall back to the
+text pipeline.
+"""
+import re
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Optional
+
+# tPag (forma de pagamento) codes of the NF-e layout
+FORMAS_PAGAMENTO = {
+    '01': 'Dinheiro', '02': 'Cheque', '03': 'Cartão de Crédito', '04': 'Cartão de Débito', '05': 'Crédito Loja',
+    '10': 'Vale Alimentação', '11': 'Vale Refeição', '12': 'Vale Presente', '13': 'Vale Combustível',
+    '15': 'Boleto Bancário', '16': 'Depósito Bancário', '17': 'PIX', '18': 'Transferência bancária',
+    '19': 'Programa de fidelidade', '90': 'Sem pagamento', '99': 'Outros',
+}
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child(el: Optional[ET.Element], *path: str) -> Optional[ET.Element]:
+    """Descend by local tag names (the NF-e namespace is ignored)."""
+    for name in path:
+        if el is None:
+            return None
+        el = next((c for c in el if _local(c.tag) == name), None)
+    return el
+
+
+def _text(el: Optional[ET.Element], *path: str) -> Optional[str]:
+    node = _child(el, *path)
+    if node is None or node.text is None:
+        return None
+    return node.text.strip() or None
+
+
+def _float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def _date(value: Optional[str]) -> Optional[str]:
+    s = value or ''
+    m = re.match(r'(\d{4})-(\d{2})-(\d{2})', s)
+    if m:
+        return m.group(0)
+    m = re.match(r'(\d{4})(\d{2})(\d{2})$', s)
+    return f"{m.group(1)}-{m.group(2)}-{m.group(3)}" if m else None
+
+
+def _address(ender: Optional[ET.Element]) -> Optional[str]:
+    if ender is None:
+        return None
+    street = ', '.join(p for p in (_text(ender, 'xLgr'), _text(ender, 'nro')) if p)
+    parts = [street, _text(ender, 'xCpl'), _text(ender, 'xBairro'), _text(ender, 'xMun'), _text(ender, 'UF')]
+    return ', '.join(p for p in parts if p) or None
+
+
+def _party(el: Optional[ET.Element], address_tag: str) -> Dict[str, Any]:
+    return {
+        'razao_social': _text(el, 'xNome'),
+        'cnpj': _text(el, 'CNPJ') or _text(el, 'CPF'),
+        'inscricao_estadual': _text(el, 'IE'),
+        'endereco': _address(_child(el, address_tag)),
+    }
+
+
+def _icms_group(imposto: Optional[ET.Element]) -> Optional[ET.Element]:
+    """The ICMS00/ICMS10/.../ICMSSN102 group of an item (the only child of imposto/ICMS)."""
+    icms = _child(imposto, 'ICMS')
+    return next(iter(icms), None) if icms is not None else None
+
+
+def _items(inf: ET.Element) -> List[Dict[str, Any]]:
+    items = []
+    for det in (c for c in inf if _local(c.tag) == 'det'):
+        prod = _child(det, 'prod')
+        group = _icms_group(_child(det, 'imposto'))
+        items.append({
+            'descricao': _text(prod, 'xProd'),
+            'quantidade': _float(_text(prod, 'qCom')),
+            'unidade': _text(prod, 'uCom'),
+            'valor_unitario': _float(_text(prod, 'vUnCom')),
+            'valor_total': _float(_text(prod, 'vProd')),
+            'codigo': _text(prod, 'cProd'),
+            'ncm': _text(prod, 'NCM'),
+            'cfop': _text(prod, 'CFOP'),
+            'cst': _text(group, 'CST'),
+            'csosn': _text(group, 'CSOSN'),
+            'aliquota_icms': _float(_text(group, 'pICMS')),
+        })
+    return items
+
+
+def _root(source: Any) -> Optional[ET.Element]:
+    if isinstance(source, ET.Element):
+        return source
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            return ET.fromstring(source)
+        if isinstance(source, str) and source.lstrip().startswith('<'):
+            return ET.fromstring(source)
+        return ET.parse(source).getroot()
+    except (ET.ParseError, OSError, ValueError):
+        return None
+
+
+def parse(source: Any) -> Optional[Dict[str, Any]]:
+    """Extraction-schema dict of an NF-e/NFC-e/CF-e XML, or None for any other file."""
+    root = _root(source)
+    if root is None:
+        return None
+    inf = next((el for el in root.iter() if _local(el.tag) in ('infNFe', 'infCFe')), None)
+    if inf is None:
+        return None
+    cfe = _local(inf.tag) == 'infCFe'
+    ide = _child(inf, 'ide')
+    chave = re.sub(r'\D', '', inf.get('Id') or '') or None
+    if not chave:
+        chave = next((re.sub(r'\D', '', el.text or '') for el in root.iter() if _local(el.tag) == 'chNFe'), None) or None
+    items = _items(inf)
+    total = _child(inf, 'total', 'ICMSTot')
+    if cfe:
+        valor_total = _float(_text(inf, 'total', 'vCFe'))
+    else:
+        valor_total = _float(_text(total, 'vNF'))
+    rates = {it['aliquota_icms'] for it in items if it['aliquota_icms'] is not None}
+    tpag = None
+    pag = _child(inf, 'pag')
+    if pag is not None:
+        tpag = _text(pag, 'detPag', 'tPag') or _text(pag, 'tPag')
+    if cfe and tpag is None:
+        tpag = _text(inf, 'pgto', 'MP', 'cMP')
+    first = items[0] if items else {}
+    return {
+        'numero_nota': _text(ide, 'nCFe' if cfe else 'nNF'),
+        'chave_acesso': chave if chave and len(chave) == 44 else None,
+        'data_emissao': _date(_text(ide, 'dhEmi') or _text(ide, 'dEmi')),
+        'natureza_operacao': _text(ide, 'natOp'),
+        'forma_pagamento': FORMAS_PAGAMENTO.get(tpag, tpag),
+        'valor_total': valor_total,
+        'emitente': _party(_child(inf, 'emit'), 'enderEmit'),
+        'destinatario': _party(_child(inf, 'dest'), 'enderDest'),
+        'impostos': {
+            'icms': {
+                'aliquota': rates.pop() if len(rates) == 1 else None,
+                'base_calculo': _float(_text(total, 'vBC')),
+                'valor': _float(_text(total, 'vICMS')),
+            },
+            'ipi': {'valor': _float(_text(total, 'vIPI'))},
+            'pis': {'valor': _float(_text(total, 'vPIS'))},
+            'cofins': {'valor': _float(_text(total, 'vCOFINS'))},
+        },
+        'codigos_fiscais': {'cfop': first.get('cfop'), 'cst': first.get('cst'), 'ncm': first.get('ncm'), 'csosn': first.get('csosn')},
+        'itens': [{k: v for k, v in it.items() if k not in ('csosn', 'aliquota_icms')} for it in items],
+        '_meta': {'extraction': 'nfe_xml'},
+    }
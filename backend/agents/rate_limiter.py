@@ -0,0 +1,274 @@
+"""Token buckets for OpenRouter requests, shared by every process that uses the same file (SQLite).
+
+The free models have per-minute and per-day quotas per API key, and each model has its own
+limits upstream. The API server (one or more uvicorn workers), reprocess_all.py, enrich_db.py and
+the refinement worker used to find those limits through 429s. Every LLM request now acquires one
+token from three buckets first:
+
+- `minute:<key>`: RATE_LIMIT_PER_MINUTE requests per minute for the API key (default 20);
+- `day:<key>`: RATE_LIMIT_PER_DAY requests per day for the API key (default 0, unlimited: the
+  quota depends on the key's credits, 50 or 1000; the daily 429s and headers still block it),
+  refilled evenly over the day;
+- `model:<model>:<key>`: RATE_LIMIT_MODEL_PER_MINUTE requests per minute for each model (default 20).
+
+A limit of 0 makes a bucket unlimited. The key is stored as a short hash, never in clear.
+`acquire(model, key, timeout)` waits until the three buckets have a token, or returns False once
+`timeout` would pass first. The caller then treats the request like a 429 without sending it.
+
+`observe(model, key, status, headers, text)` adjusts the buckets from the answer:
+- X-RateLimit-Remaining caps the tokens of the window given by X-RateLimit-Reset (epoch seconds
+  or milliseconds), and 0 remaining blocks the bucket until that reset. A reset more than two
+  minutes away is the daily window. An unlimited bucket is not capped (it has no refill), only
+  blocked at 0 remaining.
+- A 429 empties a bucket until Retry-After / X-RateLimit-Reset, or RATE_LIMIT_BACKOFF_SECONDS
+  when neither is sent. A key quota ("free-models-per-min" / "-per-day", or no requests
+  remaining) blocks the key's minute or day bucket. Any other 429 (e.g. the provider is rate-limited
+  upstream) blocks that model only.
+
+The buckets live next to the JSON DB (override with RATE_LIMITS_PATH), so processes on the same
+checkout share them. RATE_LIMIT=0 disables the limiter (acquire always succeeds).
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+_DEFAULT_DB = os.environ.get('DOCUMENTS_DB_PATH') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'api', 'documents_db.json')
+RATE_LIMITS_PATH = os.environ.get('RATE_LIMITS_PATH') or os.path.join(os.path.dirname(os.path.abspath(_DEFAULT_DB)), 'rate_limits.sqlite3')
+RATE_LIMIT = os.environ.get('RATE_LIMIT', '1') != '0'
+RATE_LIMIT_PER_MINUTE = float(os.environ.get('RATE_LIMIT_PER_MINUTE', '20'))
+RATE_LIMIT_PER_DAY = float(os.environ.get('RATE_LIMIT_PER_DAY', '0'))
+RATE_LIMIT_MODEL_PER_MINUTE = float(os.environ.get('RATE_LIMIT_MODEL_PER_MINUTE', '20'))
+RATE_LIMIT_BACKOFF_SECONDS = float(os.environ.get('RATE_LIMIT_BACKOFF_SECONDS', '60'))
+# longest wait for a token in process_document before the model counts as rate limited
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get('RATE_LIMIT_MAX_WAIT_SECONDS', '15'))
+# a reset further away than this is the daily window
+_DAY_WINDOW_THRESHOLD = 120.0
+_UNLIMITED = 1e9
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is not None:
+        return _conn
+    with _lock:
+        if _conn is not None:
+            return _conn
+        conn = sqlite3.connect(RATE_LIMITS_PATH, check_same_thread=False, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS buckets ('
+            'name TEXT PRIMARY KEY, tokens REAL, capacity REAL, per_second REAL, updated REAL, blocked_until REAL)'
+        )
+        conn.execute('CREATE TABLE IF NOT EXISTS rate_limit_stats (name TEXT PRIMARY KEY, value REAL)')
+        _conn = conn
+        return _conn
+
+
+def _bump(conn: sqlite3.Connection, name: str, by: float = 1):
+    conn.execute('INSERT INTO rate_limit_stats (name, value) VALUES (?, ?) '
+                 'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value', (name, by))
+
+
+def key_id(api_key: Optional[str]) -> str:
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:12] if api_key else 'nokey'
+
+
+def _buckets(model: Optional[str], api_key: Optional[str]) -> List[Tuple[str, float, float]]:
+    """(name, capacity, refill per second) of the buckets a request to `model` draws from."""
+    k = key_id(api_key)
+    out = [
+        (f'minute:{k}', RATE_LIMIT_PER_MINUTE, RATE_LIMIT_PER_MINUTE / 60.0),
+        (f'day:{k}', RATE_LIMIT_PER_DAY, RATE_LIMIT_PER_DAY / 86400.0),
+    ]
+    if model:
+        out.append((f'model:{model}:{k}', RATE_LIMIT_MODEL_PER_MINUTE, RATE_LIMIT_MODEL_PER_MINUTE / 60.0))
+    # a limit of 0 means unlimited; such a bucket still honours the blocks set by a 429
+    return [(name, cap, rate) if cap > 0 else (name, _UNLIMITED, 0.0) for name, cap, rate in out]
+
+
+def _load(conn: sqlite3.Connection, name: str, capacity: float, per_second: float, now: float) -> Dict[str, float]:
+    row = conn.execute('SELECT tokens, updated, blocked_until FROM buckets WHERE name=?', (name,)).fetchone()
+    if row is None:
+        return {'tokens': capacity, 'blocked_until': 0.0}
+    tokens, updated, blocked_until = row
+    return {'tokens': min(capacity, tokens + max(0.0, now - updated) * per_second), 'blocked_until': blocked_until or 0.0}
+
+
+def _store(conn: sqlite3.Connection, name: str, capacity: float, per_second: float, now: float, state: Dict[str, float]):
+    conn.execute('INSERT INTO buckets (name, tokens, capacity, per_second, updated, blocked_until) VALUES (?, ?, ?, ?, ?, ?) '
+                 'ON CONFLICT(name) DO UPDATE SET tokens=excluded.tokens, capacity=excluded.capacity, '
+                 'per_second=excluded.per_second, updated=excluded.updated, blocked_until=excluded.blocked_until',
+                 (name, state['tokens'], capacity, per_second, now, state['blocked_until']))
+
+
+def _try_take(model: Optional[str], api_key: Optional[str]) -> float:
+    """Take one token from every bucket (returns 0), or return the seconds until that is possible."""
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        # BEGIN IMMEDIATE: other processes cannot take the same tokens in between
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            specs = _buckets(model, api_key)
+            states = [_load(conn, name, cap, rate, now) for name, cap, rate in specs]
+            wait = 0.0
+            for (name, cap, rate), st in zip(specs, states):
+                if st['blocked_until'] > now:
+                    wait = max(wait, st['blocked_until'] - now)
+                elif st['tokens'] < 1.0:
+                    wait = max(wait, (1.0 - st['tokens']) / rate if rate > 0 else RATE_LIMIT_BACKOFF_SECONDS)
+            if wait <= 0:
+                for (name, cap, rate), st in zip(specs, states):
+                    st['tokens'] -= 1.0
+                    _store(conn, name, cap, rate, now, st)
+                _bump(conn, 'acquired')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    return wait
+
+
+def acquire(model: Optional[str], api_key: Optional[str], timeout: Optional[float] = None) -> bool:
+    """Wait for a token for one request to `model`. False when none frees up within `timeout` seconds.
+    Never raises (a broken limiter file lets the request through)."""
+    if not RATE_LIMIT:
+        return True
+    t0 = time.monotonic()
+    while True:
+        try:
+            wait = _try_take(model, api_key)
+        except Exception as e:
+            print(f"[RATE] limiter unavailable, request not throttled: {e}", file=sys.stderr)
+            return True
+        waited = time.monotonic() - t0
+        if wait <= 0:
+            if waited > 0.01:
+                _count('waited_seconds', waited)
+            return True
+        if timeout is not None and waited + wait > timeout:
+            _count('denied')
+            return False
+        # re-check at least every second: another process may have been told a sooner reset
+        time.sleep(min(wait, 1.0))
+
+
+def _count(name: str, by: float = 1):
+    try:
+        with _lock:
+            conn = _connect()
+            _bump(conn, name, by)
+    except Exception:
+        pass
+
+
+def _header(headers: Optional[Mapping[str, Any]], name: str) -> Optional[float]:
+    if not headers:
+        return None
+    try:
+        value = headers.get(name)
+        if value is None:
+            value = next((v for k, v in headers.items() if str(k).lower() == name.lower()), None)
+        return float(value) if value not in (None, '') else None
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _reset_at(headers: Optional[Mapping[str, Any]], now: float) -> Optional[float]:
+    """Epoch seconds of the end of the rate-limit window (X-RateLimit-Reset, else Retry-After)."""
+    reset = _header(headers, 'X-RateLimit-Reset')
+    if reset is not None:
+        if reset > 1e11:  # OpenRouter sends epoch milliseconds
+            reset /= 1000.0
+        elif reset < 1e9:  # a delta in seconds
+            reset += now
+        return reset
+    retry = _header(headers, 'Retry-After')
+    return now + retry if retry is not None else None
+
+
+def observe(model: Optional[str], api_key: Optional[str], status: Optional[int],
+            headers: Optional[Mapping[str, Any]] = None, text: Optional[str] = None):
+    """Adjust the buckets from an OpenRouter answer (status code, rate-limit headers, error text)."""
+    if not RATE_LIMIT:
+        return
+    now = time.time()
+    reset = _reset_at(headers, now)
+    remaining = _header(headers, 'X-RateLimit-Remaining')
+    k = key_id(api_key)
+    low = (text or '').lower()
+    daily = (reset is not None and reset - now > _DAY_WINDOW_THRESHOLD) or 'per-day' in low
+    specs = {name: (cap, rate) for name, cap, rate in _buckets(model, api_key)}
+    target = f'day:{k}' if daily else f'minute:{k}'
+    try:
+        with _lock:
+            conn = _connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if status == 429:
+                    # a key quota blocks every model; anything else (e.g. the provider is rate-limited
+                    # upstream) only this model, so the rotation can go on with the next one
+                    key_quota = daily or 'per-min' in low or remaining == 0
+                    names = [target] if key_quota else [f'model:{model}:{k}']
+                    until = reset if reset is not None and reset > now else now + RATE_LIMIT_BACKOFF_SECONDS
+                    for name in names:
+                        if name in specs:
+                            cap, rate = specs[name]
+                            st = _load(conn, name, cap, rate, now)
+                            _store(conn, name, cap, rate, now, {'tokens': 0.0, 'blocked_until': max(st['blocked_until'], until)})
+                    _bump(conn, 'throttled_429')
+                elif remaining is not None and target in specs:
+                    cap, rate = specs[target]
+                    st = _load(conn, target, cap, rate, now)
+                    if remaining < st['tokens'] and (rate > 0 or remaining < 1):
+                        st['tokens'] = max(0.0, remaining)
+                        if remaining < 1 and reset is not None and reset > now:
+                            # the window is used up: nothing until it resets, whatever our refill rate says
+                            st['blocked_until'] = max(st['blocked_until'], reset)
+                        _store(conn, target, cap, rate, now, st)
+                        _bump(conn, 'header_adjustments')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+    except Exception as e:
+        print(f"[RATE] failed to record the rate-limit answer: {e}", file=sys.stderr)
+
+
+def stats() -> Dict[str, Any]:
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        counters = dict(conn.execute('SELECT name, value FROM rate_limit_stats').fetchall())
+        rows = conn.execute('SELECT name, tokens, capacity, per_second, updated, blocked_until FROM buckets ORDER BY name').fetchall()
+    buckets = {}
+    for name, tokens, capacity, per_second, updated, blocked_until in rows:
+        buckets[name] = {
+            'tokens': round(min(capacity, tokens + max(0.0, now - updated) * per_second), 2),
+            'capacity': capacity,
+            'blocked_for_s': round(blocked_until - now, 1) if blocked_until and blocked_until > now else 0,
+        }
+    return {
+        'enabled': RATE_LIMIT,
+        'acquired': int(counters.get('acquired', 0)),
+        'denied': int(counters.get('denied', 0)),
+        'waited_seconds': round(counters.get('waited_seconds', 0.0), 2),
+        'throttled_429': int(counters.get('throttled_429', 0)),
+        'header_adjustments': int(counters.get('header_adjustments', 0)),
+        'buckets': buckets,
+    }
+
+
+def clear():
+    with _lock:
+        conn = _connect()
+        conn.execute('DELETE FROM buckets')
+        conn.execute('DELETE FROM rate_limit_stats')
@@ -1,6 +1,308 @@
-"""Agente de Relatórios"""
+"""Agente de Relatórios
+
+Besides the CrewAI persona, this module implements the actual export used by
+`/api/v1/export`: documents are flattened (one row per document or one row per item) and
+written through generators so large stores are exported in constant memory.
+
+Supported formats: csv, jsonl, xlsx (openpyxl write-only mode) and parquet (pyarrow, written
+in row-group batches).
+"""
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
 from crewai import Agent, Task
 
+from .br_numbers import to_num
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+EXPORT_LEVELS = ('document', 'item')
+
+# (column name, type) - type is used for parquet schemas and number coercion
+DOCUMENT_FIELDS: List[Tuple[str, str]] = [
+    ('id', 'str'), ('filename', 'str'), ('uploaded_at', 'str'), ('status', 'str'),
+    ('numero_nota', 'str'), ('chave_acesso', 'str'), ('data_emissao', 'str'),
+    ('natureza_operacao', 'str'), ('forma_pagamento', 'str'),
+    ('valor_total', 'float'), ('valor_total_calc', 'float'),
+    ('emitente_razao_social', 'str'), ('emitente_cnpj', 'str'), ('emitente_inscricao_estadual', 'str'), ('emitente_endereco', 'str'),
+    ('destinatario_razao_social', 'str'), ('destinatario_cnpj', 'str'), ('destinatario_inscricao_estadual', 'str'), ('destinatario_endereco', 'str'),
+    ('icms_aliquota', 'float'), ('icms_base_calculo', 'float'), ('icms_valor', 'float'),
+    ('ipi_valor', 'float'), ('pis_valor', 'float'), ('cofins_valor', 'float'),
+    ('cfop', 'str'), ('cst', 'str'), ('ncm', 'str'), ('csosn', 'str'),
+    ('itens_count', 'int'),
+]
+ITEM_FIELDS: List[Tuple[str, str]] = [
+    ('doc_id', 'str'), ('filename', 'str'), ('numero_nota', 'str'), ('data_emissao', 'str'),
+    ('emitente_cnpj', 'str'), ('emitente_razao_social', 'str'),
+    ('item_idx', 'int'), ('codigo', 'str'), ('descricao', 'str'), ('quantidade', 'float'), ('unidade', 'str'),
+    ('valor_unitario', 'float'), ('valor_total', 'float'), ('ncm', 'str'), ('cfop', 'str'), ('cst', 'str'),
+]
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def _to_str(x) -> Optional[str]:
+    if x is None:
+        return None
+    if isinstance(x, (dict, list)):
+        return json.dumps(x, ensure_ascii=False)
+    return str(x)
+
+
+def _coerce(row: Dict[str, Any], fields: List[Tuple[str, str]]) -> Dict[str, Any]:
+    out = {}
+    for name, typ in fields:
+        v = row.get(name)
+        if typ == 'float':
+            out[name] = to_num(v)
+        elif typ == 'int':
+            try:
+                out[name] = int(v) if v is not None else None
+            except Exception:
+                out[name] = None
+        else:
+            out[name] = _to_str(v)
+    return out
+
+
+def _sub(d: Any, key: str) -> Dict[str, Any]:
+    v = d.get(key) if isinstance(d, dict) else None
+    return v if isinstance(v, dict) else {}
+
+
+def flatten_document(doc_id: str, rec: Dict[str, Any]) -> Dict[str, Any]:
+    """One flat row per document (see DOCUMENT_FIELDS)."""
+    ed = rec.get('extracted_data') if isinstance(rec.get('extracted_data'), dict) else {}
+    emit = _sub(ed, 'emitente')
+    dest = _sub(ed, 'destinatario')
+    imp = _sub(ed, 'impostos')
+    cf = _sub(ed, 'codigos_fiscais')
+    row = {
+        'id': doc_id,
+        'filename': rec.get('filename'),
+        'uploaded_at': rec.get('uploaded_at'),
+        'status': rec.get('status'),
+        'valor_total_calc': _sub(rec, 'aggregates').get('valor_total_calc'),
+        'icms_aliquota': _sub(imp, 'icms').get('aliquota'),
+        'icms_base_calculo': _sub(imp, 'icms').get('base_calculo'),
+        'icms_valor': _sub(imp, 'icms').get('valor'),
+        'ipi_valor': _sub(imp, 'ipi').get('valor'),
+        'pis_valor': _sub(imp, 'pis').get('valor'),
+        'cofins_valor': _sub(imp, 'cofins').get('valor'),
+        'itens_count': len(ed.get('itens') or []) if isinstance(ed.get('itens'), list) else 0,
+    }
+    for k in ('numero_nota', 'chave_acesso', 'data_emissao', 'natureza_operacao', 'forma_pagamento', 'valor_total'):
+        row[k] = ed.get(k)
+    for prefix, party in (('emitente', emit), ('destinatario', dest)):
+        for k in ('razao_social', 'cnpj', 'inscricao_estadual', 'endereco'):
+            row[f'{prefix}_{k}'] = party.get(k)
+    for k in ('cfop', 'cst', 'ncm', 'csosn'):
+        row[k] = cf.get(k)
+    return _coerce(row, DOCUMENT_FIELDS)
+
+
+def flatten_items(doc_id: str, rec: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """One flat row per item (see ITEM_FIELDS); document codes fill missing item codes."""
+    ed = rec.get('extracted_data') if isinstance(rec.get('extracted_data'), dict) else {}
+    emit = _sub(ed, 'emitente')
+    cf = _sub(ed, 'codigos_fiscais')
+    itens = ed.get('itens') if isinstance(ed.get('itens'), list) else []
+    for idx, it in enumerate(itens):
+        if not isinstance(it, dict):
+            continue
+        row = {
+            'doc_id': doc_id,
+            'filename': rec.get('filename'),
+            'numero_nota': ed.get('numero_nota'),
+            'data_emissao': ed.get('data_emissao'),
+            'emitente_cnpj': emit.get('cnpj'),
+            'emitente_razao_social': emit.get('razao_social'),
+            'item_idx': idx,
+        }
+        for k in ('codigo', 'descricao', 'quantidade', 'unidade', 'valor_unitario', 'valor_total'):
+            row[k] = it.get(k)
+        for k in ('ncm', 'cfop', 'cst'):
+            row[k] = it.get(k) or cf.get(k)
+        yield _coerce(row, ITEM_FIELDS)
+
+
+def _matches(rec: Dict[str, Any], status: Optional[str], cnpj: Optional[str], date_from: Optional[str], date_to: Optional[str]) -> bool:
+    if status and rec.get('status') != status:
+        return False
+    ed = rec.get('extracted_data') if isinstance(rec.get('extracted_data'), dict) else {}
+    if cnpj:
+        want = re.sub(r'\D', '', cnpj)
+        have = re.sub(r'\D', '', str(_sub(ed, 'emitente').get('cnpj') or ''))
+        if want != have:
+            return False
+    if date_from or date_to:
+        # data_emissao is normalized to YYYY-MM-DD, so string comparison is chronological
+        d = ed.get('data_emissao')
+        if not d:
+            return False
+        d = str(d)[:10]
+        if date_from and d < date_from:
+            return False
+        if date_to and d > date_to:
+            return False
+    return True
+
+
+def iter_export_rows(store: Dict[str, Dict[str, Any]], level: str = 'document', status: Optional[str] = None,
+                     cnpj: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Yield flattened rows from `store` one record at a time.
+
+    Only the id list is snapshotted up front; records are read lazily so that a concurrent
+    upload does not break the iteration and memory stays bounded.
+    """
+    for doc_id in list(store.keys()):
+        rec = store.get(doc_id)
+        if not isinstance(rec, dict) or not _matches(rec, status, cnpj, date_from, date_to):
+            continue
+        if level == 'item':
+            yield from flatten_items(doc_id, rec)
+        else:
+            yield flatten_document(doc_id, rec)
+
+
+def fields_for(level: str) -> List[Tuple[str, str]]:
+    return ITEM_FIELDS if level == 'item' else DOCUMENT_FIELDS
+
+
+def check_format(fmt: str):
+    """Raise ValueError/RuntimeError before streaming starts (status codes cannot change afterwards)."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato não suportado: {fmt}. Use um de {sorted(EXPORT_FORMATS)}")
+    if fmt == 'xlsx':
+        try:
+            import openpyxl  # noqa: F401
+        except Exception:
+            raise RuntimeError('openpyxl não está instalado (pip install openpyxl)')
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+            import pyarrow.parquet  # noqa: F401
+        except Exception:
+            raise RuntimeError('pyarrow não está instalado (pip install pyarrow)')
+
+
+def stream_csv(rows: Iterable[Dict[str, Any]], fields: List[Tuple[str, str]]) -> Iterator[bytes]:
+    names = [n for n, _ in fields]
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=names, extrasaction='ignore')
+    # BOM so Excel opens accented text correctly
+    buf.write('\ufeff')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= _CHUNK_SIZE:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode('utf-8')
+
+
+def stream_jsonl(rows: Iterable[Dict[str, Any]], fields: List[Tuple[str, str]]) -> Iterator[bytes]:
+    chunk = []
+    size = 0
+    for row in rows:
+        line = json.dumps(row, ensure_ascii=False) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= _CHUNK_SIZE:
+            yield ''.join(chunk).encode('utf-8')
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
+
+
+def _stream_file(path: str) -> Iterator[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(_CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+    finally:
+        try:
+            os.remove(path)
+        except Exception:
+            pass
+
+
+def stream_xlsx(rows: Iterable[Dict[str, Any]], fields: List[Tuple[str, str]]) -> Iterator[bytes]:
+    """openpyxl write-only mode streams rows to its own temp storage, so memory does not grow
+    with the row count. The finished zip is then streamed back from a temp file."""
+    from openpyxl import Workbook
+    names = [n for n, _ in fields]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('export')
+    ws.append(names)
+    for row in rows:
+        ws.append([row.get(n) for n in names])
+    fd, tmp = tempfile.mkstemp(prefix='export_', suffix='.xlsx')
+    os.close(fd)
+    try:
+        wb.save(tmp)
+    except Exception:
+        os.remove(tmp)
+        raise
+    yield from _stream_file(tmp)
+
+
+def stream_parquet(rows: Iterable[Dict[str, Any]], fields: List[Tuple[str, str]], batch_size: int = 5000) -> Iterator[bytes]:
+    """Write rows in row groups of `batch_size` so only one batch is held in memory."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    types = {'str': pa.string(), 'float': pa.float64(), 'int': pa.int64()}
+    schema = pa.schema([(n, types[t]) for n, t in fields])
+    names = [n for n, _ in fields]
+    fd, tmp = tempfile.mkstemp(prefix='export_', suffix='.parquet')
+    os.close(fd)
+    try:
+        with pq.ParquetWriter(tmp, schema) as writer:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                    batch = []
+            if batch:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+    except Exception:
+        os.remove(tmp)
+        raise
+    yield from _stream_file(tmp)
+
+
+_WRITERS = {
+    'csv': stream_csv,
+    'jsonl': stream_jsonl,
+    'xlsx': stream_xlsx,
+    'parquet': stream_parquet,
+}
+
+
+def export_stream(store: Dict[str, Dict[str, Any]], fmt: str = 'csv', level: str = 'document', **filters) -> Iterator[bytes]:
+    """Generator of encoded chunks for `fmt`, reading `store` lazily."""
+    check_format(fmt)
+    if level not in EXPORT_LEVELS:
+        raise ValueError(f"Nível não suportado: {level}. Use um de {list(EXPORT_LEVELS)}")
+    rows = iter_export_rows(store, level=level, **filters)
+    return _WRITERS[fmt](rows, fields_for(level))
+
+
 class ReportingAgent:
     def __init__(self, llm):
         self.llm = llm
@@ -21,3 +323,6 @@ class ReportingAgent:
             agent=self.agent,
             expected_output="Exported files and integration status"
         )
+
+    def export(self, store, fmt: str = 'csv', level: str = 'document', **filters):
+        return export_stream(store, fmt=fmt, level=level, **filters)
@@ -3,34 +3,22 @@ Specialist agent for invoices: tries to recover structured item lines and altern
 from OCR/raw_extracted when normalization failed.
 
 Provides:
-- refine_extracted(record, extracted) -> (extracted_updated, notes)
+- refine_extracted(record, extracted, ctx=None, deadline=None) -> (extracted_updated, notes)
 
 This agent focuses on heuristics specific to Brazilian NF-e/DANFE layouts and common cupom formats.
 """
 import re
 from typing import Dict, Any, List, Tuple, Optional
-import json
+
+try:
+    from . import llm_fanout, text_context
+except ImportError:
+    # loaded as a standalone module (scripts/test_specialist_agent.py)
+    from backend.agents import llm_fanout, text_context
 
 
 def _text_sources(record: Dict[str, Any]) -> str:
-    parts = []
-    if isinstance(record.get('raw_extracted'), dict):
-        try:
-            parts.append(json.dumps(record.get('raw_extracted'), ensure_ascii=False))
-        except Exception:
-            parts.append(str(record.get('raw_extracted')))
-    elif record.get('raw_extracted'):
-        parts.append(str(record.get('raw_extracted')))
-    if record.get('ocr_text'):
-        parts.append(record.get('ocr_text'))
-    if record.get('raw_file'):
-        parts.append(str(record.get('raw_file')))
-    if record.get('extracted_data') and isinstance(record.get('extracted_data'), dict):
-        try:
-            parts.append(json.dumps(record.get('extracted_data'), ensure_ascii=False))
-        except Exception:
-            parts.append(str(record.get('extracted_data')))
-    return "\n".join([p for p in parts if p])
+    return text_context.build_text_sources(record)
 
 
 # NOTE: removed a malformed/duplicated implementation of _extract_address_parts that
@@ -216,26 +204,24 @@ def _parse_money_token(tok: str) -> Optional[float]:
 
 
 def _find_product_section_lines(text: str) -> List[str]:
-    markers = [r'DADOS DO PRODUTO', r'DADOS DO PRODUTO/SERVI\xC3\x87O', r'DESCRI\xC3\x87\xC3\x83O DOS PRODUTOS', r'DADOS DO PRODUTO']
-    low = text
-    for m in markers:
-        i = low.find(m)
-        if i != -1:
-            lines = low[i:].splitlines()
-            return [l.strip() for l in lines[1:41] if l.strip()]
-    lines = [l.strip() for l in text.splitlines() if l.strip()]
-    return lines[-80:]
-
-
-def _extract_codes_with_llm(text: str) -> Dict[str, Optional[str]]:
-    """Extract fiscal codes using LLM first, then regex fallback."""
+    return text_context.find_product_section_lines(text)
+
+
+def _extract_codes_with_llm(text: str, llm_results: Optional[Dict[str, Optional[Dict[str, Any]]]] = None) -> Dict[str, Optional[str]]:
+    """Extract fiscal codes using LLM first, then regex fallback.
+
+    `llm_results` maps code name -> an already collected extract_field_with_llm result; codes
+    missing from it (or None) are asked here.
+    """
     codes = {'ncm': None, 'cfop': None, 'cst': None, 'csosn': None}
     
     # Try LLM for each code
     try:
         from . import llm_helper
         for code_name in codes.keys():
-            result = llm_helper.extract_field_with_llm(code_name, text)
+            result = (llm_results or {}).get(code_name)
+            if result is None:
+                result = llm_helper.extract_field_with_llm(code_name, text)
             if result.get('ok') and result.get('value') and result.get('confidence', 0) >= 0.6:
                 codes[code_name] = result.get('value')
     except Exception:
@@ -265,11 +251,14 @@ def _extract_codes_with_llm(text: str) -> Dict[str, Optional[str]]:
     return codes
 
 
-def _extract_items_with_llm(text: str) -> List[Dict[str, Any]]:
-    """Extract items using LLM first, then heuristic fallback."""
+def _extract_items_with_llm(text: str, llm_result: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Extract items using LLM first, then heuristic fallback (`llm_result`: an already collected
+    extract_items_with_llm result)."""
     try:
-        from . import llm_helper
-        result = llm_helper.extract_items_with_llm(text)
+        result = llm_result
+        if result is None:
+            from . import llm_helper
+            result = llm_helper.extract_items_with_llm(text)
         if result.get('ok') and result.get('items') and result.get('confidence', 0) >= 0.6:
             items = result.get('items', [])
             # Normalize LLM items to our schema
@@ -410,15 +399,25 @@ def _extract_items_from_lines(lines: List[str]) -> List[Dict[str, Any]]:
     return items
 
 
-def refine_extracted(record: Dict[str, Any], extracted: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+def refine_extracted(record: Dict[str, Any], extracted: Dict[str, Any], ctx: Optional['text_context.RecordTextContext'] = None, deadline=None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     """Attempt to improve extracted dict by finding missing items, descriptions and codes.
     Now uses LLM-first approach before falling back to regex.
 
+    `ctx` is the RecordTextContext built by enrichment_agent for the same record, if any.
+    `deadline` (api.budget.Deadline, or the one already on `ctx`) skips the LLM lookups when the
+    document budget is too small.
+
     Returns (updated_extracted, notes)
     notes contains 'filled' dict similar to enrichment_agent.report['filled'] and 'notes' list.
     """
     notes = {'filled': {}, 'notes': []}
-    text = _text_sources(record)
+    ctx = text_context.RecordTextContext.for_record(record, ctx)
+    if deadline is not None and ctx.deadline is None:
+        ctx.deadline = deadline
+    if ctx.llm is None and ctx.deadline is not None and llm_fanout.llm_configured() and not ctx.deadline.allows('specialist_llm'):
+        ctx.deadline.skip('specialist_llm')
+        ctx.llm = llm_fanout.LLMFanout.skipped('budget')
+    text = ctx.text
 
     # ensure extracted structure
     if not isinstance(extracted, dict):
@@ -429,7 +428,7 @@ def refine_extracted(record: Dict[str, Any], extracted: Dict[str, Any]) -> Tuple
         existing_items = extracted.get('itens') if isinstance(extracted.get('itens'), list) else []
         
         # Try LLM extraction first
-        llm_items = _extract_items_with_llm(text)
+        llm_items = _extract_items_with_llm(text, ctx.llm.result('itens') if ctx.llm else None)
         
         if existing_items:
             # Merge LLM items with existing items
@@ -458,7 +457,7 @@ def refine_extracted(record: Dict[str, Any], extracted: Dict[str, Any]) -> Tuple
 
         # Extract fiscal codes using LLM first
         cf = extracted.get('codigos_fiscais') if isinstance(extracted.get('codigos_fiscais'), dict) else {}
-        llm_codes = _extract_codes_with_llm(text)
+        llm_codes = _extract_codes_with_llm(text, {c: ctx.llm.result(c) for c in ('ncm', 'cfop', 'cst', 'csosn')} if ctx.llm else None)
         
         for code_name, code_value in llm_codes.items():
             if code_value and not cf.get(code_name):
@@ -475,7 +474,7 @@ def refine_extracted(record: Dict[str, Any], extracted: Dict[str, Any]) -> Tuple
         # Fallback to original regex-based extraction
         existing_items = extracted.get('itens') if isinstance(extracted.get('itens'), list) else []
         recovered = []
-        lines = _find_product_section_lines(text)
+        lines = ctx.product_lines
         cand = _extract_items_from_lines(lines)
         if existing_items:
             for idx, it in enumerate(existing_items):
@@ -539,6 +538,9 @@ def refine_extracted(record: Dict[str, Any], extracted: Dict[str, Any]) -> Tuple
         for party in ('emitente', 'destinatario'):
             if not isinstance(extracted.get(party), dict):
                 continue
+            # parts already known (e.g. filled from the supplier registry): nothing to parse
+            if all(extracted[party].get(k) for k in ('cep', 'uf', 'municipio', 'bairro')):
+                continue
             addr = extracted[party].get('endereco') or ''
             if addr and isinstance(addr, str) and addr.strip():
                 parts = _extract_address_parts(addr)
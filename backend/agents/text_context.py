@@ -0,0 +1,125 @@
+"""Per-record text context shared by enrichment_agent and specialist_agent.
+
+Both agents search the same concatenation of a record's text sources (raw_extracted JSON,
+ocr_text, raw_file, extracted_data JSON). Building it means two `json.dumps` calls plus copying
+`raw_file`, which for uploads is the whole file decoded as latin-1. A `RecordTextContext` builds
+the text, its lines, the field scan and the product section once and caches them, so
+`enrich_record` -> `refine_extracted` (and `merge_extracted_sources` in main) share the work.
+
+Binary `raw_file` content (PDFs, images) is left out: it only added noise and false matches to
+the regex heuristics. Its readable text already reaches the record as `ocr_text`.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from . import field_scanner
+
+_PRODUCT_MARKERS = [r'DADOS DO PRODUTO', r'DADOS DO PRODUTO/SERVI\xC3\x87O', r'DESCRI\xC3\x87\xC3\x83O DOS PRODUTOS', r'DADOS DO PRODUTO']
+_BINARY_SIGNATURES = ('%PDF', '\xff\xd8\xff', '\x89PNG', 'GIF8', 'II*\x00', 'MM\x00*', 'PK\x03\x04')
+
+
+def is_binary_text(s: str, sample: int = 4096) -> bool:
+    """True when `s` looks like a binary file decoded as text (known magic or many control chars)."""
+    if not s:
+        return False
+    if s.startswith(_BINARY_SIGNATURES):
+        return True
+    head = s[:sample]
+    if '\x00' in head:
+        return True
+    ctrl = sum(1 for ch in head if ch < ' ' and ch not in '\r\n\t\f')
+    return ctrl > len(head) * 0.1
+
+
+def build_text_sources(record: Dict[str, Any]) -> str:
+    parts = []
+    if isinstance(record.get('raw_extracted'), dict):
+        try:
+            parts.append(json.dumps(record.get('raw_extracted'), ensure_ascii=False))
+        except Exception:
+            parts.append(str(record.get('raw_extracted')))
+    elif record.get('raw_extracted'):
+        parts.append(str(record.get('raw_extracted')))
+
+    if record.get('ocr_text'):
+        parts.append(record.get('ocr_text'))
+
+    raw_file = record.get('raw_file')
+    if raw_file:
+        raw_file = str(raw_file)
+        if not is_binary_text(raw_file):
+            parts.append(raw_file)
+
+    if record.get('extracted_data') and isinstance(record.get('extracted_data'), dict):
+        try:
+            parts.append(json.dumps(record.get('extracted_data'), ensure_ascii=False))
+        except Exception:
+            parts.append(str(record.get('extracted_data')))
+
+    return "\n".join([p for p in parts if p])
+
+
+def find_product_section_lines(text: str, lines: Optional[List[str]] = None) -> List[str]:
+    """Up to 40 lines after the DANFE product header, else the last 80 non-empty lines."""
+    for m in _PRODUCT_MARKERS:
+        i = text.find(m)
+        if i != -1:
+            section = text[i:].splitlines()
+            return [l.strip() for l in section[1:41] if l.strip()]
+    if lines is None:
+        lines = [l.strip() for l in text.splitlines() if l.strip()]
+    return lines[-80:]
+
+
+class RecordTextContext:
+    """Lazily built, cached text views of one record.
+
+    The context snapshots the record's sources on first use; build a new one if the record's
+    raw_extracted/ocr_text/raw_file/extracted_data change.
+    """
+
+    def __init__(self, record: Dict[str, Any]):
+        self.record = record if isinstance(record, dict) else {}
+        self._text: Optional[str] = None
+        self._scan: Optional[field_scanner.ScanResult] = None
+        self._lines: Optional[List[str]] = None
+        self._product_lines: Optional[List[str]] = None
+        # llm_fanout.LLMFanout with this record's in-flight LLM lookups (set by enrich_record)
+        self.llm = None
+        # the document's latency budget (api.budget.Deadline), when running inside process_document
+        self.deadline = None
+
+    @classmethod
+    def for_record(cls, record: Dict[str, Any], ctx: Optional['RecordTextContext'] = None) -> 'RecordTextContext':
+        """Reuse `ctx` when it was built for this same record object, otherwise build a new one."""
+        if ctx is not None and ctx.record is record:
+            return ctx
+        return cls(record)
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = build_text_sources(self.record)
+        return self._text
+
+    @property
+    def scan(self) -> field_scanner.ScanResult:
+        if self._scan is None:
+            self._scan = field_scanner.scan(self.text)
+        return self._scan
+
+    @property
+    def lines(self) -> List[str]:
+        """Stripped, non-empty lines of `text`."""
+        if self._lines is None:
+            if self._scan is not None:
+                self._lines = self._scan.lines
+            else:
+                self._lines = [l.strip() for l in self.text.splitlines() if l.strip()]
+        return self._lines
+
+    @property
+    def product_lines(self) -> List[str]:
+        if self._product_lines is None:
+            self._product_lines = find_product_section_lines(self.text, self.lines)
+        return self._product_lines
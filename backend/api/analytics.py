@@ -0,0 +1,330 @@
+"""Columnar analytics over the document store.
+
+Materializes two pandas frames from `persistence.documents_db`:
+- docs: one row per document (declared total, computed total, taxes, emitente, CFOP/NCM, month)
+- items: one row per item (doc_id, descricao, valor_total, NCM/CFOP with document-level fallback)
+
+Rows are cached per document and only rebuilt for records whose `extracted_data`/`aggregates`
+objects were replaced (every writer in main.py assigns fresh dicts), so refreshing the frames after
+a few uploads does not re-parse the whole corpus. Group-by queries then run vectorized in pandas.
+"""
+import re
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# numpy/pandas are imported on first use (_require_pandas) so that importing the API stays fast;
+# so is agents/br_numbers.to_num (the agents package pulls in crewai)
+np = None
+pd = None
+_to_num = None
+
+
+def _require_pandas():
+    global np, pd, _to_num
+    if pd is None:
+        try:
+            import numpy
+            import pandas
+        except Exception as e:
+            raise RuntimeError('pandas/numpy are required for analytics (pip install pandas numpy)') from e
+        np, pd = numpy, pandas
+    if _to_num is None:
+        try:
+            from backend.agents.br_numbers import to_num
+        except ImportError:
+            # API launched from backend/ (uvicorn api.main:app)
+            from agents.br_numbers import to_num
+        _to_num = to_num
+
+DOC_COLUMNS = [
+    'doc_id', 'status', 'uploaded_at', 'month', 'emitente_cnpj', 'emitente_razao_social',
+    'cfop', 'ncm', 'valor_total', 'valor_total_calc', 'items_sum', 'items_count',
+    'icms', 'ipi', 'pis', 'cofins',
+]
+ITEM_COLUMNS = [
+    'doc_id', 'item_idx', 'month', 'emitente_cnpj', 'descricao', 'quantidade',
+    'valor_unitario', 'valor_total', 'ncm', 'cfop',
+]
+TAX_COLUMNS = ['icms', 'ipi', 'pis', 'cofins']
+GROUP_KEYS = {
+    'emitente': 'emitente_cnpj',
+    'cfop': 'cfop',
+    'ncm': 'ncm',
+    'month': 'month',
+}
+
+
+def _tax_value(impostos: Dict[str, Any], name: str) -> Optional[float]:
+    v = impostos.get(name)
+    if isinstance(v, dict):
+        v = v.get('valor')
+    return _to_num(v)
+
+
+def _month_of(extracted: Dict[str, Any], record: Dict[str, Any]) -> Optional[str]:
+    d = extracted.get('data_emissao') or record.get('uploaded_at')
+    if not d:
+        return None
+    s = str(d)
+    m = re.match(r'(\d{4})-(\d{2})', s)
+    if m:
+        return f"{m.group(1)}-{m.group(2)}"
+    m2 = re.match(r'\d{2}/(\d{2})/(\d{4})', s)
+    if m2:
+        return f"{m2.group(2)}-{m2.group(1)}"
+    return None
+
+
+def _code(value) -> Optional[str]:
+    if value is None:
+        return None
+    s = re.sub(r'\D', '', str(value))
+    return s or None
+
+
+def _rows_for_record(doc_id: str, record: Dict[str, Any]) -> Tuple[tuple, List[tuple]]:
+    """Flatten one stored record into a document row and its item rows."""
+    ed = record.get('extracted_data') if isinstance(record.get('extracted_data'), dict) else {}
+    ag = record.get('aggregates') if isinstance(record.get('aggregates'), dict) else {}
+    emit = ed.get('emitente') if isinstance(ed.get('emitente'), dict) else {}
+    cf = ed.get('codigos_fiscais') if isinstance(ed.get('codigos_fiscais'), dict) else {}
+    month = _month_of(ed, record)
+    cnpj = _code(emit.get('cnpj'))
+    doc_cfop = _code(cf.get('cfop'))
+    doc_ncm = _code(cf.get('ncm'))
+
+    # taxes: prefer persisted aggregates (already coerced), fall back to the extracted block
+    imp_calc = ag.get('impostos_calc') if isinstance(ag.get('impostos_calc'), dict) else None
+    impostos = ed.get('impostos') if isinstance(ed.get('impostos'), dict) else {}
+    taxes = []
+    for name in TAX_COLUMNS:
+        v = _to_num(imp_calc.get(name)) if imp_calc else None
+        if v is None:
+            v = _tax_value(impostos, name)
+        taxes.append(v if v is not None else 0.0)
+
+    items = []
+    items_sum = 0.0
+    items_count = 0
+    for idx, it in enumerate(ed.get('itens') or []):
+        if not isinstance(it, dict):
+            continue
+        vt = _to_num(it.get('valor_total'))
+        if vt is not None:
+            items_sum += vt
+            items_count += 1
+        items.append((
+            doc_id, idx, month, cnpj, it.get('descricao'), _to_num(it.get('quantidade')),
+            _to_num(it.get('valor_unitario')), vt,
+            _code(it.get('ncm')) or doc_ncm, _code(it.get('cfop')) or doc_cfop,
+        ))
+
+    doc_row = (
+        doc_id, record.get('status'), record.get('uploaded_at'), month, cnpj, emit.get('razao_social'),
+        doc_cfop, doc_ncm, _to_num(ed.get('valor_total')), _to_num(ag.get('valor_total_calc')),
+        items_sum if items_count else None, items_count, *taxes,
+    )
+    return doc_row, items
+
+
+class CorpusFrame:
+    """Incrementally maintained columnar view of the document store."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # doc_id -> (status, extracted_data obj, aggregates obj, doc_row, item_rows).
+        # Holding the dict objects keeps identity comparisons valid (ids cannot be recycled).
+        self._rows: Dict[str, tuple] = {}
+        self._docs = None
+        self._items = None
+        self._dirty = True
+
+    def invalidate(self, doc_id: Optional[str] = None):
+        with self._lock:
+            if doc_id is None:
+                self._rows.clear()
+            else:
+                self._rows.pop(doc_id, None)
+            self._dirty = True
+
+    def refresh(self, store: Dict[str, Dict[str, Any]]) -> int:
+        """Re-flatten records that changed since the last refresh. Returns how many were rebuilt."""
+        _require_pandas()
+        with self._lock:
+            snapshot = list(store.items())
+            seen = set()
+            changed = []
+            for doc_id, rec in snapshot:
+                if not isinstance(rec, dict):
+                    continue
+                seen.add(doc_id)
+                ed = rec.get('extracted_data')
+                ag = rec.get('aggregates')
+                status = rec.get('status')
+                cached = self._rows.get(doc_id)
+                if cached is not None and cached[0] == status and cached[1] is ed and cached[2] is ag:
+                    continue
+                try:
+                    doc_row, item_rows = _rows_for_record(doc_id, rec)
+                except Exception as e:
+                    print(f"[ANALYTICS] failed to flatten {doc_id}: {e}", file=sys.stderr)
+                    continue
+                self._rows[doc_id] = (status, ed, ag, doc_row, item_rows)
+                changed.append(doc_id)
+            removed = [k for k in self._rows if k not in seen]
+            for k in removed:
+                self._rows.pop(k, None)
+            if self._dirty or self._docs is None or len(changed) + len(removed) > len(self._rows) // 4:
+                self._build_frames()
+            elif changed or removed:
+                self._patch_frames(changed, removed)
+        return len(changed)
+
+    def _frames_from(self, entries):
+        doc_rows = []
+        item_rows = []
+        for entry in entries:
+            doc_rows.append(entry[3])
+            item_rows.extend(entry[4])
+        docs = pd.DataFrame.from_records(doc_rows, columns=DOC_COLUMNS)
+        items = pd.DataFrame.from_records(item_rows, columns=ITEM_COLUMNS)
+        for col in ['valor_total', 'valor_total_calc', 'items_sum'] + TAX_COLUMNS:
+            docs[col] = pd.to_numeric(docs[col], errors='coerce').astype('float64')
+        docs['items_count'] = docs['items_count'].astype('int64')
+        for col in ['quantidade', 'valor_unitario', 'valor_total']:
+            items[col] = pd.to_numeric(items[col], errors='coerce').astype('float64')
+        items['item_idx'] = items['item_idx'].astype('int64')
+        return docs, items
+
+    def _build_frames(self):
+        self._docs, self._items = self._frames_from(self._rows.values())
+        self._dirty = False
+
+    def _patch_frames(self, changed: List[str], removed: List[str]):
+        """Replace only the rows of changed/removed documents (small incremental updates)."""
+        drop = set(changed) | set(removed)
+        docs = self._docs[~self._docs['doc_id'].isin(drop)]
+        items = self._items[~self._items['doc_id'].isin(drop)]
+        new_docs, new_items = self._frames_from(self._rows[k] for k in changed)
+        self._docs = pd.concat([docs, new_docs], ignore_index=True) if len(new_docs) else docs.reset_index(drop=True)
+        self._items = pd.concat([items, new_items], ignore_index=True) if len(new_items) else items.reset_index(drop=True)
+
+    @property
+    def docs(self):
+        return self._docs
+
+    @property
+    def items(self):
+        return self._items
+
+    # --- queries -------------------------------------------------------------------------
+
+    def summary(self, status: Optional[str] = None) -> Dict[str, Any]:
+        """Dashboard totals: document count, summed totals and taxes."""
+        docs = self._filter_status(self._docs, status)
+        taxes = docs[TAX_COLUMNS].sum()
+        return {
+            'documents': int(len(docs)),
+            'valor_total': float(docs['valor_total_calc'].fillna(docs['valor_total']).fillna(0.0).sum()),
+            'impostos': {k: float(taxes[k]) for k in TAX_COLUMNS},
+            'impostos_total': float(taxes.sum()),
+            'by_status': {str(k): int(v) for k, v in self._docs['status'].value_counts().items()},
+        }
+
+    def tax_totals(self, by: str = 'emitente', status: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Tax totals grouped by emitente CNPJ, CFOP, NCM or month.
+
+        CFOP/NCM are attributed per document (document-level codes), so a document is
+        counted once in its group; use `item_totals` for item-level attribution.
+        """
+        key = GROUP_KEYS.get(by)
+        if key is None:
+            raise ValueError(f"unsupported group key '{by}', use one of {sorted(GROUP_KEYS)}")
+        docs = self._filter_status(self._docs, status)
+        # same document total as summary(): the computed total, else the declared one
+        docs = docs.assign(valor_total_doc=docs['valor_total_calc'].fillna(docs['valor_total']))
+        grouped = docs.groupby(key, observed=True, dropna=True).agg(
+            documents=('doc_id', 'size'),
+            valor_total=('valor_total_doc', 'sum'),
+            icms=('icms', 'sum'),
+            ipi=('ipi', 'sum'),
+            pis=('pis', 'sum'),
+            cofins=('cofins', 'sum'),
+        )
+        grouped['impostos_total'] = grouped[TAX_COLUMNS].sum(axis=1)
+        grouped = grouped.sort_values('impostos_total', ascending=False)
+        if by == 'emitente':
+            names = (docs.dropna(subset=['emitente_razao_social'])
+                     .drop_duplicates('emitente_cnpj', keep='last')
+                     .set_index('emitente_cnpj')['emitente_razao_social'])
+            grouped['razao_social'] = names.reindex(grouped.index).astype(object)
+        if limit:
+            grouped = grouped.head(int(limit))
+        return self._records(grouped.reset_index().rename(columns={key: by}))
+
+    def item_totals(self, by: str = 'ncm', limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Item value totals grouped by NCM, CFOP, emitente or month (item-level attribution)."""
+        key = GROUP_KEYS.get(by)
+        if key is None:
+            raise ValueError(f"unsupported group key '{by}', use one of {sorted(GROUP_KEYS)}")
+        grouped = self._items.groupby(key, observed=True, dropna=True).agg(
+            items=('item_idx', 'size'),
+            documents=('doc_id', 'nunique'),
+            valor_total=('valor_total', 'sum'),
+        ).sort_values('valor_total', ascending=False)
+        if limit:
+            grouped = grouped.head(int(limit))
+        return self._records(grouped.reset_index().rename(columns={key: by}))
+
+    def discrepancies(self, tolerance: float = 0.5, min_ratio: float = 0.0, limit: Optional[int] = 100) -> Dict[str, Any]:
+        """Documents whose item sum differs from the declared valor_total by more than `tolerance`
+        (absolute, BRL) and `min_ratio` (relative to the declared total).
+
+        Returns {'count': total matches, 'documents': the `limit` largest differences}.
+        """
+        docs = self._docs
+        mask = docs['items_sum'].notna() & docs['valor_total'].notna()
+        sub = docs.loc[mask, ['doc_id', 'status', 'emitente_cnpj', 'emitente_razao_social',
+                              'valor_total', 'items_sum', 'items_count']].copy()
+        diff = sub['items_sum'] - sub['valor_total']
+        abs_diff = diff.abs()
+        denom = sub['valor_total'].abs().replace(0.0, np.nan)
+        ratio = (abs_diff / denom).fillna(np.inf)
+        keep = (abs_diff > tolerance) & (ratio >= min_ratio)
+        sub = sub.loc[keep]
+        sub['diferenca'] = diff.loc[keep].round(2)
+        sub['diferenca_pct'] = (ratio.loc[keep] * 100).replace(np.inf, np.nan).round(2)
+        count = int(len(sub))
+        sub = sub.sort_values('diferenca', key=lambda s: s.abs(), ascending=False)
+        if limit:
+            sub = sub.head(int(limit))
+        return {'count': count, 'documents': self._records(sub)}
+
+    @staticmethod
+    def _filter_status(docs, status: Optional[str]):
+        if status:
+            return docs[docs['status'] == status]
+        return docs
+
+    @staticmethod
+    def _records(frame) -> List[Dict[str, Any]]:
+        # NaN -> None and numpy scalars -> python types for JSON responses
+        frame = frame.astype(object).where(frame.notna(), None)
+        out = []
+        for rec in frame.to_dict(orient='records'):
+            out.append({k: (v.item() if hasattr(v, 'item') else v) for k, v in rec.items()})
+        return out
+
+
+_corpus = CorpusFrame()
+
+
+def get_corpus(store: Dict[str, Dict[str, Any]]) -> CorpusFrame:
+    """Return the shared CorpusFrame refreshed against `store`."""
+    _corpus.refresh(store)
+    return _corpus
+
+
+def invalidate(doc_id: Optional[str] = None):
+    _corpus.invalidate(doc_id)
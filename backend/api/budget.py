@@ -0,0 +1,72 @@
+"""Per-document latency budget.
+
+A `Deadline` is created when a worker starts `process_document` on a document (time spent queued
+behind the other files of an upload does not count) and handed to its LLM stages: the model
+rotation, `merge_extracted_sources`, `enrich_record` and `refine_extracted`. Before an expensive
+step, a stage asks `deadline.allows(stage)`. If the time left is below that stage's minimum
+(STAGE_MIN_SECONDS), the stage falls back to its regex/heuristic path and calls
+`deadline.skip(stage)`. The skipped stages end up in the record under 'budget'.
+
+OCR is never cut by the budget: its text is the input of every later stage and there is no
+cheaper fallback for it.
+
+The agents only duck-type the object (remaining/allows/skip), so they do not import this module.
+
+DOCUMENT_BUDGET_SECONDS (default 120) sets the total budget. 0 or a negative value disables the
+cap.
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+DOCUMENT_BUDGET_SECONDS = float(os.environ.get('DOCUMENT_BUDGET_SECONDS', '120'))
+
+# minimum remaining seconds for a stage to be worth starting
+STAGE_MIN_SECONDS: Dict[str, float] = {
+    'llm_extraction': 10.0,  # one model attempt of the main extraction prompt
+    'enrich_llm': 8.0,       # the enrichment LLM fan-out (natureza, pagamento, aliquota, codes, items)
+    'specialist_llm': 8.0,   # specialist codes/items lookups when run on their own
+    'verify_total': 3.0,     # verify_total_with_llm
+}
+
+
+class Deadline:
+    def __init__(self, seconds: Optional[float] = None, started_at: Optional[float] = None):
+        budget = DOCUMENT_BUDGET_SECONDS if seconds is None else float(seconds)
+        self.budget = budget if budget > 0 else None
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.skipped: List[Dict[str, Any]] = []
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining(self) -> float:
+        if self.budget is None:
+            return float('inf')
+        return max(0.0, self.budget - self.elapsed())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, stage: str) -> bool:
+        return self.remaining() >= STAGE_MIN_SECONDS.get(stage, 0.0)
+
+    def timeout(self, cap: Optional[float] = None) -> Optional[float]:
+        """`cap` bounded by the remaining budget, at least 1 s (for HTTP/OCR timeouts); None = unbounded."""
+        r = self.remaining()
+        if cap is not None:
+            r = min(r, float(cap))
+        return None if r == float('inf') else max(1.0, r)
+
+    def skip(self, stage: str, detail: Optional[str] = None) -> None:
+        entry = {'stage': stage, 'remaining_s': round(min(self.remaining(), 1e9), 2)}
+        if detail:
+            entry['detail'] = detail
+        self.skipped.append(entry)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'budget_s': self.budget,
+            'elapsed_s': round(self.elapsed(), 3),
+            'skipped_stages': list(self.skipped),
+        }
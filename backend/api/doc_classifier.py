@@ -0,0 +1,113 @@
+"""Document-type classifier that routes each document to the cheapest sufficient pipeline profile.
+
+Every document used to take the same path: the full extraction prompt, then the merge, then
+enrichment (up to nine more LLM lookups) and the specialist agent. `classify()` is a few string
+checks on the extracted text and looks at:
+- the file type (and whether the XML is an NF-e/CF-e, see agents/nfe_xml.py);
+- the model of a valid chave de acesso;
+- DANFE / NFC-e / receipt keywords;
+- the line count.
+It picks one of PROFILES:
+
+- 'native': NF-e/NFC-e/CF-e XML mapped field by field (nfe_xml.parse). No LLM, merge or enrichment.
+- 'heuristics': short receipts (recibos, comprovantes, delivery). simple_receipt_parser only,
+  accepted when `sufficient()` (a total and consistent items). Otherwise the document escalates
+  to 'llm'.
+- 'llm': NFC-e / cupons fiscais. One extraction call and the merge, without the enrichment lookups.
+- 'full': DANFEs (NF-e modelo 55), CSV and anything unrecognized. The whole path.
+
+A matching layout template (layout_templates.py) is cheaper than any of these and is tried
+first. Such documents are recorded with the profile 'layout_template'. Without the LLM
+(EXTRACTION_MODE=heuristic, or no API key) every other profile becomes 'offline': the merge and
+regex-only enrichment, no escalation. The route, together with
+its cost (seconds, extraction LLM calls, whether enrichment ran), is stored in the record.
+`summarize()` aggregates it per profile. PIPELINE_PROFILE=<profile> forces one profile for every
+document ('auto', the default, classifies). A forced 'native' still needs an NF-e XML, and a
+forced 'heuristics' still escalates when its result is insufficient.
+"""
+import os
+import re
+import statistics
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+PROFILES = ('native', 'heuristics', 'llm', 'full')
+PIPELINE_PROFILE = os.environ.get('PIPELINE_PROFILE', 'auto').lower()
+SIMPLE_MAX_LINES = int(os.environ.get('SIMPLE_MAX_LINES', '40'))
+
+_DANFE_MARKERS = ('DANFE', 'DOCUMENTO AUXILIAR DA NOTA FISCAL ELETRONICA', 'DESTINATARIO / REMETENTE',
+                  'DESTINATARIO/REMETENTE', 'CALCULO DO IMPOSTO', 'DADOS DO PRODUTO', 'TRANSPORTADOR / VOLUMES')
+_NFCE_RE = re.compile(r'\bNFC-?E\b|NOTA FISCAL DE CONSUMIDOR|CUPOM FISCAL|\bCF-?E\b|\bSAT\b')
+_RECEIPT_RE = re.compile(r'\bRECIBO\b|\bCOMPROVANTE\b|\bPEDIDO\b|\bIFOOD\b|\bDELIVERY\b|\bCUPOM\b')
+
+
+def _upper(text: str) -> str:
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').upper()
+
+
+def classify(text: Optional[str], ext: str, chave: Optional[Dict[str, Any]] = None, native: bool = False) -> Dict[str, Any]:
+    """Document type, pipeline profile and the signals behind the choice. `native` tells whether
+    the file parsed as an NF-e/CF-e XML."""
+    ext = (ext or '').lower()
+    up = _upper(text or '')
+    lines = sum(1 for l in (text or '').splitlines() if l.strip())
+    danfe = [m for m in _DANFE_MARKERS if m in up]
+    signals = {
+        'ext': ext,
+        'lines': lines,
+        'chave_modelo': chave.get('modelo') if chave else None,
+        'danfe_markers': len(danfe),
+        'nfce_marker': bool(_NFCE_RE.search(up)),
+        'receipt_marker': bool(_RECEIPT_RE.search(up)),
+    }
+    if ext == '.xml':
+        doc_type, profile = ('nfe_xml', 'native') if native else ('xml', 'full')
+    elif ext == '.csv':
+        doc_type, profile = 'csv', 'full'
+    elif signals['chave_modelo'] == '55' or len(danfe) >= 2:
+        doc_type, profile = 'danfe', 'full'
+    elif signals['chave_modelo'] in ('65', '59') or signals['nfce_marker']:
+        doc_type, profile = 'nfce', 'llm'
+    elif signals['receipt_marker'] or lines <= SIMPLE_MAX_LINES:
+        doc_type, profile = 'recibo', 'heuristics'
+    else:
+        doc_type, profile = 'unknown', 'full'
+    if PIPELINE_PROFILE in PROFILES and PIPELINE_PROFILE != profile:
+        if PIPELINE_PROFILE != 'native' or native:
+            signals['forced'] = PIPELINE_PROFILE
+            profile = PIPELINE_PROFILE
+    return {'type': doc_type, 'profile': profile, 'signals': signals}
+
+
+def sufficient(extracted: Optional[Dict[str, Any]], chave: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Why a heuristic extraction is not enough (empty list = accept it without the LLM)."""
+    try:
+        from . import layout_templates
+    except Exception:
+        from backend.api import layout_templates
+    # same consistency rules that decide which documents layout templates learn from
+    return layout_templates.check(extracted or {}, chave)
+
+
+def summarize(store: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Documents, types, escalations and cost (seconds, extraction LLM calls) per profile."""
+    out: Dict[str, Dict[str, Any]] = {}
+    seconds: Dict[str, List[float]] = {}
+    for rec in list(store.values()):
+        route = rec.get('route') if isinstance(rec, dict) else None
+        if not isinstance(route, dict) or not route.get('profile'):
+            continue
+        p = out.setdefault(route['profile'], {'documents': 0, 'types': {}, 'escalated': 0, 'llm_calls': 0, 'enrichment': 0})
+        p['documents'] += 1
+        p['types'][route.get('type')] = p['types'].get(route.get('type'), 0) + 1
+        p['escalated'] += int(bool(route.get('escalated_from')))
+        p['llm_calls'] += int(route.get('llm_calls') or 0)
+        p['enrichment'] += int(bool(route.get('enrichment')))
+        if isinstance(route.get('seconds'), (int, float)):
+            seconds.setdefault(route['profile'], []).append(float(route['seconds']))
+    for profile, p in out.items():
+        s = seconds.get(profile) or []
+        p['seconds_p50'] = round(statistics.median(s), 3) if s else None
+        p['seconds_mean'] = round(sum(s) / len(s), 3) if s else None
+        p['llm_calls_per_document'] = round(p['llm_calls'] / p['documents'], 2)
+    return {'profiles': out, 'documents': sum(p['documents'] for p in out.values())}
@@ -0,0 +1,152 @@
+"""Per-field confidence of an extraction: where each value came from and whether it checks out.
+
+`score(extracted, chave)` looks at the normalized extracted_data and its `_meta` (field path ->
+source, as set by the merge, the supplier registry and the layout templates) and gives each field
+of FIELDS a confidence between 0 and 1:
+
+- the base value comes from the source (SOURCE_CONFIDENCE). A native XML and a valid chave de
+  acesso are almost certain, while a value picked from an OCR line is a guess;
+- values that agree with the chave de acesso (numero, emitente CNPJ, emission month) are raised
+  to CHAVE_CONFIDENCE. A CNPJ with wrong check digits or an unparseable date is halved;
+- valor_total and itens are raised when the items add up to the total and lowered when they
+  do not.
+
+Missing fields score 0 and are listed in `missing`. Present fields below LOW_CONFIDENCE (default
+0.6) are listed in `low`. Both are the ones worth an LLM pass later (EXTRACTION_MODE=heuristic
+processes backlogs without the LLM).
+`summarize(store)` aggregates the stored reports per extraction mode.
+"""
+import os
+import re
+from typing import Any, Dict, Optional
+
+LOW_CONFIDENCE = float(os.environ.get('LOW_CONFIDENCE', '0.6'))
+
+FIELDS = ('numero_nota', 'chave_acesso', 'data_emissao', 'valor_total', 'natureza_operacao', 'forma_pagamento',
+          'emitente.cnpj', 'emitente.razao_social', 'emitente.inscricao_estadual', 'emitente.endereco',
+          'destinatario.razao_social', 'destinatario.cnpj', 'impostos.icms.valor', 'itens')
+
+SOURCE_CONFIDENCE = {
+    'nfe_xml': 0.99,
+    'chave_acesso': 0.99,
+    'layout_template': 0.95,
+    'supplier_registry': 0.9,
+    'llm': 0.8,
+    'llm_refinement': 0.8,
+    'merged': 0.7,
+    'specialist': 0.6,
+    'fallback': 0.55,
+    'enrichment': 0.5,
+    'ocr': 0.4,
+}
+CHAVE_CONFIDENCE = 0.99
+_DEFAULT_CONFIDENCE = 0.5
+
+
+def _get(data: Dict[str, Any], path: str) -> Any:
+    cur: Any = data
+    for part in path.split('.'):
+        if not isinstance(cur, dict):
+            return None
+        cur = cur.get(part)
+    return cur
+
+
+def _source(meta: Dict[str, Any], path: str) -> Optional[str]:
+    """Most specific source recorded for `path` (the field, then its parent, then the extraction)."""
+    parts = path.split('.')
+    for n in range(len(parts), 0, -1):
+        src = meta.get('.'.join(parts[:n]))
+        if isinstance(src, str):
+            return src
+    return meta.get('extraction') if isinstance(meta.get('extraction'), str) else None
+
+
+def _digits(value: Any) -> str:
+    return re.sub(r'\D', '', str(value or ''))
+
+
+def _items_sum(items: Any) -> Optional[float]:
+    if not isinstance(items, list) or not items:
+        return None
+    total = 0.0
+    for it in items:
+        v = it.get('valor_total') if isinstance(it, dict) else None
+        if not isinstance(v, (int, float)):
+            return None
+        total += v
+    return round(total, 2)
+
+
+def score(extracted: Optional[Dict[str, Any]], chave: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Confidence and source of each field of FIELDS, their mean, the missing and the low-confidence fields."""
+    extracted = extracted if isinstance(extracted, dict) else {}
+    meta = extracted.get('_meta') if isinstance(extracted.get('_meta'), dict) else {}
+    try:
+        from backend.agents import chave_acesso
+    except ImportError:
+        try:
+            # API launched from backend/ (uvicorn api.main:app)
+            from agents import chave_acesso
+        except ImportError:
+            chave_acesso = None
+    total = extracted.get('valor_total')
+    items_sum = _items_sum(extracted.get('itens'))
+    sums_match = isinstance(total, (int, float)) and items_sum is not None and abs(items_sum - total) <= 0.05
+    fields: Dict[str, Dict[str, Any]] = {}
+    for path in FIELDS:
+        value = _get(extracted, path)
+        if value in (None, '', [], {}):
+            fields[path] = {'source': None, 'confidence': 0.0}
+            continue
+        src = _source(meta, path)
+        conf = SOURCE_CONFIDENCE.get(src, _DEFAULT_CONFIDENCE)
+        if path.endswith('cnpj') and chave_acesso is not None and len(_digits(value)) == 14 and not chave_acesso.cnpj_is_valid(_digits(value)):
+            conf /= 2
+        if path == 'data_emissao' and not re.match(r'\d{4}-\d{2}-\d{2}$', str(value)):
+            conf /= 2
+        if chave:
+            if path == 'chave_acesso' and _digits(value) == chave.get('chave'):
+                conf = CHAVE_CONFIDENCE
+            elif path == 'numero_nota' and _digits(value) and int(_digits(value)) == int(chave.get('numero') or -1):
+                conf = CHAVE_CONFIDENCE
+            elif path == 'emitente.cnpj' and chave.get('cnpj_valido') and _digits(value) == chave.get('cnpj'):
+                conf = CHAVE_CONFIDENCE
+            elif path == 'data_emissao' and chave_acesso is not None and chave_acesso.matches_date(chave, value):
+                conf = max(conf, 0.9)
+        if path in ('valor_total', 'itens') and items_sum is not None:
+            conf = max(conf, 0.9) if sums_match else conf * 0.6
+        if path == 'itens' and any(not isinstance(it, dict) or not it.get('descricao') for it in value):
+            conf *= 0.7
+        fields[path] = {'source': src, 'confidence': round(min(conf, 1.0), 3)}
+    return {
+        'fields': fields,
+        'mean': round(sum(f['confidence'] for f in fields.values()) / len(fields), 3),
+        'missing': [p for p, f in fields.items() if not f['confidence']],
+        'low': [p for p, f in fields.items() if 0 < f['confidence'] < LOW_CONFIDENCE],
+    }
+
+
+def summarize(store: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Per extraction mode: documents, mean confidence and, per field, mean confidence and missing rate."""
+    modes: Dict[str, Dict[str, Any]] = {}
+    for rec in list(store.values()):
+        quality = rec.get('quality') if isinstance(rec, dict) else None
+        if not isinstance(quality, dict) or not isinstance(quality.get('fields'), dict):
+            continue
+        m = modes.setdefault(quality.get('mode') or 'unknown', {'documents': 0, 'mean': 0.0, 'fields': {}})
+        m['documents'] += 1
+        m['mean'] += quality.get('mean') or 0.0
+        for path, f in quality['fields'].items():
+            agg = m['fields'].setdefault(path, {'confidence': 0.0, 'missing': 0, 'low': 0})
+            agg['confidence'] += f.get('confidence') or 0.0
+            agg['missing'] += int(not f.get('confidence'))
+            agg['low'] += int(path in (quality.get('low') or []))
+    for m in modes.values():
+        n = m['documents']
+        m['mean'] = round(m['mean'] / n, 3)
+        for agg in m['fields'].values():
+            agg['confidence'] = round(agg['confidence'] / n, 3)
+            agg['missing_rate'] = round(agg.pop('missing') / n, 3)
+            agg['low_rate'] = round(agg.pop('low') / n, 3)
+    return {'modes': modes, 'documents': sum(m['documents'] for m in modes.values())}
@@ -0,0 +1,746 @@
+"""Layout templates: deterministic extraction for documents whose layout was seen before (SQLite, stdlib only).
+
+Documents of the same emitter share a layout (the Leroy Merlin and iFood cases that the item
+prompt in llm_helper special-cases), yet every one of them went through the full extraction
+prompt. This module learns, from verified documents, where each field and the item rows sit in the
+text, and replays that on new documents of the same layout:
+
+- `fingerprint(text)`: hash of the first LAYOUT_HEADER_LINES lines with letters (digits masked;
+  case, accents and spacing normalized) plus a line-structure signature. The signature has one
+  class per line (label, number, date, mixed) with repeated classes collapsed, so the item count
+  does not change it.
+- `learn(doc_id, record)`: a finalized record that passes `check()` is verified. Every field value
+  is located in its text, and the template stores how to find it again:
+  - an anchor line (one of the nearest lines with letters at or before the value, digits masked);
+  - which occurrence of that anchor it was;
+  - the line offset from the anchor to the value;
+  - the value's position among the tokens of its kind on that line.
+  Item rows are learned either as one line per item or, for single-item documents, like the other
+  fields. For one-line rows, token positions are counted from the end of the line because
+  descriptions vary in length. A rule gains support when another verified document of the same
+  layout confirms it, and extraction tries the best-supported rules first.
+- `match(text, cnpj)` finds the template by header hash. When the header differs (e.g. the customer
+  name printed in the canhoto), it falls back to a template of the same emitente CNPJ whose
+  structure signature is at least LAYOUT_MIN_SIMILARITY similar. Templates that failed
+  LAYOUT_MAX_FAILURES more times than they succeeded are no longer used.
+- `extract(template, text)` applies the rules, with no model call. `check()` then validates the
+  result: the learned key fields are present, the items add up to valor_total, and
+  numero/CNPJ/month agree with the chave de acesso. process_document calls the LLM only on a miss
+  or a failed check.
+
+Templates live next to the JSON DB (override with LAYOUT_TEMPLATES_PATH). LAYOUT_TEMPLATES=0
+disables matching; learning still runs.
+"""
+import difflib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+_DEFAULT_DB = os.environ.get('DOCUMENTS_DB_PATH') or os.path.join(os.path.dirname(__file__), 'documents_db.json')
+LAYOUT_TEMPLATES_PATH = os.environ.get('LAYOUT_TEMPLATES_PATH') or os.path.join(os.path.dirname(os.path.abspath(_DEFAULT_DB)), 'layout_templates.sqlite3')
+LAYOUT_TEMPLATES = os.environ.get('LAYOUT_TEMPLATES', '1').lower() not in ('0', 'false', 'no', 'off')
+LAYOUT_MIN_SIMILARITY = float(os.environ.get('LAYOUT_MIN_SIMILARITY', '0.8'))
+LAYOUT_HEADER_LINES = int(os.environ.get('LAYOUT_HEADER_LINES', '8'))
+LAYOUT_MAX_FAILURES = int(os.environ.get('LAYOUT_MAX_FAILURES', '3'))
+
+FIELD_KINDS = {
+    'numero_nota': 'digits',
+    'data_emissao': 'date',
+    'valor_total': 'money',
+    'natureza_operacao': 'text',
+    'forma_pagamento': 'text',
+    'emitente.razao_social': 'text',
+    'emitente.cnpj': 'cnpj',
+    'emitente.inscricao_estadual': 'digits',
+    'emitente.endereco': 'text',
+    'destinatario.razao_social': 'text',
+    'destinatario.cnpj': 'cnpj',
+    'destinatario.inscricao_estadual': 'digits',
+    'destinatario.endereco': 'text',
+    'impostos.icms.base_calculo': 'money',
+    'impostos.icms.valor': 'money',
+    'impostos.ipi.valor': 'money',
+    'impostos.pis.valor': 'money',
+    'impostos.cofins.valor': 'money',
+}
+ITEM_KINDS = {
+    'descricao': 'text', 'quantidade': 'number', 'unidade': 'unit', 'valor_unitario': 'money',
+    'valor_total': 'money', 'codigo': 'digits', 'ncm': 'digits', 'cfop': 'digits', 'cst': 'digits',
+}
+# fields a template must extract when it has learned them (their absence means the layout moved)
+KEY_FIELDS = ('numero_nota', 'data_emissao', 'emitente.cnpj', 'valor_total')
+TEMPLATE_SOURCE = 'layout_template'
+
+_ANCHORS_PER_VALUE = 3
+_OCCURRENCES = 3
+_ANCHOR_WINDOW = 12
+_MAX_RULES = 9
+_STRUCTURE_LINES = 150
+
+_NUM_RE = re.compile(r'\d[\d.,]*\d|\d')
+_ID_RE = re.compile(r'\d[\d./\-]*\d|\d')
+_DATE_RE = re.compile(r'\d{2}/\d{2}/\d{4}|\d{4}-\d{2}-\d{2}')
+_UNIT_RE = re.compile(r'(?<![A-Za-z])[A-Za-z]{1,4}\.?(?![A-Za-z])')
+_LETTER_RE = re.compile(r'[A-Za-zÀ-ÿ]')
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is not None:
+        return _conn
+    with _lock:
+        if _conn is not None:
+            return _conn
+        conn = sqlite3.connect(LAYOUT_TEMPLATES_PATH, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS layout_templates ('
+            'fingerprint TEXT PRIMARY KEY, cnpj TEXT, structure TEXT, template TEXT, '
+            'documents INTEGER, hits INTEGER, failures INTEGER, updated_at TEXT)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS layout_templates_cnpj ON layout_templates (cnpj)')
+        conn.execute('CREATE TABLE IF NOT EXISTS layout_docs (doc_id TEXT PRIMARY KEY, fingerprint TEXT, sig TEXT, learned_at TEXT)')
+        conn.execute('CREATE TABLE IF NOT EXISTS layout_stats (name TEXT PRIMARY KEY, value INTEGER)')
+        conn.commit()
+        _conn = conn
+        return _conn
+
+
+def _bump(conn: sqlite3.Connection, name: str):
+    conn.execute('INSERT INTO layout_stats (name, value) VALUES (?, 1) '
+                 'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+
+# --- text model -------------------------------------------------------------------------------
+
+def _norm(value: Any) -> str:
+    s = unicodedata.normalize('NFKD', str(value)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^0-9A-Za-z]+', ' ', s).upper().split())
+
+
+def _mask(line: str) -> str:
+    """Line with digits masked, for anchors and the header hash (labels repeat, values do not)."""
+    s = unicodedata.normalize('NFKD', line).encode('ascii', 'ignore').decode('ascii').upper()
+    return ' '.join(re.sub(r'\d+', '#', s).split())
+
+
+def _lettered(line: str) -> bool:
+    return len(_LETTER_RE.findall(line)) >= 3
+
+
+class _Text:
+    """Non-empty lines of a document with their masks and where each mask occurs."""
+
+    def __init__(self, text: str):
+        self.lines = [l.strip() for l in (text or '').splitlines() if l.strip()]
+        self.masks = [_mask(l) for l in self.lines]
+        self.lettered = [_lettered(l) for l in self.lines]
+        self.where: Dict[str, List[int]] = {}
+        for i, m in enumerate(self.masks):
+            self.where.setdefault(m, []).append(i)
+
+
+def _line_class(line: str) -> str:
+    if _lettered(line):
+        return 'M' if re.search(r'\d', line) else 'L'
+    return 'D' if _DATE_RE.search(line) else 'N'
+
+
+def fingerprint(text: str) -> Optional[Dict[str, str]]:
+    """Header hash and structure signature of `text`, or None when it has too little text."""
+    doc = text if isinstance(text, _Text) else _Text(text)
+    header = [m for m, lettered in zip(doc.masks, doc.lettered) if lettered][:LAYOUT_HEADER_LINES]
+    if len(header) < 3:
+        return None
+    classes: List[str] = []
+    for line in doc.lines[:_STRUCTURE_LINES]:
+        c = _line_class(line)
+        if not classes or classes[-1] != c:
+            classes.append(c)
+    return {'key': hashlib.sha1('\n'.join(header).encode('utf-8')).hexdigest()[:16], 'structure': ''.join(classes)}
+
+
+# --- values -----------------------------------------------------------------------------------
+
+def _number(token: Any) -> Optional[float]:
+    """Number in Brazilian or OCR/US notation ('3.254,07', '3,254.0700', '1.0000', '10,000')."""
+    if isinstance(token, (int, float)):
+        return float(token)
+    s = re.sub(r'[^0-9,.]', '', str(token or ''))
+    if not s or not s[0].isdigit() or not s[-1].isdigit():
+        return None
+    if ',' in s and '.' in s:
+        dec = ',' if s.rfind(',') > s.rfind('.') else '.'
+    elif ',' in s:
+        dec = ',' if s.count(',') == 1 else None
+    elif s.count('.') == 1 and len(s.split('.')[1]) != 3:
+        dec = '.'
+    else:
+        dec = None
+    if dec:
+        whole, frac = s.rsplit(dec, 1)
+        s = re.sub(r'\D', '', whole) + '.' + frac
+    else:
+        s = re.sub(r'\D', '', s)
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _iso_date(value: Any) -> Optional[str]:
+    s = str(value or '')
+    m = re.match(r'(\d{4})-(\d{2})-(\d{2})', s)
+    if m:
+        return m.group(0)
+    m = re.match(r'(\d{2})/(\d{2})/(\d{4})', s)
+    return f"{m.group(3)}-{m.group(2)}-{m.group(1)}" if m else None
+
+
+def _parse(kind: str, token: str) -> Any:
+    if kind in ('money', 'number'):
+        return _number(token)
+    if kind == 'date':
+        return _iso_date(token)
+    digits = re.sub(r'\D', '', token)
+    if kind == 'cnpj':
+        return digits if len(digits) in (11, 14) else None
+    if kind == 'digits':
+        return digits or None
+    if kind == 'unit':
+        return token.rstrip('.').upper() if _UNIT_RE.fullmatch(token) else None
+    return token
+
+
+def _values(kind: str, line: str) -> List[Any]:
+    """Values of `kind` on a line, in order."""
+    regex = {'money': _NUM_RE, 'number': _NUM_RE, 'date': _DATE_RE, 'unit': _UNIT_RE}.get(kind, _ID_RE)
+    out = []
+    for m in regex.finditer(line):
+        v = _parse(kind, m.group(0))
+        if v is not None:
+            out.append(v)
+    return out
+
+
+def _same(kind: str, a: Any, b: Any) -> bool:
+    if a in (None, '') or b in (None, ''):
+        return False
+    if kind in ('money', 'number'):
+        x, y = _number(a), _number(b)
+        return x is not None and y is not None and abs(x - y) < 0.005
+    if kind == 'date':
+        return _iso_date(a) is not None and _iso_date(a) == _iso_date(b)
+    if kind in ('cnpj', 'digits'):
+        x, y = re.sub(r'\D', '', str(a)).lstrip('0'), re.sub(r'\D', '', str(b)).lstrip('0')
+        return bool(x) and x == y
+    x, y = _norm(a), _norm(b)
+    if not x or not y:
+        return False
+    # descriptions often continue on a line the stored value left out (or the other way round)
+    short, long_ = sorted((x, y), key=len)
+    return x == y or (len(short) >= 12 and long_.startswith(short))
+
+
+def _get(d: Dict[str, Any], path: str) -> Any:
+    cur: Any = d
+    for part in path.split('.'):
+        cur = cur.get(part) if isinstance(cur, dict) else None
+    return cur
+
+
+def _set(d: Dict[str, Any], path: str, value: Any):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        d = d.setdefault(part, {})
+    d[parts[-1]] = value
+
+
+# --- rules ------------------------------------------------------------------------------------
+
+def _anchors(doc: _Text, i: int, include_self: bool) -> List[Dict[str, Any]]:
+    """Up to _ANCHORS_PER_VALUE lines with letters at (or strictly before) line i."""
+    out = []
+    j = i if include_self else i - 1
+    while j >= 0 and i - j <= _ANCHOR_WINDOW and len(out) < _ANCHORS_PER_VALUE:
+        if doc.lettered[j]:
+            m = doc.masks[j]
+            out.append({'anchor': m, 'nth': doc.where[m].index(j), 'offset': i - j})
+        j -= 1
+    return out
+
+
+def _resolve(doc: _Text, rule: Dict[str, Any]) -> Optional[int]:
+    hits = doc.where.get(rule['anchor'])
+    if not hits or rule['nth'] >= len(hits):
+        return None
+    i = hits[rule['nth']] + rule['offset']
+    return i if i < len(doc.lines) else None
+
+
+def _apply(doc: _Text, kind: str, rule: Dict[str, Any]) -> Any:
+    i = _resolve(doc, rule)
+    if i is None:
+        return None
+    if kind == 'text':
+        span = doc.lines[i:i + rule.get('span', 1)]
+        if len(span) < rule.get('span', 1) or not all(doc.lettered[i:i + len(span)]):
+            return None
+        return ' '.join(span)
+    vals = _values(kind, doc.lines[i])
+    idx = rule.get('index', 0)
+    return vals[idx] if idx < len(vals) else None
+
+
+def _locate(doc: _Text, kind: str, value: Any) -> List[Dict[str, Any]]:
+    """Rules that find `value` in this document (checked by applying them back)."""
+    rules: List[Dict[str, Any]] = []
+    found = 0
+    target = _norm(value) if kind == 'text' else None
+    for i, line in enumerate(doc.lines):
+        if found >= _OCCURRENCES:
+            break
+        if kind == 'text':
+            if not doc.lettered[i]:
+                continue
+            for span in range(1, 5):
+                joined = _norm(' '.join(doc.lines[i:i + span]))
+                if _same('text', joined, value):
+                    rules.extend(dict(a, span=span) for a in _anchors(doc, i, include_self=False))
+                    found += 1
+                    break
+                if len(joined) >= len(target):
+                    break
+        else:
+            for idx, v in enumerate(_values(kind, line)):
+                if _same(kind, v, value):
+                    rules.extend(dict(a, index=idx) for a in _anchors(doc, i, include_self=True))
+                    found += 1
+                    break
+    out = []
+    for rule in rules:
+        if rule not in out and _same(kind, _apply(doc, kind, rule), value):
+            out.append(rule)
+    return out
+
+
+def _merge_rules(old: List[Dict[str, Any]], new: List[Dict[str, Any]], doc: _Text, kind: str, value: Any) -> List[Dict[str, Any]]:
+    """Old rules that also find this document's value gain support; new rules start at 1."""
+    def ident(r):
+        return {k: v for k, v in r.items() if k != 'support'}
+    merged = []
+    for rule in old:
+        if _same(kind, _apply(doc, kind, rule), value):
+            rule = dict(rule, support=rule.get('support', 1) + 1)
+        merged.append(rule)
+    known = [ident(r) for r in merged]
+    merged.extend(dict(r, support=1) for r in new if ident(r) not in known)
+    merged.sort(key=lambda r: (-r.get('support', 1), r['offset']))
+    return merged[:_MAX_RULES]
+
+
+def _best(doc: _Text, kind: str, rules: List[Dict[str, Any]]) -> Any:
+    for rule in rules:
+        v = _apply(doc, kind, rule)
+        if v not in (None, ''):
+            return v
+    return None
+
+
+# --- item rows --------------------------------------------------------------------------------
+
+_ROW_FIELDS = ('valor_total', 'valor_unitario', 'quantidade', 'unidade', 'codigo', 'ncm', 'cfop', 'cst')
+
+
+def _row_rule(tokens: List[str], item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Where the item's fields sit on one line: token positions after the description (counted
+    from the end, descriptions vary in length) and before it (e.g. the product code). None when
+    the description or valor_total is not on this line."""
+    desc = _norm(item.get('descricao') or '')
+    if not desc:
+        return None
+    lead, end = None, None
+    for s in range(len(tokens)):
+        first = _norm(tokens[s])
+        if first and (desc == first or desc.startswith(first + ' ')):
+            lead, end = s, s + 1
+            while end < len(tokens):
+                part = _norm(' '.join(tokens[s:end + 1]))
+                if not (desc == part or desc.startswith(part + ' ')):
+                    break
+                end += 1
+            break
+    if lead is None:
+        return None
+    positions: Dict[str, int] = {}
+    leading: Dict[str, int] = {}
+    for field in _ROW_FIELDS:
+        value = item.get(field)
+        if value in (None, ''):
+            continue
+        kind = ITEM_KINDS[field]
+        for j in list(range(len(tokens) - 1, end - 1, -1)) + list(range(lead)):
+            taken = j - len(tokens) in positions.values() if j >= end else j in leading.values()
+            if taken or not _same(kind, _parse(kind, tokens[j]), value):
+                continue
+            if j >= end:
+                positions[field] = j - len(tokens)
+            else:
+                leading[field] = j
+            break
+    if 'valor_total' not in positions:
+        return None
+    # tokens after the description are fixed by the layout (even those not learned as fields)
+    return {'lead': lead, 'tail': len(tokens) - end, 'positions': positions, 'leading': leading}
+
+
+def _row(tokens: List[str], rule: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    width = max(rule.get('tail', 0), -min(rule['positions'].values()))
+    if len(tokens) < rule['lead'] + 1 + width:
+        return None
+    item: Dict[str, Any] = {}
+    for field, pos in list(rule['positions'].items()) + list((rule.get('leading') or {}).items()):
+        v = _parse(ITEM_KINDS[field], tokens[pos])
+        if v is None:
+            return None
+        item[field] = v
+    desc = ' '.join(tokens[rule['lead']:len(tokens) - width])
+    if not _lettered(desc):
+        return None
+    item['descricao'] = desc
+    return item
+
+
+def _learn_items(doc: _Text, items: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    items = [it for it in items if isinstance(it, dict) and it.get('descricao')]
+    if not items:
+        return None
+    # one line per item
+    rule, lines, start = None, [], 0
+    for it in items:
+        for i in range(start, len(doc.lines)):
+            tokens = doc.lines[i].split()
+            if rule is None:
+                candidate = _row_rule(tokens, it)
+                if candidate:
+                    rule = candidate
+                    lines.append(i)
+                    break
+            else:
+                row = _row(tokens, rule)
+                if row and _same('money', row['valor_total'], it.get('valor_total')) and _same('text', row['descricao'], it['descricao']):
+                    lines.append(i)
+                    break
+        else:
+            break
+        start = lines[-1] + 1
+    if rule and len(lines) == len(items):
+        end = None
+        for i in range(lines[-1] + 1, len(doc.lines)):
+            if doc.lettered[i] and not _row(doc.lines[i].split(), rule):
+                end = doc.masks[i]
+                break
+        starts = _anchors(doc, lines[0], include_self=False)
+        if starts:
+            return {'strategy': 'line', 'rule': rule, 'start': starts, 'end': end, 'support': 1}
+    # a single item spread over lines: each field is anchored like the header fields
+    if len(items) == 1:
+        fields = {}
+        for field, kind in ITEM_KINDS.items():
+            value = items[0].get(field)
+            if value not in (None, ''):
+                rules = _locate(doc, kind, value)
+                if rules:
+                    fields[field] = [dict(r, support=1) for r in rules[:_MAX_RULES]]
+        if 'descricao' in fields and 'valor_total' in fields:
+            return {'strategy': 'single', 'fields': fields, 'support': 1}
+    return None
+
+
+def _extract_items(doc: _Text, spec: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if not spec:
+        return []
+    if spec['strategy'] == 'single':
+        item = {}
+        for field, rules in spec['fields'].items():
+            v = _best(doc, ITEM_KINDS[field], rules)
+            if v is not None:
+                item[field] = v
+        return [item] if item.get('descricao') else []
+    start = None
+    for rule in spec['start']:
+        start = _resolve(doc, rule)
+        if start is not None:
+            break
+    if start is None:
+        return []
+    items, misses = [], 0
+    for i in range(start, len(doc.lines)):
+        if spec.get('end') and doc.masks[i] == spec['end']:
+            break
+        row = _row(doc.lines[i].split(), spec['rule'])
+        if row:
+            items.append(row)
+            misses = 0
+        elif items:
+            # descriptions continuing on the next line are skipped; a gap ends the section
+            misses += 1
+            if misses > 2:
+                break
+    return items
+
+
+# --- templates --------------------------------------------------------------------------------
+
+def _build(doc: _Text, extracted: Dict[str, Any], old: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    old = old or {'fields': {}, 'items': None, 'has_items': False}
+    fields = dict(old.get('fields') or {})
+    for path, kind in FIELD_KINDS.items():
+        value = _get(extracted, path)
+        if value in (None, '') or (kind == 'money' and _number(value) == 0):
+            continue
+        new = _locate(doc, kind, value)
+        if new or path in fields:
+            fields[path] = _merge_rules(fields.get(path) or [], new, doc, kind, value)
+    items = [it for it in (extracted.get('itens') or []) if isinstance(it, dict)]
+    spec = old.get('items')
+    if items:
+        learned = _learn_items(doc, items)
+        if spec and learned and _same_items(_extract_items(doc, spec), items):
+            spec = dict(spec, support=spec.get('support', 1) + 1)
+        elif learned and (not spec or spec.get('support', 1) < 2):
+            spec = learned
+    return {'fields': fields, 'items': spec, 'has_items': bool(items) or old.get('has_items', False)}
+
+
+def _same_items(got: List[Dict[str, Any]], want: List[Dict[str, Any]]) -> bool:
+    return len(got) == len(want) and all(
+        _same('money', g.get('valor_total'), w.get('valor_total')) for g, w in zip(got, want))
+
+
+def extract(template: Dict[str, Any], text: str) -> Dict[str, Any]:
+    """Apply a template to `text`: the fields it has rules for, the items and a `_meta` marking
+    them as coming from the template."""
+    doc = _Text(text)
+    out: Dict[str, Any] = {}
+    meta: Dict[str, str] = {'extraction': TEMPLATE_SOURCE}
+    for path, rules in (template.get('fields') or {}).items():
+        v = _best(doc, FIELD_KINDS.get(path, 'text'), rules)
+        if v is not None:
+            _set(out, path, v)
+            meta[path] = TEMPLATE_SOURCE
+    out['itens'] = _extract_items(doc, template.get('items'))
+    if out['itens']:
+        meta['itens'] = TEMPLATE_SOURCE
+    out['_meta'] = meta
+    return out
+
+
+def check(extracted: Dict[str, Any], chave: Optional[Dict[str, Any]] = None,
+          template: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Problems with an extraction (empty list = consistent). Used to pick the documents templates
+    learn from and to accept a template's output."""
+    issues = []
+    if not isinstance(extracted, dict):
+        return ['no extraction']
+    total = _number(extracted.get('valor_total')) if extracted.get('valor_total') not in (None, '') else None
+    if not total or total <= 0:
+        issues.append('valor_total missing')
+    items = [it for it in (extracted.get('itens') or []) if isinstance(it, dict)]
+    if template and template.get('has_items') and not items:
+        issues.append('items not found')
+    if items:
+        values = [_number(it.get('valor_total')) if it.get('valor_total') not in (None, '') else None for it in items]
+        if any(not it.get('descricao') for it in items) or any(v is None for v in values):
+            issues.append('incomplete item')
+        elif total:
+            s = sum(values)
+            if abs(s - total) > max(0.05, total * 0.001):
+                issues.append(f'items sum {s:.2f} != valor_total {total:.2f}')
+    if template:
+        for path in KEY_FIELDS:
+            if path in (template.get('fields') or {}) and _get(extracted, path) in (None, ''):
+                issues.append(f'{path} not found')
+    if chave:
+        numero = _get(extracted, 'numero_nota')
+        if numero and not _same('digits', numero, chave['numero']):
+            issues.append('numero_nota differs from chave de acesso')
+        cnpj = _get(extracted, 'emitente.cnpj')
+        if cnpj and chave.get('cnpj_valido') and not _same('digits', cnpj, chave['cnpj']):
+            issues.append('emitente.cnpj differs from chave de acesso')
+        date = _iso_date(_get(extracted, 'data_emissao'))
+        if date and (int(date[:4]), int(date[5:7])) != (chave['ano'], chave['mes']):
+            issues.append('data_emissao outside the chave de acesso month')
+    return issues
+
+
+def _chave(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    try:
+        from backend.agents import chave_acesso
+    except ImportError:
+        try:
+            # API launched from backend/ (uvicorn api.main:app)
+            from agents import chave_acesso
+        except ImportError:
+            return None
+    return chave_acesso.find_valid(record.get('ocr_text'), record.get('filename'))
+
+
+def _usable(row) -> bool:
+    hits, failures = row[2] or 0, row[3] or 0
+    return failures - hits < LAYOUT_MAX_FAILURES
+
+
+def match(text: str, cnpj: Optional[str] = None, count: bool = True) -> Optional[Dict[str, Any]]:
+    """Template for the layout of `text` (header hash, else same emitente CNPJ with a similar
+    structure), or None. The result has fingerprint, similarity, documents and template."""
+    fp = fingerprint(text)
+    if not fp:
+        return None
+    cnpj = re.sub(r'\D', '', str(cnpj or '')) or None
+    found = None
+    try:
+        with _lock:
+            conn = _connect()
+            row = conn.execute('SELECT fingerprint, structure, hits, failures, documents, template '
+                               'FROM layout_templates WHERE fingerprint=?', (fp['key'],)).fetchone()
+            if row and _usable(row):
+                found = (row, difflib.SequenceMatcher(None, fp['structure'], row[1] or '').ratio())
+            elif cnpj:
+                for row in conn.execute('SELECT fingerprint, structure, hits, failures, documents, template '
+                                        'FROM layout_templates WHERE cnpj=?', (cnpj,)).fetchall():
+                    ratio = difflib.SequenceMatcher(None, fp['structure'], row[1] or '').ratio()
+                    if ratio >= LAYOUT_MIN_SIMILARITY and _usable(row) and (not found or ratio > found[1]):
+                        found = (row, ratio)
+            if count:
+                _bump(conn, 'lookups')
+                if not found:
+                    _bump(conn, 'misses')
+                conn.commit()
+    except Exception as e:
+        print(f"[LAYOUT] template lookup failed: {e}", file=sys.stderr)
+        return None
+    if not found:
+        return None
+    row, ratio = found
+    return {'fingerprint': row[0], 'similarity': round(ratio, 3), 'documents': row[4], 'template': json.loads(row[5])}
+
+
+def record_result(fp: str, ok: bool):
+    """Count a template's output as accepted or rejected by check() (disables failing templates)."""
+    try:
+        with _lock:
+            conn = _connect()
+            column = 'hits' if ok else 'failures'
+            conn.execute(f'UPDATE layout_templates SET {column} = {column} + 1 WHERE fingerprint=?', (fp,))
+            _bump(conn, 'hits' if ok else 'rejected')
+            conn.commit()
+    except Exception as e:
+        print(f"[LAYOUT] failed to record template result for {fp}: {e}", file=sys.stderr)
+
+
+def _learn(conn: sqlite3.Connection, doc_id: str, record: Dict[str, Any]) -> bool:
+    extracted = record.get('extracted_data')
+    text = record.get('ocr_text')
+    if record.get('status') != 'finalizado' or not isinstance(extracted, dict) or not text:
+        return False
+    meta = extracted.get('_meta') if isinstance(extracted.get('_meta'), dict) else {}
+    # the template's own output would only reinforce it
+    if meta.get('extraction') == TEMPLATE_SOURCE:
+        return False
+    if check(extracted, _chave(record)):
+        return False
+    doc = _Text(text)
+    fp = fingerprint(doc)
+    if not fp:
+        return False
+    sig = hashlib.sha1(json.dumps([text, {k: v for k, v in extracted.items() if k != '_meta'}],
+                                  ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    row = conn.execute('SELECT sig FROM layout_docs WHERE doc_id=?', (doc_id,)).fetchone()
+    if row and row[0] == sig:
+        return False
+    old = conn.execute('SELECT template, documents FROM layout_templates WHERE fingerprint=?', (fp['key'],)).fetchone()
+    template = _build(doc, extracted, json.loads(old[0]) if old else None)
+    if not template['fields'] and not template['items']:
+        return False
+    cnpj = re.sub(r'\D', '', str(_get(extracted, 'emitente.cnpj') or '')) or None
+    now = datetime.now().isoformat()
+    conn.execute(
+        'INSERT INTO layout_templates (fingerprint, cnpj, structure, template, documents, hits, failures, updated_at) '
+        'VALUES (?, ?, ?, ?, 1, 0, 0, ?) ON CONFLICT(fingerprint) DO UPDATE SET cnpj = COALESCE(excluded.cnpj, cnpj), '
+        'structure = excluded.structure, template = excluded.template, documents = documents + 1, updated_at = excluded.updated_at',
+        (fp['key'], cnpj, fp['structure'], json.dumps(template, ensure_ascii=False), now),
+    )
+    conn.execute('INSERT OR REPLACE INTO layout_docs (doc_id, fingerprint, sig, learned_at) VALUES (?, ?, ?, ?)',
+                 (doc_id, fp['key'], sig, now))
+    return True
+
+
+def learn(doc_id: str, record: Dict[str, Any]) -> bool:
+    """Learn from a finalized record when it passes check(). Returns True when a template changed. Never raises."""
+    try:
+        with _lock:
+            conn = _connect()
+            changed = _learn(conn, doc_id, record)
+            if changed:
+                conn.commit()
+            return changed
+    except Exception as e:
+        print(f"[LAYOUT] failed to learn from {doc_id}: {e}", file=sys.stderr)
+        return False
+
+
+def sync(store: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    """Learn from the verified finalized records of `store` that are new or changed, oldest first."""
+    learned = 0
+    records = [(doc_id, rec) for doc_id, rec in list(store.items()) if isinstance(rec, dict) and rec.get('status') == 'finalizado']
+    records.sort(key=lambda item: str(item[1].get('uploaded_at') or ''))
+    with _lock:
+        conn = _connect()
+        for doc_id, rec in records:
+            try:
+                if _learn(conn, doc_id, rec):
+                    learned += 1
+            except Exception as e:
+                print(f"[LAYOUT] failed to learn from {doc_id}: {e}", file=sys.stderr)
+        conn.commit()
+    return {'learned': learned}
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        conn = _connect()
+        counters = dict(conn.execute('SELECT name, value FROM layout_stats').fetchall())
+        templates = conn.execute('SELECT count(*) FROM layout_templates').fetchone()[0]
+        documents = conn.execute('SELECT count(*) FROM layout_docs').fetchone()[0]
+    lookups = counters.get('lookups', 0)
+    hits = counters.get('hits', 0)
+    return {
+        'templates': templates,
+        'documents_learned': documents,
+        'lookups': lookups,
+        'hits': hits,
+        'rejected': counters.get('rejected', 0),
+        'misses': counters.get('misses', 0),
+        'hit_rate': round(hits / lookups, 3) if lookups else None,
+    }
+
+
+def clear():
+    with _lock:
+        conn = _connect()
+        conn.execute('DELETE FROM layout_templates')
+        conn.execute('DELETE FROM layout_docs')
+        conn.execute('DELETE FROM layout_stats')
+        conn.commit()
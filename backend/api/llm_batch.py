@@ -0,0 +1,175 @@
+"""Multi-document extraction prompts for small documents.
+
+A cupom or recibo has a few hundred tokens of OCR text, yet each one paid for a whole request
+round trip plus the extraction instruction block, which is larger than the document itself.
+`ExtractionBatcher` packs the small documents that reach the LLM stage at about the same time
+into one request:
+
+- `submit(doc_id, text, known_fields, timeout)` is called by process_document for documents of at
+  most BATCH_MAX_DOC_TOKENS (estimated as characters / 4). The document waits up to
+  BATCH_WINDOW_SECONDS for company. The batch is sent as soon as it holds BATCH_MAX_DOCS documents,
+  or when the next document would push it over BATCH_TOKEN_BUDGET.
+- `build_prompt()` writes the instruction block once, then one <documento id="..."> section per
+  document (with its known fields). The answer is {"documentos": {"<id>": {...}}}. `split_response()`
+  hands each document its own object.
+- `submit()` returns the document's extraction, or None when the document ended up alone in its
+  window, its sub-result is missing or does not parse, or the request failed. The caller then
+  makes its usual individual call (model rotation).
+
+`stats()` reports the effective requests per document. That counts the batched requests plus one
+individual request for every document that was alone or fell back.
+"""
+import json
+import os
+import re
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+LLM_BATCH = os.environ.get('LLM_BATCH', '1') != '0'
+BATCH_TOKEN_BUDGET = int(os.environ.get('BATCH_TOKEN_BUDGET', '6000'))
+BATCH_MAX_DOC_TOKENS = int(os.environ.get('BATCH_MAX_DOC_TOKENS', '1500'))
+BATCH_MAX_DOCS = int(os.environ.get('BATCH_MAX_DOCS', '6'))
+BATCH_WINDOW_SECONDS = float(os.environ.get('BATCH_WINDOW_SECONDS', '0.75'))
+BATCH_TIMEOUT_SECONDS = float(os.environ.get('BATCH_TIMEOUT_SECONDS', '60'))
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    return len(text or '') // 4 + 1
+
+
+def eligible(text: Optional[str]) -> bool:
+    return LLM_BATCH and bool(text) and estimate_tokens(text) <= BATCH_MAX_DOC_TOKENS
+
+
+def build_prompt(instructions: str, entries: List[Dict[str, Any]]) -> str:
+    blocks = []
+    for e in entries:
+        known = f"\n{e['known_fields'].strip()}" if (e.get('known_fields') or '').strip() else ''
+        blocks.append(f"<documento id=\"{e['id']}\">{known}\nTexto extraído:\n{e['text']}\n</documento>")
+    return (
+        "Lote de documentos: cada <documento id=\"...\"> abaixo é um documento independente. "
+        + instructions.strip()
+        + "\nFaça a extração separadamente para cada documento e retorne um único JSON no formato "
+        "{\"documentos\": {\"<id>\": {<campos do documento>}}}, com uma entrada para cada id.\n\n"
+        + "\n\n".join(blocks)
+    )
+
+
+def _json_text(s: str) -> Optional[str]:
+    m = re.search(r'```(?:json)?\s*(\{.*\})\s*```', s, flags=re.DOTALL)
+    if m:
+        return m.group(1)
+    first, last = s.find('{'), s.rfind('}')
+    return s[first:last + 1] if first != -1 and last > first else None
+
+
+def split_response(content: Optional[str], ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Per-document extraction dicts of a batched answer (None for the ids it lacks or garbled)."""
+    out: Dict[str, Optional[Dict[str, Any]]] = {doc_id: None for doc_id in ids}
+    text = _json_text(content or '') if isinstance(content, str) else None
+    try:
+        parsed = json.loads(text) if text else None
+    except Exception:
+        try:
+            parsed = json.loads(re.sub(r'[\x00-\x1f]+', '', text))
+        except Exception:
+            parsed = None
+    if not isinstance(parsed, dict):
+        return out
+    docs = parsed.get('documentos') if isinstance(parsed.get('documentos'), dict) else parsed
+    for doc_id in ids:
+        sub = docs.get(doc_id)
+        if isinstance(sub, str):
+            try:
+                sub = json.loads(_json_text(sub) or '')
+            except Exception:
+                sub = None
+        out[doc_id] = sub if isinstance(sub, dict) and sub else None
+    return out
+
+
+class ExtractionBatcher:
+    """Collects concurrent small-document extractions into shared requests sent by `send`.
+
+    `send(entries)` receives [{'id', 'text', 'known_fields'}] and returns split_response()'s dict
+    (it may raise; every document then falls back).
+    """
+
+    def __init__(self, send: Callable[[List[Dict[str, Any]]], Dict[str, Optional[Dict[str, Any]]]],
+                 token_budget: int = BATCH_TOKEN_BUDGET, max_docs: int = BATCH_MAX_DOCS, window: float = BATCH_WINDOW_SECONDS):
+        self.send = send
+        self.token_budget = token_budget
+        self.max_docs = max(2, max_docs)
+        self.window = window
+        self._pending: List[Dict[str, Any]] = []
+        self._tokens = 0
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self.counters = {'documents': 0, 'requests': 0, 'batched': 0, 'alone': 0, 'fallbacks': 0}
+
+    def _take(self) -> List[Dict[str, Any]]:
+        batch, self._pending, self._tokens = self._pending, [], 0
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self):
+        with self._lock:
+            batch = self._take()
+        self._send(batch)
+
+    def _send(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        if len(batch) == 1:
+            with self._lock:
+                self.counters['alone'] += 1
+            batch[0]['event'].set()
+            return
+        try:
+            results = self.send([{k: e[k] for k in ('id', 'text', 'known_fields')} for e in batch]) or {}
+        except Exception as ex:
+            print(f"[BATCH] request for {len(batch)} documents failed: {ex}", file=sys.stderr)
+            results = {}
+        with self._lock:
+            self.counters['requests'] += 1
+            for e in batch:
+                e['result'] = results.get(e['id'])
+                self.counters['batched' if e['result'] is not None else 'fallbacks'] += 1
+        for e in batch:
+            e['event'].set()
+
+    def submit(self, doc_id: str, text: str, known_fields: str = '', timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Extraction of this document from a shared request, or None (make the individual call)."""
+        entry = {'id': doc_id, 'text': text, 'known_fields': known_fields or '', 'event': threading.Event(), 'result': None}
+        tokens = estimate_tokens(text)
+        ready = []
+        with self._lock:
+            self.counters['documents'] += 1
+            if self._pending and self._tokens + tokens > self.token_budget:
+                ready.append(self._take())
+            self._pending.append(entry)
+            self._tokens += tokens
+            if len(self._pending) >= self.max_docs:
+                ready.append(self._take())
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        for batch in ready:
+            self._send(batch)
+        if not entry['event'].wait(timeout):
+            # the shared request is still running; this document goes on alone
+            with self._lock:
+                self.counters['fallbacks'] += 1
+            return None
+        return entry['result']
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self.counters)
+        individual = c['alone'] + c['fallbacks']
+        c['requests_per_document'] = round((c['requests'] + individual) / c['documents'], 3) if c['documents'] else None
+        return c
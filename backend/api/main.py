@@ -1,32 +1,59 @@
 # ...existing code...
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Response
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional, List
 import json
-import uvicorn
 import uuid
 from datetime import datetime
-import pytesseract
-import pdf2image
 import os
 import threading
 import sys
 import tempfile
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-import requests
 import shutil
 import time
+# Heavy dependencies (langchain_openai, pytesseract, pdf2image, requests, pandas via analytics) are
+# imported where they are used, so importing this module (API startup, maintenance scripts) stays fast.
 # Read OpenRouter API key from environment for safety. If not present, LLM calls will be attempted
 # but may fail. Avoid hardcoding secrets in source.
 OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY') or os.environ.get('OPENROUTER_KEY') or None
 OPENROUTER_MODEL = "deepseek/deepseek-chat-v3.1:free"
-if not OPENROUTER_API_KEY:
+# OpenRouter-compatible API root; point it at a local stand-in (benchmarks/fake_openrouter.py) for offline runs
+_OPENROUTER_DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+OPENROUTER_BASE_URL = (os.environ.get('OPENROUTER_BASE_URL') or _OPENROUTER_DEFAULT_BASE_URL).rstrip('/')
+# EXTRACTION_MODE: 'auto' (default; LLM when a key is set), 'llm', 'heuristic' (regex parser,
+# specialist line parsing and enrichment regexes only, with no network attempt at all) or
+# 'deferred' (heuristic at upload; the refinement worker asks the LLM for weak fields later)
+EXTRACTION_MODE = os.environ.get('EXTRACTION_MODE', 'auto').lower()
+if EXTRACTION_MODE in ('heuristic', 'deferred'):
+    print(f'[CONFIG] EXTRACTION_MODE={EXTRACTION_MODE}: documents are extracted without the LLM', file=sys.stderr)
+elif not OPENROUTER_API_KEY:
     print('[CONFIG] Warning: OPENROUTER_API_KEY not set. LLM calls may fail.', file=sys.stderr)
 else:
     print('[CONFIG] OPENROUTER_API_KEY loaded from environment', file=sys.stderr)
 
 
+def _offline() -> bool:
+    """No LLM for this document: EXTRACTION_MODE=heuristic / deferred, or 'auto' without an API key
+    (every model of the rotation would fail anyway)."""
+    return EXTRACTION_MODE in ('heuristic', 'deferred') or (EXTRACTION_MODE == 'auto' and not OPENROUTER_API_KEY)
+
+
+# instruction block of the extraction prompt (shared by the per-document and the batched prompts, see llm_batch.py)
+EXTRACTION_INSTRUCTIONS = """
+            Extraia os principais campos fiscais do texto abaixo e retorne um objeto JSON com os seguintes campos. Se algum campo não for encontrado, preencha com null. Considere variações de nomes, sinônimos, abreviações e formatos comuns usados em notas fiscais brasileiras, cupons fiscais, recibos, pedidos e documentos similares. Identifique campos mesmo que estejam com nomes diferentes, abreviados, em ordem distinta ou ausentes. Exemplos de variações: 'Razão Social', 'Empresa', 'Emitente', 'Fornecedor', 'Destinatário', 'Cliente', 'CNPJ', 'CPF', 'IE', 'Inscrição Estadual', 'Endereço', 'Rua', 'Logradouro', 'CFOP', 'CST', 'NCM', 'CSOSN', 'Data', 'Emissão', 'Nota', 'Chave', 'Pagamento', 'Produto', 'Descrição', 'Qtd', 'Unidade', 'Valor', 'Total', 'Recibo', 'Pedido', 'Cupom', etc. Use padrões, contexto e inferência para mapear corretamente, mesmo em documentos não estruturados. Campos:
+            - emitente: razao_social, cnpj, inscricao_estadual, endereco
+            - destinatario: razao_social, cnpj, inscricao_estadual, endereco
+            - itens: descricao, quantidade, unidade, valor_unitario, valor_total
+            - impostos: icms (aliquota, base_calculo, valor), ipi (valor), pis (valor), cofins (valor)
+            - codigos_fiscais: cfop, cst, ncm, csosn
+            - outros: numero_nota, chave_acesso, data_emissao, natureza_operacao, forma_pagamento, valor_total
+            Retorne apenas o JSON, sem explicações ou markdown. Se não encontrar campos fiscais, tente extrair os principais dados financeiros e de identificação presentes."""
+EXTRACTION_PROMPT = EXTRACTION_INSTRUCTIONS.rstrip() + """ {known_fields}
+            Texto extraído:
+            {ocr_text}
+            """
+
+
 def _mask_key(k: str) -> str:
     try:
         if not k:
@@ -39,6 +66,14 @@ def _mask_key(k: str) -> str:
         return '<error>'
 
 
+def _openrouter_urls(path: str) -> List[str]:
+    """`path` under the configured base URL, plus the alternate OpenRouter host when using the default."""
+    urls = [OPENROUTER_BASE_URL + path]
+    if OPENROUTER_BASE_URL == _OPENROUTER_DEFAULT_BASE_URL:
+        urls.append("https://api.openrouter.ai/v1" + path)
+    return urls
+
+
 # Cache/utility to fetch free models from OpenRouter dynamically
 _FREE_MODELS_CACHE = []
 def get_openrouter_free_models(limit: int = 20):
@@ -47,15 +82,15 @@ def get_openrouter_free_models(limit: int = 20):
     """
     global _FREE_MODELS_CACHE
     if _FREE_MODELS_CACHE:
+        metrics.CACHE_HITS.inc(cache='openrouter_models')
         return _FREE_MODELS_CACHE[:limit]
+    metrics.CACHE_MISSES.inc(cache='openrouter_models')
     if not OPENROUTER_API_KEY:
         return [OPENROUTER_MODEL, 'minimax/minimax-m2:free']
     headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}"}
-    urls = [
-        "https://openrouter.ai/api/v1/models?max_price=0&order=top-weekly",
-        "https://api.openrouter.ai/v1/models?max_price=0&order=top-weekly",
-    ]
+    urls = _openrouter_urls("/models?max_price=0&order=top-weekly")
     models = []
+    import requests
     for u in urls:
         try:
             r = requests.get(u, headers=headers, timeout=8)
@@ -179,12 +214,17 @@ if not TESSERACT_CMD:
         TESSERACT_CMD = shutil.which('tesseract')
 
 if TESSERACT_CMD:
-    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
     print(f"[CONFIG] Using tesseract executable: {TESSERACT_CMD}", file=sys.stderr)
 else:
     # leave pytesseract default; OCR calls will fail later if not available
     print('[CONFIG] Warning: tesseract executable not found. OCR will fail unless available in PATH or TESSERACT_CMD is set.', file=sys.stderr)
 
+
+
+def get_ocr_engine():
+    """Process-wide OCR engine (ocr_engine.py): tesserocr with models kept loaded, or pytesseract."""
+    return ocr_engine.get_engine(TESSERACT_CMD)
+
 # Configure Poppler path (used by pdf2image on Windows). Allow override via env var POPPLER_PATH.
 try:
     REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
@@ -211,25 +251,87 @@ _db_lock = persistence._db_lock
 load_documents_db = persistence.load_documents_db
 save_documents_db = persistence.save_documents_db
 
-# Load persisted DB at startup
-load_documents_db()
-# rebind the local reference to the persistence module's store (persistence.load_documents_db may replace the object)
 try:
-    documents_db = persistence.documents_db
+    from . import analytics
+    from . import budget
+    from . import doc_classifier
+    from . import field_confidence
+    from . import layout_templates
+    from . import llm_batch
+    from . import metrics
+    from . import ocr_engine
+    from . import ocr_pipeline
+    from . import preprocess
+    from . import refinement
+    from . import retry_queue
+    from . import search_index
+    from . import supplier_registry
 except Exception:
-    pass
-# Global flag indicating whether chat/completions is allowed with current key
+    from backend.api import analytics
+    from backend.api import budget
+    from backend.api import doc_classifier
+    from backend.api import field_confidence
+    from backend.api import layout_templates
+    from backend.api import llm_batch
+    from backend.api import metrics
+    from backend.api import ocr_engine
+    from backend.api import ocr_pipeline
+    from backend.api import preprocess
+    from backend.api import refinement
+    from backend.api import retry_queue
+    from backend.api import search_index
+    from backend.api import supplier_registry
+
+
+def _import_agent(name: str):
+    """backend/agents/<name>: `backend.agents.<name>` from the repo root, `agents.<name>` when the API is
+    launched from backend/ (`uvicorn api.main:app`, as in the README, Dockerfile and start scripts)."""
+    import importlib
+    try:
+        return importlib.import_module(f'backend.agents.{name}')
+    except ModuleNotFoundError as e:
+        if e.name not in ('backend', 'backend.agents'):
+            raise
+        return importlib.import_module(f'agents.{name}')
+
+@app.middleware("http")
+async def _refresh_store_from_disk(request, call_next):
+    """Pick up records saved by other worker processes (uvicorn --workers N) before serving a request."""
+    if persistence.disk_changed():
+        from starlette.concurrency import run_in_threadpool
+        await run_in_threadpool(persistence.refresh_if_changed)
+    return await call_next(request)
+
+
+# Global flag indicating whether chat/completions is allowed with current key (None while the probe runs)
 LLM_AVAILABLE = None
 
 
+@app.on_event("startup")
+def _load_db():
+    """Load the persisted DB when the server starts (not at import time; see persistence.ensure_loaded)."""
+    t0 = time.perf_counter()
+    persistence.ensure_loaded()
+    print(f"[PERSIST] loaded {len(documents_db)} records in {time.perf_counter() - t0:.2f}s", file=sys.stderr)
+
+
 @app.on_event("startup")
 def _check_llm_available():
+    """Run the OpenRouter probe and model-list fetch in the background so they do not delay readiness."""
+    threading.Thread(target=_probe_llm_available, name='llm-probe', daemon=True).start()
+
+
+def _probe_llm_available():
     """Perform a lightweight check to see if the configured OPENROUTER_API_KEY can call chat/completions.
     This prevents attempting LLM calls that will return 401 for every document and lets us
     fall back to heuristics immediately.
     """
     global LLM_AVAILABLE
     key = OPENROUTER_API_KEY
+    if EXTRACTION_MODE == 'heuristic':
+        LLM_AVAILABLE = False
+        print('[LLM-CHK] EXTRACTION_MODE=heuristic; skipping the probe and the model list', file=sys.stderr)
+        return
     if not key:
         LLM_AVAILABLE = False
         print('[LLM-CHK] OPENROUTER_API_KEY not set; skipping LLM usage', file=sys.stderr)
@@ -247,22 +349,30 @@ def _check_llm_available():
     }
 
     # Try a couple of known OpenRouter endpoints before deciding
-    endpoints = [
-        "https://openrouter.ai/api/v1/chat/completions",
-        "https://api.openrouter.ai/v1/chat/completions",
-    ]
+    endpoints = _openrouter_urls("/chat/completions")
     errors = []
     try:
+        import requests
+        rate_limiter = _import_agent('rate_limiter')
         for u in endpoints:
+            if not rate_limiter.acquire(test_body["model"], key, timeout=8):
+                errors.append(f"{u} - no rate-limit token (quota in use)")
+                continue
             try:
                 r = requests.post(u, json=test_body, headers=headers, timeout=8)
             except Exception as e:
                 errors.append(f"{u} - request error: {e}")
                 continue
+            rate_limiter.observe(test_body["model"], key, r.status_code, r.headers, r.text[:500] if r.status_code == 429 else None)
 
             if r.status_code == 200:
                 LLM_AVAILABLE = True
                 print('[LLM-CHK] OpenRouter chat/completions reachable with current key', file=sys.stderr)
+                # warm the model rotation list so the first document does not fetch it
+                try:
+                    initialize_openrouter_free_models(at_most=50)
+                except Exception as ie:
+                    print(f"[LLM-CHK] failed initializing free-models list: {ie}", file=sys.stderr)
                 return
             # Auth failures are actionable: stop and report succinctly
             if r.status_code == 401:
@@ -297,6 +407,69 @@ def _check_llm_available():
         except Exception as ie:
             print(f"[LLM-CHK] failed initializing free-models list: {ie}", file=sys.stderr)
         return
+
+
+@app.on_event("startup")
+def _sync_search_index():
+    """Reconcile the full-text index with the loaded DB in the background (new/changed/deleted docs)."""
+    def _run():
+        try:
+            res = search_index.sync(documents_db)
+            print(f"[SEARCH] index synced: {res}", file=sys.stderr)
+        except Exception as e:
+            print(f"[SEARCH] index sync failed: {e}", file=sys.stderr)
+    threading.Thread(target=_run, name='search-index-sync', daemon=True).start()
+
+
+@app.on_event("startup")
+def _sync_supplier_registry():
+    """Feed the supplier registry with finalized documents it has not seen yet (background)."""
+    def _run():
+        try:
+            res = supplier_registry.sync(documents_db)
+            print(f"[SUPPLIER] registry synced: {res}", file=sys.stderr)
+        except Exception as e:
+            print(f"[SUPPLIER] registry sync failed: {e}", file=sys.stderr)
+    threading.Thread(target=_run, name='supplier-registry-sync', daemon=True).start()
+
+
+@app.on_event("startup")
+def _sync_layout_templates():
+    """Learn layout templates from verified finalized documents not seen yet (background)."""
+    def _run():
+        try:
+            res = layout_templates.sync(documents_db)
+            print(f"[LAYOUT] templates synced: {res}", file=sys.stderr)
+        except Exception as e:
+            print(f"[LAYOUT] template sync failed: {e}", file=sys.stderr)
+    threading.Thread(target=_run, name='layout-templates-sync', daemon=True).start()
+
+
+@app.on_event("startup")
+def _start_refinement_worker():
+    """Drain the deferred refinement queue in the background (see refinement.py)."""
+    if refinement.REFINEMENT:
+        threading.Thread(target=_refinement_loop, name='llm-refinement', daemon=True).start()
+
+
+@app.on_event("startup")
+def _start_retry_worker():
+    """Run parked (rate-limited) documents again when their retry is due (see retry_queue.py)."""
+    if retry_queue.RETRY_QUEUE:
+        threading.Thread(target=_retry_loop, name='retry-queue', daemon=True).start()
+
+
+@app.on_event("startup")
+def _warm_ocr_engine():
+    """Create the OCR engine in the background so the first document does not pay for loading it."""
+    def _run():
+        try:
+            get_ocr_engine().available()
+        except Exception as e:
+            print(f"[OCR] engine warm-up failed: {e}", file=sys.stderr)
+    threading.Thread(target=_run, name='ocr-warmup', daemon=True).start()
+
+
 pipeline_steps = [
     {"step": 1, "name": "ingestao"},
     {"step": 2, "name": "preprocessamento"},
@@ -324,6 +497,12 @@ async def health():
     }
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Pipeline metrics in the Prometheus text format (stage durations, LLM calls, queue depth)."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/api/v1/debug/llm_test")
 async def llm_test():
     """Quick diagnostic endpoint to verify the OpenRouter API key and base URLs from the running process.
@@ -333,7 +512,7 @@ async def llm_test():
     masked = _mask_key(key)
     results = []
     headers = {"Authorization": f"Bearer {key}"} if key else {}
-    urls = ["https://openrouter.ai/api/v1/models", "https://api.openrouter.ai/v1/models"]
+    urls = _openrouter_urls("/models")
     try:
         import requests
         for u in urls:
@@ -607,6 +786,7 @@ def compute_aggregates(extracted):
     """Compute numeric aggregates from normalized extracted data.
     Returns dict with 'valor_total_calc' and 'impostos_calc' containing numeric values.
     """
+    import re
     try:
         if not extracted or not isinstance(extracted, dict):
             return {"valor_total_calc": None, "impostos_calc": {"icms": 0.0, "ipi": 0.0, "pis": 0.0, "cofins": 0.0}}
@@ -706,7 +886,103 @@ def _extract_json_text_from_raw(s: str):
     return None
 
 
+# ids uploaded and scheduled as background tasks that process_document has not picked up yet
+_queued_docs = set()
+_queued_lock = threading.Lock()
+
+
+def _enqueued(doc_id: str):
+    with _queued_lock:
+        if doc_id not in _queued_docs:
+            _queued_docs.add(doc_id)
+            metrics.QUEUE_DEPTH.inc()
+
+
+def _dequeued(doc_id: str):
+    with _queued_lock:
+        if doc_id in _queued_docs:
+            _queued_docs.discard(doc_id)
+            metrics.QUEUE_DEPTH.dec()
+
+
+def _send_extraction_batch(entries):
+    """One extraction request for several small documents (llm_batch.ExtractionBatcher's sender)."""
+    from langchain_openai import ChatOpenAI
+    rate_limiter = _import_agent('rate_limiter')
+    if not rate_limiter.acquire(OPENROUTER_MODEL, OPENROUTER_API_KEY, timeout=rate_limiter.RATE_LIMIT_MAX_WAIT_SECONDS):
+        raise RuntimeError(f"rate limit: no token available for {OPENROUTER_MODEL}")
+    t0 = time.perf_counter()
+    outcome = 'batch_error'
+    try:
+        llm = ChatOpenAI(api_key=OPENROUTER_API_KEY, base_url=OPENROUTER_BASE_URL, model=OPENROUTER_MODEL, timeout=llm_batch.BATCH_TIMEOUT_SECONDS, max_retries=0)
+        result = llm.invoke(llm_batch.build_prompt(EXTRACTION_INSTRUCTIONS, entries))
+        outcome = 'batch_ok'
+    except Exception as e:
+        msg = str(e).lower()
+        if '429' in msg or 'rate limit' in msg or 'rate_limit' in msg:
+            outcome = 'batch_rate_limit'
+            metrics.RATE_LIMITED.inc(model=OPENROUTER_MODEL)
+            rate_limiter.observe(OPENROUTER_MODEL, OPENROUTER_API_KEY, 429, None, str(e))
+        raise
+    finally:
+        metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - t0, model=OPENROUTER_MODEL, outcome=outcome)
+    content = result.content if hasattr(result, "content") else str(result)
+    return llm_batch.split_response(content, [e["id"] for e in entries])
+
+
+# small documents that reach the LLM extraction together share one request (see llm_batch.py)
+_extraction_batcher = llm_batch.ExtractionBatcher(_send_extraction_batch)
+
+
+def _finish_retry(doc_id: str):
+    """A parked document ran to the end: drop it from the retry queue (dead letters stay listed)."""
+    retry = documents_db[doc_id].get("retry")
+    if not isinstance(retry, dict) or retry.get("status") != "waiting":
+        return
+    try:
+        recovered = documents_db[doc_id].get("status") == "finalizado"
+        retry_queue.remove(doc_id, recovered=recovered)
+        retry["status"] = "recovered" if recovered else "abandoned"
+        retry.pop("next_attempt_at", None)
+        metrics.PARKED_DOCUMENTS.inc(outcome=retry["status"])
+    except Exception as e:
+        print(f"[RETRY] {doc_id} - failed to update the retry queue: {e}", file=sys.stderr)
+
+
+def _dead_letter(doc_id: str, temp_path: str, file_name: str, error: Exception):
+    """A document that raised: record its structured failure reason and put it on the dead-letter list."""
+    reason = retry_queue.classify(error)
+    metrics.FAILURES.inc(reason=reason)
+    try:
+        documents_db[doc_id]["retry"] = retry_queue.dead_letter(doc_id, temp_path, file_name, reason, str(error))
+    except Exception as e:
+        print(f"[RETRY] {doc_id} - failed to dead-letter the document: {e}", file=sys.stderr)
+        documents_db[doc_id]["retry"] = {"status": "dead", "reason": reason}
+
+
 def process_document(doc_id: str, temp_path: str, file_name: str):
+    # the document's latency budget starts when a worker picks it up (see budget.py); the LLM
+    # stages fall back to heuristics when it runs low and the skipped ones are stored in the record
+    deadline = budget.Deadline()
+    # scripts import this module and call process_document without the server's startup hook
+    persistence.ensure_loaded()
+    # per-stage timings: Prometheus histograms plus the compact breakdown stored in the record
+    timer = metrics.StageTimer()
+    _dequeued(doc_id)
+    metrics.IN_FLIGHT.inc()
+    # pipeline profile chosen by doc_classifier and what it cost (stored in the record)
+    route = None
+    llm_calls = 0
+
+    def _persist():
+        with timer.stage('persistence'):
+            save_documents_db()
+
+    def _record_route():
+        if route is not None:
+            route.update(seconds=round(timer.total(), 4), llm_calls=llm_calls, enrichment=timer.get('enrichment') > 0)
+            documents_db[doc_id]["route"] = route
+
     # Use configured POPPLER_PATH (env override or repo-local default) when available.
     # pdf2image.convert_from_path accepts None to rely on system defaults; pass POPPLER_PATH when set.
     poppler_path = POPPLER_PATH
@@ -714,131 +990,219 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
         print(f"[PROCESSAMENTO] {doc_id} - Iniciando preprocessamento", file=sys.stderr)
         documents_db[doc_id]["status"] = "preprocessamento"
         documents_db[doc_id]["progress"] = 15
-        save_documents_db()
+        _persist()
+
+        ext = os.path.splitext(file_name)[1].lower()
+        # a document handed back by the retry queue keeps the text of its parked run (no second OCR)
+        resumed_text = None
+        if (documents_db[doc_id].get("retry") or {}).get("status") == "waiting" and ext in (".pdf", ".jpg", ".jpeg", ".png"):
+            resumed_text = documents_db[doc_id].get("ocr_text") or None
+        # photos: downscale/crop/deskew/binarize (OpenCV, process pool) before Tesseract
+        ocr_input_path = temp_path
+        if ext in [".jpg", ".jpeg", ".png"] and resumed_text is None:
+            try:
+                with timer.stage('preprocess'):
+                    ocr_input_path, prep_info = preprocess.preprocess_image(temp_path, timeout=deadline.timeout())
+                documents_db[doc_id]["preprocessing"] = prep_info
+            except Exception as e:
+                print(f"[PREPROC] {doc_id} - preprocessing failed, OCR will use the original image: {e}", file=sys.stderr)
 
         print(f"[PROCESSAMENTO] {doc_id} - Iniciando OCR", file=sys.stderr)
         documents_db[doc_id]["status"] = "ocr"
         documents_db[doc_id]["progress"] = 40
-        save_documents_db()
+        _persist()
 
-        ext = os.path.splitext(file_name)[1].lower()
         ocr_text = ""
-        if ext == ".pdf":
-            # Try to extract selectable text from the PDF first (no Tesseract needed).
-            # This helps processing when Tesseract is not installed on the host.
-            try:
-                from PyPDF2 import PdfReader
-                pages_text = []
-                with open(temp_path, 'rb') as _f:
-                    reader = PdfReader(_f)
-                    for p in reader.pages:
-                        try:
-                            pages_text.append(p.extract_text() or "")
-                        except Exception:
-                            pages_text.append("")
-                ocr_text = "\n\n".join(pages_text).strip()
-            except Exception:
-                # PyPDF2 not available or failed - try pdfminer if present
-                try:
-                    from pdfminer.high_level import extract_text
-                    try:
-                        ocr_text = extract_text(temp_path) or ""
-                    except Exception:
-                        ocr_text = ""
-                except Exception:
-                    ocr_text = ""
-
-            # If no selectable text found, fall back to image-based OCR if Tesseract is available.
-            if not ocr_text:
-                try:
-                    try:
-                        _ = pytesseract.get_tesseract_version()
-                        tesseract_available = True
-                    except Exception:
-                        tesseract_available = False
-
-                    if tesseract_available:
-                        images = pdf2image.convert_from_path(temp_path, poppler_path=poppler_path)
-                        ocr_text = "\n\n".join([pytesseract.image_to_string(img, lang="por") for img in images])
-                    else:
-                        # No selectable text and no Tesseract: raise a clear error to be recorded in the DB
-                        raise RuntimeError(
-                            "Nenhum texto selecionável encontrado no PDF e o Tesseract não está disponível. "
-                            "Instale o Tesseract ou adicione PyPDF2/pdfminer.six ao ambiente."
-                        )
-                except Exception:
-                    # Let outer exception handler record the error in the DB
-                    raise
+        native_extracted = None
+        if resumed_text is not None:
+            ocr_text = resumed_text
+        elif ext == ".pdf":
+            # text layer per page; only pages that fail the quality check are rendered and OCRed
+            ocr_text, pdf_pages = ocr_pipeline.extract_pdf_text(temp_path, timer, poppler_path=poppler_path, get_ocr=get_ocr_engine)
+            documents_db[doc_id]["pages"] = pdf_pages
         elif ext in [".jpg", ".jpeg", ".png"]:
             from PIL import Image
-            img = Image.open(temp_path)
-            ocr_text = pytesseract.image_to_string(img, lang="por")
+            img = Image.open(ocr_input_path)
+            engine = get_ocr_engine()
+            with timer.stage('tesseract'):
+                ocr_text = engine.image_to_string(img, lang="por")
         elif ext == ".xml":
             import xml.etree.ElementTree as ET
-            tree = ET.parse(temp_path)
-            root = tree.getroot()
-            ocr_text = "\n".join([elem.text for elem in root.iter() if elem.text])
+            with timer.stage('text_extraction'):
+                tree = ET.parse(temp_path)
+                root = tree.getroot()
+                ocr_text = "\n".join([elem.text for elem in root.iter() if elem.text])
+                # NF-e / CF-e XML: every field is already structured (doc_classifier 'native' profile)
+                try:
+                    native_extracted = _import_agent('nfe_xml').parse(root)
+                except ImportError as e:
+                    # no native parser: the XML text goes through the usual text path
+                    print(f"[PROCESSAMENTO] {doc_id} - native XML parser unavailable: {e}", file=sys.stderr)
         elif ext == ".csv":
             import csv
-            with open(temp_path, encoding="utf-8") as f:
+            with timer.stage('text_extraction'), open(temp_path, encoding="utf-8") as f:
                 reader = csv.reader(f)
                 ocr_text = "\n".join([", ".join(row) for row in reader])
         else:
             raise ValueError(f"Formato de arquivo não suportado: {ext}")
 
         documents_db[doc_id]["ocr_text"] = ocr_text
-        save_documents_db()
+        _persist()
 
         print(f"[PROCESSAMENTO] {doc_id} - Iniciando NLP", file=sys.stderr)
         documents_db[doc_id]["status"] = "nlp"
         documents_db[doc_id]["progress"] = 70
-        save_documents_db()
+        _persist()
 
-        prompt = ChatPromptTemplate.from_template(
-            """
-            Extraia os principais campos fiscais do texto abaixo e retorne um objeto JSON com os seguintes campos. Se algum campo não for encontrado, preencha com null. Considere variações de nomes, sinônimos, abreviações e formatos comuns usados em notas fiscais brasileiras, cupons fiscais, recibos, pedidos e documentos similares. Identifique campos mesmo que estejam com nomes diferentes, abreviados, em ordem distinta ou ausentes. Exemplos de variações: 'Razão Social', 'Empresa', 'Emitente', 'Fornecedor', 'Destinatário', 'Cliente', 'CNPJ', 'CPF', 'IE', 'Inscrição Estadual', 'Endereço', 'Rua', 'Logradouro', 'CFOP', 'CST', 'NCM', 'CSOSN', 'Data', 'Emissão', 'Nota', 'Chave', 'Pagamento', 'Produto', 'Descrição', 'Qtd', 'Unidade', 'Valor', 'Total', 'Recibo', 'Pedido', 'Cupom', etc. Use padrões, contexto e inferência para mapear corretamente, mesmo em documentos não estruturados. Campos:
-            - emitente: razao_social, cnpj, inscricao_estadual, endereco
-            - destinatario: razao_social, cnpj, inscricao_estadual, endereco
-            - itens: descricao, quantidade, unidade, valor_unitario, valor_total
-            - impostos: icms (aliquota, base_calculo, valor), ipi (valor), pis (valor), cofins (valor)
-            - codigos_fiscais: cfop, cst, ncm, csosn
-            - outros: numero_nota, chave_acesso, data_emissao, natureza_operacao, forma_pagamento, valor_total
-            Retorne apenas o JSON, sem explicações ou markdown. Se não encontrar campos fiscais, tente extrair os principais dados financeiros e de identificação presentes. Texto extraído:
-            {ocr_text}
-            """
-        )
+        # a valid chave de acesso (mod-11 checked) already gives numero_nota, the emitente CNPJ and the
+        # emission month: the LLM is told not to look for them and they are enforced after the merge
+        chave_info = None
+        known_fields = ""
+        try:
+            chave_acesso = _import_agent('chave_acesso')
+            with timer.stage('chave'):
+                chave_info = chave_acesso.find_valid(ocr_text, file_name)
+        except Exception as e:
+            print(f"[CHAVE] {doc_id} - chave de acesso lookup failed: {e}", file=sys.stderr)
+        # known supplier (registry keyed by the emitente CNPJ): its party fields need no extraction either
+        supplier = None
+        if chave_info and chave_info['cnpj_valido']:
+            with timer.stage('supplier_registry'):
+                supplier = supplier_registry.lookup(chave_info['cnpj'])
+        if chave_info:
+            known_fields = (
+                "Campos já identificados pela chave de acesso (não procure no texto; use exatamente estes valores): "
+                f"chave_acesso={chave_info['chave']}, numero_nota={chave_info['numero']}"
+                + (f", emitente.cnpj={chave_info['cnpj']}" if chave_info['cnpj_valido'] else "")
+                + f", data_emissao no mês {chave_info['ano']}-{chave_info['mes']:02d}."
+            )
+        if supplier:
+            known_supplier = [f"emitente.{k}={v['value']}" for k, v in supplier['fields'].items()
+                              if k in supplier_registry.FIELDS and v['confidence'] >= supplier_registry.SUPPLIER_MIN_CONFIDENCE]
+            if known_supplier:
+                known_fields += " Emitente já cadastrado (use estes valores): " + ", ".join(known_supplier) + "."
+
+        # cheapest sufficient pipeline for this document (doc_classifier.py): native XML mapping,
+        # heuristics only, one LLM call without enrichment, or the full LLM + enrichment path
+        with timer.stage('classify'):
+            route = doc_classifier.classify(ocr_text, ext, chave_info, native=native_extracted is not None)
+        route['classified'] = route['profile']
+        # an extraction that needs neither the LLM nor the merge
+        direct_extracted = native_extracted if route['profile'] == 'native' else None
+
+        # known layout (template learned from verified documents of the same emitter): extracted
+        # deterministically; the LLM only runs on a template miss or when check() rejects the output
+        if direct_extracted is None and layout_templates.LAYOUT_TEMPLATES:
+            layout_info = {'outcome': 'miss'}
+            try:
+                with timer.stage('layout_template'):
+                    layout = layout_templates.match(ocr_text, cnpj=chave_info['cnpj'] if chave_info and chave_info['cnpj_valido'] else None)
+                    if layout:
+                        candidate = layout_templates.extract(layout['template'], ocr_text)
+                        issues = layout_templates.check(candidate, chave_info, layout['template'])
+                        layout_templates.record_result(layout['fingerprint'], not issues)
+                        layout_info = {'outcome': 'rejected' if issues else 'hit', 'fingerprint': layout['fingerprint'],
+                                       'similarity': layout['similarity'], 'documents': layout['documents'], 'issues': issues}
+                        if not issues:
+                            direct_extracted = candidate
+                            route['profile'] = 'layout_template'
+            except Exception as e:
+                print(f"[LAYOUT] {doc_id} - template extraction failed: {e}", file=sys.stderr)
+            documents_db[doc_id]["layout"] = layout_info
 
+        # simple receipts: the regex parser alone, unless its result is inconsistent (then one LLM call)
+        heuristic_extracted = None
+        if direct_extracted is None and route['profile'] == 'heuristics':
+            try:
+                with timer.stage('heuristics'):
+                    heuristic_extracted = simple_receipt_parser(ocr_text)
+                insufficient = doc_classifier.sufficient(heuristic_extracted, chave_info)
+            except Exception as e:
+                insufficient = [f"heuristics failed: {e}"]
+            if insufficient:
+                route.update(profile='llm', escalated_from='heuristics', escalation_reasons=insufficient)
+            else:
+                direct_extracted = heuristic_extracted
+        # offline (EXTRACTION_MODE=heuristic or no key): regex parser, specialist line parsing and
+        # enrichment regexes, merged as usual; the per-field confidence tells what an LLM pass could fix
+        if direct_extracted is None and _offline():
+            route['profile'] = 'offline'
+        documents_db[doc_id]["route"] = route
+
+        from langchain_core.prompts import ChatPromptTemplate
+        from langchain_openai import ChatOpenAI
+        prompt = ChatPromptTemplate.from_template(EXTRACTION_PROMPT)
+
+        rate_limiter = _import_agent('rate_limiter')
         # Call the LLM but don't let LLM failures abort processing; fall back to heuristics.
         raw_extracted = None
         parsed_extracted = None
         try:
-            # Build a fallback list of free models (dynamically fetched if possible)
-            try:
-                candidate_models = get_openrouter_free_models(limit=20)
-            except Exception:
-                candidate_models = [OPENROUTER_MODEL, "minimax/minimax-m2:free"]
-            # ensure our configured preferred model is first
+            # ensure our configured preferred model is first (no model at all for a direct or offline extraction)
             models_to_try = []
-            if OPENROUTER_MODEL:
-                models_to_try.append(OPENROUTER_MODEL)
-            for m in candidate_models:
-                if m and m not in models_to_try:
-                    models_to_try.append(m)
+            if direct_extracted is None and route['profile'] != 'offline':
+                # Build a fallback list of free models (dynamically fetched if possible)
+                try:
+                    candidate_models = get_openrouter_free_models(limit=20)
+                except Exception:
+                    candidate_models = [OPENROUTER_MODEL, "minimax/minimax-m2:free"]
+                if OPENROUTER_MODEL:
+                    models_to_try.append(OPENROUTER_MODEL)
+                for m in candidate_models:
+                    if m and m not in models_to_try:
+                        models_to_try.append(m)
 
             raw_extracted = None
             last_exc = None
             succeeded = False
-            # rotate through models on auth/rate-limit errors; use small backoff between attempts
-            sleep_base = 0.5
+            # models tried, and how many of them were rate limited (all of them: park the document)
+            tried = 0
+            rate_limited = 0
+            # a small document shares one request with the other documents being processed; any
+            # document the batched answer does not cover goes through the model rotation below
+            if models_to_try and llm_batch.eligible(ocr_text) and deadline.allows('llm_extraction') \
+                    and metrics.IN_FLIGHT.value() + metrics.QUEUE_DEPTH.value() > 1:
+                with timer.stage('llm_batch'):
+                    batched = _extraction_batcher.submit(
+                        doc_id, ocr_text, known_fields,
+                        timeout=deadline.timeout(llm_batch.BATCH_TIMEOUT_SECONDS + llm_batch.BATCH_WINDOW_SECONDS))
+                route['batched'] = batched is not None
+                metrics.BATCHED_DOCUMENTS.inc(outcome='batched' if batched is not None else 'individual')
+                if batched is not None:
+                    raw_extracted = json.dumps(batched, ensure_ascii=False)
+                    succeeded = True
+                    models_to_try = []
+            # rotate through models on auth/rate-limit errors
             for idx, model_name in enumerate(models_to_try):
+                if not deadline.allows('llm_extraction'):
+                    deadline.skip('llm_extraction', f"after {idx} model attempt(s)")
+                    print(f"[LLM] {doc_id} - budget exhausted, skipping LLM extraction", file=sys.stderr)
+                    break
+                tried += 1
+                # shared quota (agents/rate_limiter.py): wait for a token, or treat the model as rate limited
+                if not rate_limiter.acquire(model_name, OPENROUTER_API_KEY, timeout=deadline.timeout(rate_limiter.RATE_LIMIT_MAX_WAIT_SECONDS)):
+                    print(f"[LLM] {doc_id} - no rate-limit token for model {model_name}, skipping it", file=sys.stderr)
+                    metrics.MODEL_FAILURES.inc(model=model_name, reason='throttled')
+                    last_exc = RuntimeError(f"rate limit: no token available for {model_name}")
+                    rate_limited += 1
+                    continue
                 try:
                     try:
                         print(f"[LLM] {doc_id} - attempting model={model_name} (masked key={_mask_key(OPENROUTER_API_KEY)})", file=sys.stderr)
                     except Exception:
                         pass
-                    llm = ChatOpenAI(api_key=OPENROUTER_API_KEY, base_url="https://openrouter.ai/api/v1", model=model_name)
-                    chain = prompt | llm
-                    result = chain.invoke({"ocr_text": ocr_text})
+                    _llm_t0 = time.perf_counter()
+                    llm_calls += 1
+                    try:
+                        # max_retries=0: the client would sleep through 429s itself; retries belong to the retry queue
+                        llm = ChatOpenAI(api_key=OPENROUTER_API_KEY, base_url=OPENROUTER_BASE_URL, model=model_name, timeout=deadline.timeout(), max_retries=0)
+                        chain = prompt | llm
+                        result = chain.invoke({"ocr_text": ocr_text, "known_fields": known_fields})
+                    finally:
+                        _llm_s = time.perf_counter() - _llm_t0
+                        timer.add('llm', _llm_s)
+                        timer.add(f'llm:{model_name}', _llm_s, observe=False)
+                    metrics.LLM_REQUEST_SECONDS.observe(_llm_s, model=model_name, outcome='ok')
                     raw_extracted = result.content if hasattr(result, "content") else str(result)
                     succeeded = True
                     if idx != 0:
@@ -852,13 +1216,16 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
                     low = msg.lower()
                     is_auth = ('401' in msg or 'user not found' in low or 'unauthoriz' in low)
                     is_rate = ('429' in msg or 'rate limit' in low or 'free-models-per-day' in low or 'rate_limit' in low)
+                    _reason = 'rate_limit' if is_rate else 'auth' if is_auth else 'error'
+                    metrics.MODEL_FAILURES.inc(model=model_name, reason=_reason)
+                    if is_rate:
+                        metrics.RATE_LIMITED.inc(model=model_name)
+                        rate_limiter.observe(model_name, OPENROUTER_API_KEY, 429, None, msg)
+                        rate_limited += 1
+                    metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - _llm_t0, model=model_name, outcome=_reason)
                     if is_rate or is_auth:
-                        # sleep a bit (exponential backoff) before trying next model
-                        try:
-                            import time
-                            time.sleep(min(5, sleep_base * (2 ** idx)))
-                        except Exception:
-                            pass
+                        # next model right away: the rate limiter paces the requests, and a document
+                        # that every model turned away is parked for a later retry (retry_queue.py)
                         continue
                     else:
                         break
@@ -868,6 +1235,25 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
             # Defensive: any unexpected error here should be recorded and processing continue via fallback heuristics
             raw_extracted = f"LLM Error: {str(e)}"
             print(f"[LLM] {doc_id} - unexpected LLM processing error: {e}", file=sys.stderr)
+            tried = rate_limited = 0
+
+        # every model rate limited: park the document and release this worker; the retry worker
+        # runs it again later. After RETRY_MAX_ATTEMPTS it is dead-lettered and falls back below.
+        if retry_queue.RETRY_QUEUE and tried and rate_limited == tried:
+            retry = retry_queue.park(doc_id, temp_path, file_name, 'llm_rate_limited', raw_extracted)
+            documents_db[doc_id]["retry"] = retry
+            if retry["status"] == "waiting":
+                print(f"[RETRY] {doc_id} - rate limited on {tried} model(s), parked until {retry['next_attempt_at']}", file=sys.stderr)
+                metrics.PARKED_DOCUMENTS.inc(outcome='parked')
+                documents_db[doc_id]["status"] = "aguardando"
+                documents_db[doc_id]["budget"] = deadline.to_dict()
+                documents_db[doc_id]["timings"] = timer.timings()
+                _record_route()
+                _persist()
+                return
+            print(f"[RETRY] {doc_id} - still rate limited after {retry['attempts']} attempt(s), dead-lettered", file=sys.stderr)
+            metrics.PARKED_DOCUMENTS.inc(outcome='dead_letter')
+            metrics.FAILURES.inc(reason='llm_rate_limited')
 
         # try to parse LLM JSON output (if any)
         def _extract_json_text(s: str):
@@ -890,6 +1276,7 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
                 return s[first:last+1]
             return None
 
+        _t0 = time.perf_counter()
         try:
             candidate_raw = raw_extracted if raw_extracted is not None else ''
             candidate_text = _extract_json_text(candidate_raw)
@@ -909,11 +1296,18 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
                 parsed_extracted = None
         except Exception:
             parsed_extracted = None
+        timer.add('json_parse', time.perf_counter() - _t0)
+        if direct_extracted is not None:
+            parsed_extracted = direct_extracted
 
         # Always compute a cheap heuristic fallback from OCR text. We'll use it to repair
         # obvious bad LLM outputs (for example when the LLM put a CPF-like token into valor_total).
         try:
-            fallback = simple_receipt_parser(ocr_text)
+            if heuristic_extracted is not None:
+                fallback = heuristic_extracted
+            else:
+                with timer.stage('heuristics'):
+                    fallback = simple_receipt_parser(ocr_text)
         except Exception:
             fallback = {}
 
@@ -941,11 +1335,12 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
             except Exception:
                 return None
 
-        def merge_extracted_sources(parsed, fallback, ocr_text, record):
+        def merge_extracted_sources(parsed, fallback, ocr_text, record, deadline=None, enrich=True):
             """Merge parsed LLM output (parsed), heuristic fallback (fallback), OCR text and other record sources.
             Returns a tuple (merged_dict, meta) where meta is a dict mapping field paths to source names
             (e.g., 'llm', 'fallback', 'ocr', 'specialist'). This aggressively fills missing item textual fields
-            from whichever source has non-garbage content.
+            from whichever source has non-garbage content. `deadline` is handed on to enrich_record;
+            `enrich=False` (the 'llm' pipeline profile) skips enrichment and its LLM lookups.
             """
             try:
                 meta = {}
@@ -1017,7 +1412,8 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
                     if sa:
                         # pass record and current outm (best-effort)
                         rec_copy = record or {}
-                        cand_lines = sa._find_product_section_lines(sa._text_sources(rec_copy)) if hasattr(sa, '_find_product_section_lines') else []
+                        # product section via the shared text context (binary raw_file excluded)
+                        cand_lines = sa.text_context.RecordTextContext(rec_copy).product_lines
                         if cand_lines:
                             ocr_cand = sa._extract_items_from_lines(cand_lines) if hasattr(sa, '_extract_items_from_lines') else []
                     else:
@@ -1032,6 +1428,8 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
                 except Exception:
                     ocr_cand = []
 
+                ocr_lines = None
+
                 # Choose base list: prefer parsed_items if present, else fallback_items, else ocr_cand
                 base = parsed_items or fallback_items or ocr_cand
                 # If lengths differ, still try to merge by index where possible
@@ -1056,7 +1454,9 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
                             if fld == 'descricao' and not v and ocr_text:
                                 try:
                                     # find lines where next line contains price
-                                    lines = [l.strip() for l in ocr_text.splitlines() if l.strip()]
+                                    if ocr_lines is None:
+                                        ocr_lines = [l.strip() for l in ocr_text.splitlines() if l.strip()]
+                                    lines = ocr_lines
                                     for idx, ln in enumerate(lines[:-1]):
                                         if re.search(r'[0-9]+[\.,][0-9]{2}', lines[idx+1]):
                                             # pick this as candidate
@@ -1077,6 +1477,9 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
                     outm['itens'] = merged_items
                     meta['itens'] = 'merged'
 
+                if not enrich:
+                    return outm, meta
+
                 # As a last step, run enrichment_agent to further fill fields
                 try:
                     import importlib
@@ -1085,10 +1488,13 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
                     temp_rec = dict(record) if isinstance(record, dict) else {'ocr_text': ocr_text}
                     temp_rec['raw_extracted'] = parsed or temp_rec.get('raw_extracted')
                     temp_rec['ocr_text'] = ocr_text
-                    new_extracted, info = ea.enrich_record({'extracted_data': outm, 'raw_extracted': parsed or {}, 'ocr_text': ocr_text})
+                    with timer.stage('enrichment'):
+                        new_extracted, info = ea.enrich_record({'extracted_data': outm, 'raw_extracted': parsed or {}, 'ocr_text': ocr_text}, deadline=deadline)
                     if isinstance(new_extracted, dict):
                         outm = new_extracted
                         meta['enrichment'] = 'enrichment_agent'
+                        for path in (info or {}).get('filled') or {}:
+                            meta[path] = 'enrichment'
                 except Exception:
                     pass
 
@@ -1096,13 +1502,47 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
             except Exception:
                 return (parsed or fallback or {}), {}
 
+        # fill the emitente from the supplier registry before merging, so enrichment skips the party
+        # heuristics (and the address parsing) for known suppliers
+        supplier_filled = []
+        try:
+            with timer.stage('supplier_registry'):
+                if supplier is None:
+                    for src in (parsed_extracted, fallback):
+                        em = src.get('emitente') if isinstance(src, dict) else None
+                        if isinstance(em, dict) and em.get('cnpj'):
+                            supplier = supplier_registry.lookup(em.get('cnpj'))
+                            break
+                if supplier:
+                    # LLM values are only completed; the regex fallback is replaced by the registry
+                    for src, overwrite in ((parsed_extracted, False), (fallback, True)):
+                        if isinstance(src, dict):
+                            if not isinstance(src.get('emitente'), dict):
+                                src['emitente'] = {}
+                            for f in supplier_registry.fill_party(src['emitente'], supplier, overwrite=overwrite):
+                                if f not in supplier_filled:
+                                    supplier_filled.append(f)
+        except Exception as e:
+            print(f"[SUPPLIER] {doc_id} - registry fill failed: {e}", file=sys.stderr)
+
         final_extracted = None
-        if parsed_extracted is None:
+        if direct_extracted is not None:
+            # XML mapping, validated template or sufficient heuristics: merging would only run the
+            # specialist and enrichment lookups again
+            final_extracted = parsed_extracted
+        elif parsed_extracted is None and route['profile'] != 'offline':
             final_extracted = fallback
         else:
             try:
                 # merge LLM parsed output, fallback heuristics, OCR text and specialist/enrichment
-                merged, meta = merge_extracted_sources(parsed_extracted, fallback, ocr_text, documents_db.get(doc_id, {}))
+                # ('merge' excludes the nested enrichment, which is timed on its own)
+                _t0 = time.perf_counter()
+                _enrich_before = timer.get('enrichment')
+                try:
+                    merged, meta = merge_extracted_sources(parsed_extracted, fallback, ocr_text, documents_db.get(doc_id, {}), deadline=deadline,
+                                                           enrich=route['profile'] in ('full', 'offline'))
+                finally:
+                    timer.add('merge', time.perf_counter() - _t0 - (timer.get('enrichment') - _enrich_before))
                 final_extracted = merged
                 if isinstance(final_extracted, dict):
                     final_extracted.setdefault('_meta', {})
@@ -1113,11 +1553,28 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
             except Exception:
                 final_extracted = parsed_extracted or fallback
 
+        # the key wins over LLM/heuristic values (also covers the path where the LLM failed and
+        # only the heuristic fallback ran, which skips enrichment_agent)
+        if chave_info and isinstance(final_extracted, dict):
+            try:
+                ea = _import_agent('enrichment_agent')
+                chave_report = {'filled': {}, 'notes': []}
+                with timer.stage('chave'):
+                    ea.apply_chave({'ocr_text': ocr_text, 'filename': file_name}, final_extracted, report=chave_report, decoded=chave_info)
+                documents_db[doc_id]["chave"] = dict(chave_report.get('chave') or {}, notes=chave_report['notes'])
+            except Exception as e:
+                print(f"[CHAVE] {doc_id} - failed to apply chave de acesso: {e}", file=sys.stderr)
+        if supplier_filled and isinstance(final_extracted, dict):
+            meta = final_extracted.setdefault('_meta', {})
+            if isinstance(meta, dict):
+                meta.update({f'emitente.{f}': supplier_registry.REGISTRY_SOURCE for f in supplier_filled})
+
         # store raw LLM output and the normalized extracted data
         documents_db[doc_id]["raw_extracted"] = raw_extracted
         # Normalize defensively: on failure try to normalize the fallback, otherwise store an empty dict.
         try:
-            normalized = normalize_extracted(final_extracted) if final_extracted is not None else {}
+            with timer.stage('normalize'):
+                normalized = normalize_extracted(final_extracted) if final_extracted is not None else {}
         except Exception:
             try:
                 normalized = normalize_extracted(fallback) if isinstance(fallback, dict) else {}
@@ -1125,26 +1582,46 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
                 normalized = {}
         # Ensure extracted_data is always a dict (clients expect an object). Keep raw_extracted separate for debugging.
         documents_db[doc_id]["extracted_data"] = normalized if isinstance(normalized, dict) else {}
+        try:
+            quality = field_confidence.score(documents_db[doc_id]["extracted_data"], chave_info)
+            quality['mode'] = ('heuristic' if route['profile'] == 'offline' else 'direct' if direct_extracted is not None
+                               else 'llm' if parsed_extracted is not None else 'fallback')
+            documents_db[doc_id]["quality"] = quality
+        except Exception as e:
+            print(f"[QUALITY] {doc_id} - confidence scoring failed: {e}", file=sys.stderr)
         # merged_extracted already prioritized parsed/fallback/ocr and ran enrichment; no extra repair step needed here
         # compute and persist aggregates for reliable dashboard aggregation
         try:
-            aggregates = compute_aggregates(normalized if isinstance(normalized, dict) else {})
+            with timer.stage('aggregates'):
+                aggregates = compute_aggregates(normalized if isinstance(normalized, dict) else {})
             documents_db[doc_id]["aggregates"] = aggregates
         except Exception as e:
             print(f"[AGG] failed to compute aggregates for {doc_id}: {e}", file=sys.stderr)
             documents_db[doc_id]["aggregates"] = {"valor_total_calc": None, "impostos_calc": {"icms":0.0,"ipi":0.0,"pis":0.0,"cofins":0.0}}
-        save_documents_db()
+        _persist()
+        with timer.stage('persistence'):
+            search_index.index_document(doc_id, documents_db[doc_id])
 
         print(f"[PROCESSAMENTO] {doc_id} - Iniciando validação", file=sys.stderr)
         documents_db[doc_id]["status"] = "validacao"
         documents_db[doc_id]["progress"] = 90
-        save_documents_db()
+        _persist()
 
         # finalização
         print(f"[PROCESSAMENTO] {doc_id} - Finalizado", file=sys.stderr)
         documents_db[doc_id]["status"] = "finalizado"
         documents_db[doc_id]["progress"] = 100
-        save_documents_db()
+        documents_db[doc_id]["budget"] = deadline.to_dict()
+        documents_db[doc_id]["timings"] = timer.timings()
+        _record_route()
+        # heuristic-only or failed-LLM extractions: weak fields wait for the refinement worker
+        quality = documents_db[doc_id].get("quality") or {}
+        if quality.get("mode") in ("heuristic", "fallback") and refinement.enqueue(doc_id, quality):
+            documents_db[doc_id]["refinement"] = {"status": "queued", "fields": refinement.fields_to_refine(quality)}
+        _finish_retry(doc_id)
+        _persist()
+        supplier_registry.observe(doc_id, documents_db[doc_id].get("extracted_data") or {})
+        layout_templates.learn(doc_id, documents_db[doc_id])
 
     except Exception as e:
         print(f"[PROCESSAMENTO] {doc_id} - ERRO: {str(e)}", file=sys.stderr)
@@ -1154,7 +1631,155 @@ def process_document(doc_id: str, temp_path: str, file_name: str):
         documents_db[doc_id]["extracted_error"] = f"Erro: {str(e)}"
         # keep extracted_data as-is (None or dict) so clients don't crash when reading it
         documents_db[doc_id]["aggregates"] = {"valor_total_calc": None, "impostos_calc": {"icms":0.0,"ipi":0.0,"pis":0.0,"cofins":0.0}}
-        save_documents_db()
+        documents_db[doc_id]["budget"] = deadline.to_dict()
+        documents_db[doc_id]["timings"] = timer.timings()
+        _record_route()
+        _dead_letter(doc_id, temp_path, file_name, e)
+        _persist()
+        # keep whatever text we got searchable (e.g. OCR succeeded but the LLM stage failed)
+        search_index.index_document(doc_id, documents_db[doc_id])
+    finally:
+        metrics.IN_FLIGHT.dec()
+        status = (documents_db.get(doc_id) or {}).get("status") or "unknown"
+        metrics.DOCUMENTS_TOTAL.inc(status=status)
+        metrics.DOCUMENT_SECONDS.observe(timer.total(), status=status)
+        if route is not None:
+            metrics.PROFILE_DOCUMENTS.inc(profile=route['profile'], type=route['type'])
+            metrics.PROFILE_SECONDS.observe(timer.total(), profile=route['profile'])
+        for skipped in deadline.skipped:
+            metrics.BUDGET_SKIPS.inc(stage=skipped.get('stage'))
+
+
+def _apply_refinement(doc_id: str, fields: List[str], values: dict) -> List[str]:
+    """Write refined values into a finalized record and refresh what derives from extracted_data
+    (normalization, aggregates, quality report, search index) in place."""
+    import copy
+    rec = documents_db.get(doc_id)
+    extracted = copy.deepcopy(rec.get("extracted_data") or {})
+    filled = refinement.apply(extracted, fields, values)
+    if filled:
+        normalized = normalize_extracted(extracted)
+        # fresh dicts, so the analytics frames rebuild this document's rows
+        rec["extracted_data"] = normalized
+        rec["aggregates"] = compute_aggregates(normalized)
+        chave = _import_agent('chave_acesso').decode(normalized.get("chave_acesso"))
+        quality = field_confidence.score(normalized, chave)
+        quality["mode"] = (rec.get("quality") or {}).get("mode")
+        rec["quality"] = quality
+    rec["refinement"] = {"status": "done", "fields": fields, "filled": filled, "refined_at": datetime.now().isoformat()}
+    save_documents_db()
+    search_index.index_document(doc_id, rec)
+    return filled
+
+
+def _refine_next_batch() -> bool:
+    """Send one batched refinement request. Returns False when nothing was due."""
+    claimed = refinement.claim(refinement.REFINE_BATCH_DOCS)
+    if not claimed:
+        return False
+    persistence.refresh_if_changed()
+    texts, ready = {}, []
+    for entry in claimed:
+        rec = documents_db.get(entry["doc_id"])
+        if not rec:
+            refinement.remove(entry["doc_id"])
+        elif rec.get("status") != "finalizado" or not rec.get("ocr_text"):
+            refinement.fail(entry["doc_id"], "record not finalized")
+        else:
+            texts[entry["doc_id"]] = rec["ocr_text"]
+            ready.append(entry)
+    batch, rest = refinement.pack(ready, texts)
+    refinement.release([e["doc_id"] for e in rest])
+    if not batch:
+        return True
+    llm_helper = _import_agent('llm_helper')
+    docs = [{"id": e["doc_id"], "text": texts[e["doc_id"]][:refinement.REFINE_BATCH_CHARS], "fields": e["fields"]} for e in batch]
+    t0 = time.perf_counter()
+    res = llm_helper.refine_documents_with_llm(docs)
+    refinement.count_request(len(docs))
+    outcome = 'ok' if res.get('ok') else res.get('reason') or 'error'
+    metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - t0, model=llm_helper.OPENROUTER_DEFAULT_MODEL, outcome=f"refinement_{outcome}")
+    if outcome == 'rate_limited':
+        # not sent: the shared quota had no token; the documents wait for the next round
+        refinement.release([e["doc_id"] for e in batch])
+        return True
+    if not res.get("ok"):
+        print(f"[REFINE] batch of {len(docs)} failed: {outcome}", file=sys.stderr)
+        # a quota error is not the documents' fault: retry them after the quota window
+        delay = 300 if outcome == 'http_429' else None
+        for e in batch:
+            refinement.fail(e["doc_id"], outcome, delay)
+            metrics.REFINED_DOCUMENTS.inc(outcome='failed')
+        return True
+    for e in batch:
+        values = res["results"].get(e["doc_id"])
+        if values is None:
+            refinement.fail(e["doc_id"], "missing from the batch answer")
+            metrics.REFINED_DOCUMENTS.inc(outcome='missing')
+            continue
+        try:
+            filled = _apply_refinement(e["doc_id"], e["fields"], values)
+            refinement.complete(e["doc_id"], filled)
+            metrics.REFINED_DOCUMENTS.inc(outcome='refined' if filled else 'unchanged')
+        except Exception as ex:
+            print(f"[REFINE] {e['doc_id']} - failed to apply: {ex}", file=sys.stderr)
+            refinement.fail(e["doc_id"], f"apply failed: {ex}")
+            metrics.REFINED_DOCUMENTS.inc(outcome='failed')
+    return True
+
+
+def _refinement_loop():
+    """One batched request per 60 / REFINE_RATE_PER_MINUTE seconds while documents are due."""
+    interval = 60.0 / max(0.1, refinement.REFINE_RATE_PER_MINUTE)
+    while True:
+        try:
+            # no LLM at all in heuristic mode (the queue keeps filling for a later run)
+            if EXTRACTION_MODE == 'heuristic' or not OPENROUTER_API_KEY:
+                time.sleep(60)
+                continue
+            _refine_next_batch()
+        except Exception as e:
+            print(f"[REFINE] worker error: {e}", file=sys.stderr)
+        time.sleep(interval)
+
+
+# files of one upload processed side by side (so small documents can share batched LLM requests)
+PROCESS_CONCURRENCY = int(os.environ.get('PROCESS_CONCURRENCY', '4'))
+
+
+def _process_uploads(jobs, concurrency: Optional[int] = None):
+    """Background task of an upload: its documents, up to `concurrency` (PROCESS_CONCURRENCY) at a time."""
+    concurrency = PROCESS_CONCURRENCY if concurrency is None else concurrency
+    if len(jobs) == 1 or concurrency <= 1:
+        for job in jobs:
+            process_document(*job)
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(jobs)), thread_name_prefix='process-document') as pool:
+        for job in jobs:
+            pool.submit(process_document, *job)
+
+
+def _retry_loop():
+    """Hand parked documents back to process_document once their next attempt is due."""
+    while True:
+        try:
+            due = retry_queue.claim(limit=max(1, PROCESS_CONCURRENCY))
+            if due:
+                jobs = []
+                for entry in due:
+                    if entry["doc_id"] not in documents_db:
+                        retry_queue.remove(entry["doc_id"])
+                        continue
+                    print(f"[RETRY] {entry['doc_id']} - attempt {entry['attempts'] + 1}", file=sys.stderr)
+                    _enqueued(entry["doc_id"])
+                    jobs.append((entry["doc_id"], entry["temp_path"], entry["file_name"]))
+                if jobs:
+                    _process_uploads(jobs)
+                continue
+        except Exception as e:
+            print(f"[RETRY] worker error: {e}", file=sys.stderr)
+        time.sleep(retry_queue.RETRY_POLL_SECONDS)
 
 
 @app.post("/api/v1/documents/upload")
@@ -1166,6 +1791,7 @@ async def upload_document(files: List[UploadFile] = File(...), background_tasks:
         raise HTTPException(status_code=400, detail="No files provided")
 
     created_ids = []
+    jobs = []
     tmp_dir = tempfile.gettempdir()
     for file in files:
         doc_id = str(uuid.uuid4())
@@ -1200,12 +1826,15 @@ async def upload_document(files: List[UploadFile] = File(...), background_tasks:
 
         # schedule background processing
         if background_tasks is not None:
-            background_tasks.add_task(process_document, doc_id, tmp_path, file.filename)
+            _enqueued(doc_id)
+            jobs.append((doc_id, tmp_path, file.filename))
         else:
             process_document(doc_id, tmp_path, file.filename)
 
         created_ids.append(doc_id)
 
+    if jobs:
+        background_tasks.add_task(_process_uploads, jobs)
     return {"message": f"Scheduled {len(created_ids)} file(s) for processing", "document_ids": created_ids}
 
 
@@ -1258,6 +1887,165 @@ async def list_documents():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/v1/analytics/summary")
+def analytics_summary(status: Optional[str] = None):
+    """Corpus-wide totals (documents, valor_total, taxes) computed on the columnar frame."""
+    try:
+        return analytics.get_corpus(documents_db).summary(status=status)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/v1/analytics/taxes")
+def analytics_taxes(by: str = 'emitente', status: Optional[str] = None, limit: Optional[int] = None):
+    """Tax totals grouped by `by` = emitente | cfop | ncm | month."""
+    if by not in analytics.GROUP_KEYS:
+        raise HTTPException(status_code=400, detail=f"Unsupported group key: {by}")
+    try:
+        return {"by": by, "groups": analytics.get_corpus(documents_db).tax_totals(by=by, status=status, limit=limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/v1/analytics/items")
+def analytics_items(by: str = 'ncm', limit: Optional[int] = None):
+    """Item value totals grouped by `by` = ncm | cfop | emitente | month."""
+    if by not in analytics.GROUP_KEYS:
+        raise HTTPException(status_code=400, detail=f"Unsupported group key: {by}")
+    try:
+        return {"by": by, "groups": analytics.get_corpus(documents_db).item_totals(by=by, limit=limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/v1/analytics/discrepancies")
+def analytics_discrepancies(tolerance: float = 0.5, min_ratio: float = 0.0, limit: int = 100):
+    """Documents whose sum(itens.valor_total) disagrees with the declared valor_total.
+    `count` is the total number of mismatching documents; `documents` lists the largest `limit`.
+    """
+    try:
+        return analytics.get_corpus(documents_db).discrepancies(tolerance=tolerance, min_ratio=min_ratio, limit=limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/v1/export")
+def export_documents(format: str = 'csv', level: str = 'document', status: Optional[str] = None,
+                     cnpj: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """Stream the store as csv | xlsx | parquet | jsonl.
+    `level=document` yields one row per nota, `level=item` one row per item. Filters: `status`,
+    emitente `cnpj` and `date_from`/`date_to` (YYYY-MM-DD, on data_emissao).
+    """
+    import importlib
+    reporting_agent = None
+    tried = []
+    for cand in ['backend.agents.reporting_agent', 'agents.reporting_agent']:
+        try:
+            reporting_agent = importlib.import_module(cand)
+            break
+        except Exception as e:
+            tried.append((cand, str(e)))
+    if reporting_agent is None:
+        raise HTTPException(status_code=500, detail=f"Reporting agent import failed, tried: {tried}")
+    fmt = (format or '').lower()
+    try:
+        stream = reporting_agent.export_stream(documents_db, fmt=fmt, level=level, status=status,
+                                               cnpj=cnpj, date_from=date_from, date_to=date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    media_type, ext = reporting_agent.EXPORT_FORMATS[fmt]
+    fname = f"notas_{level}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
+    from fastapi.responses import StreamingResponse
+    return StreamingResponse(stream, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{fname}"'})
+
+
+@app.get("/api/v1/search")
+def search_documents(q: str, limit: int = 20, offset: int = 0):
+    """Full-text search over ocr_text, item descriptions, party names and CNPJs.
+    Results are ranked (bm25) and carry highlighted snippets per matching field.
+    """
+    try:
+        res = search_index.search(q, limit=limit, offset=offset)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    for r in res['results']:
+        rec = documents_db.get(r['doc_id']) or {}
+        r['filename'] = rec.get('filename')
+        r['status'] = rec.get('status')
+        r['uploaded_at'] = rec.get('uploaded_at')
+    return {"query": q, "total": res['total'], "limit": limit, "offset": offset, "results": res['results']}
+
+
+@app.get("/api/v1/suppliers/stats")
+def supplier_registry_stats():
+    """Supplier registry size and lookup hit rate (see supplier_registry.py)."""
+    try:
+        return supplier_registry.stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/v1/suppliers/{cnpj}")
+def supplier_registry_entry(cnpj: str):
+    """Canonical emitente fields stored for a CNPJ, with confidence and supporting documents."""
+    entry = supplier_registry.lookup(cnpj, count=False)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Supplier not found")
+    return entry
+
+
+@app.get("/api/v1/retry/stats")
+def retry_stats():
+    """Rate-limited documents parked for a later retry, recoveries and the dead-letter list."""
+    stats = retry_queue.stats()
+    stats["dead_letters"] = retry_queue.dead_letters()
+    return stats
+
+
+@app.get("/api/v1/llm/rate_limits")
+def llm_rate_limits():
+    """Shared OpenRouter token buckets (all processes): tokens left, blocks after 429s, waits and denials."""
+    return _import_agent('rate_limiter').stats()
+
+
+@app.get("/api/v1/llm/batching")
+def llm_batching_stats():
+    """Batched extraction of small documents: shared requests, fallbacks and requests per document."""
+    stats = _extraction_batcher.stats()
+    stats.update(enabled=llm_batch.LLM_BATCH, token_budget=_extraction_batcher.token_budget,
+                 max_docs=_extraction_batcher.max_docs, max_doc_tokens=llm_batch.BATCH_MAX_DOC_TOKENS)
+    return stats
+
+
+@app.get("/api/v1/refinement/stats")
+def refinement_stats():
+    """Deferred refinement queue: documents per status, requests sent, documents per request."""
+    return refinement.stats()
+
+
+@app.get("/api/v1/quality/fields")
+def quality_fields():
+    """Mean confidence and missing rate per field, per extraction mode (see field_confidence.py)."""
+    return field_confidence.summarize(documents_db)
+
+
+@app.get("/api/v1/pipeline/profiles")
+def pipeline_profiles():
+    """Documents, escalations and cost per pipeline profile (see doc_classifier.py)."""
+    return doc_classifier.summarize(documents_db)
+
+
+@app.get("/api/v1/layouts/stats")
+def layout_template_stats():
+    """Layout templates learned and how often they replaced the LLM extraction (see layout_templates.py)."""
+    try:
+        return layout_templates.stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/api/v1/documents/{doc_id}/enrich")
 async def enrich_document_endpoint(doc_id: str):
     """Run the enrichment heuristics on a single stored document and persist changes.
@@ -1288,6 +2076,7 @@ async def enrich_document_endpoint(doc_id: str):
         documents_db[doc_id]["extracted_data"] = new_extracted
         documents_db[doc_id]["aggregates"] = info.get('aggregates')
         save_documents_db()
+        search_index.index_document(doc_id, documents_db[doc_id])
         return {"message": "enriched", "filled": info.get('report', {}).get('filled', {}), "aggregates": documents_db[doc_id]["aggregates"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1338,10 +2127,63 @@ def admin_repair_from_raw(doc_id: str):
         documents_db[doc_id]['extracted_data'] = normalized
         documents_db[doc_id]['aggregates'] = ag
         save_documents_db()
+    search_index.index_document(doc_id, documents_db[doc_id])
 
     return {"doc_id": doc_id, "replaced": replaced, "aggregates": documents_db[doc_id].get('aggregates')}
 
 
+@app.get("/api/v1/admin/dead_letters")
+def admin_dead_letters(reason: Optional[str] = None, limit: int = 100):
+    """Admin: failed documents on the dead-letter list (optionally of one reason) and the count per reason."""
+    if reason and reason not in retry_queue.REASONS:
+        raise HTTPException(status_code=400, detail=f"reason must be one of {', '.join(retry_queue.REASONS)}")
+    return {"counts": retry_queue.stats()["dead_by_reason"], "documents": retry_queue.dead_letters(reason=reason, limit=limit)}
+
+
+@app.post("/api/v1/admin/dead_letters/backfill")
+def admin_backfill_dead_letters():
+    """Admin: add the stored 'erro' documents that are not on the dead-letter list yet (reason taken
+    from their `extracted_error`)."""
+    added = retry_queue.backfill(list(documents_db.values()))
+    for doc_id, rec in list(documents_db.items()):
+        if rec.get("status") == "erro" and not isinstance(rec.get("retry"), dict):
+            rec["retry"] = {"status": "dead", "reason": retry_queue.classify(rec.get("extracted_error"))}
+    save_documents_db()
+    return {"added": added}
+
+
+@app.post("/api/v1/admin/dead_letters/retry")
+def admin_retry_dead_letters(reason: Optional[str] = None, limit: int = 50, concurrency: int = PROCESS_CONCURRENCY,
+                             background_tasks: BackgroundTasks = None):
+    """Admin: process the dead letters of `reason` (or all of them) again, `concurrency` documents at a time."""
+    if reason and reason not in retry_queue.REASONS:
+        raise HTTPException(status_code=400, detail=f"reason must be one of {', '.join(retry_queue.REASONS)}")
+    jobs = []
+    for entry in retry_queue.reopen(reason=reason, limit=limit):
+        rec = documents_db.get(entry["doc_id"])
+        if rec is None:
+            retry_queue.remove(entry["doc_id"])
+            continue
+        # 'waiting' lets process_document reuse the stored OCR text and close the entry when it finishes
+        rec["retry"] = {"status": "waiting", "reason": entry["reason"], "attempts": 0}
+        rec["status"] = "aguardando"
+        _enqueued(entry["doc_id"])
+        jobs.append((entry["doc_id"], entry["temp_path"] or rec.get("tmp_path"), entry["file_name"] or rec.get("filename")))
+    save_documents_db()
+    if jobs:
+        if background_tasks is not None:
+            background_tasks.add_task(_process_uploads, jobs, max(1, concurrency))
+        else:
+            _process_uploads(jobs, max(1, concurrency))
+    return {"scheduled": len(jobs), "reason": reason, "concurrency": max(1, concurrency), "document_ids": [j[0] for j in jobs]}
+
+
+@app.get("/api/v1/failures")
+def failure_counts(bucket: str = "hour", hours: float = 24):
+    """Failures per reason over time (per hour or day of the last `hours` hours)."""
+    return retry_queue.failure_counts(bucket=bucket, hours=hours)
+
+
 @app.post("/api/v1/admin/recompute_aggregates")
 def admin_recompute_aggregates():
     """Admin: recompute aggregates for all stored documents from their `extracted_data`.
@@ -1382,7 +2224,8 @@ def admin_reload_db():
         except Exception:
             pass
         count = len(persistence.documents_db)
-        return {"reloaded": True, "loaded_records": count}
+        indexed = search_index.sync(persistence.documents_db)
+        return {"reloaded": True, "loaded_records": count, "search_index": indexed}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1416,6 +2259,7 @@ def admin_clear_db(backup: bool = True):
             documents_db.clear()
         # persist empty DB to disk
         save_documents_db()
+        search_index.clear()
         return {"cleared": True, "backup": os.path.basename(backup_path) if backup_path else None, "loaded_records": len(persistence.documents_db or documents_db)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1444,5 +2288,7 @@ def admin_db_info():
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False)
+    import uvicorn
+    # API_WORKERS > 1 runs several processes sharing documents_db.json (see persistence.py)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False, workers=int(os.environ.get('API_WORKERS', '1')))
                         
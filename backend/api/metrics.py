@@ -0,0 +1,186 @@
+"""Pipeline instrumentation: Prometheus text-format metrics and per-document stage timings.
+
+prometheus_client is not a dependency, so this is a small hand-rolled registry (counters,
+gauges, histograms with labels) rendered in the Prometheus text exposition format (0.0.4) by
+`render()`, which main serves on GET /metrics.
+
+`StageTimer` is what `process_document` uses: `with timer.stage('ocr_text'): ...` observes
+`fiscal_stage_duration_seconds{stage=...}` and accumulates the seconds per stage for the compact
+breakdown stored in the record under 'timings'.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# seconds; covers sub-ms JSON parsing up to multi-minute LLM rotations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_registry_lock = threading.Lock()
+_registry: List['_Metric'] = []
+
+
+def _escape(v: str) -> str:
+    return str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _fmt(v: float) -> str:
+    if v == float('inf'):
+        return '+Inf'
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{self._labels(k)} {_fmt(v)}' for k, v in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = []
+        for key, row in items:
+            for i, b in enumerate(self.buckets):
+                out.append(f'{self.name}_bucket{self._labels(key, ("le", _fmt(b)))} {_fmt(row[i])}')
+            out.append(f'{self.name}_sum{self._labels(key)} {_fmt(row[-2])}')
+            out.append(f'{self.name}_count{self._labels(key)} {_fmt(row[-1])}')
+        return out
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    return '\n'.join(m.render() for m in metrics) + '\n'
+
+
+# --- pipeline metrics -------------------------------------------------------------------------
+
+STAGE_SECONDS = Histogram('fiscal_stage_duration_seconds', 'Duration of process_document stages.', ['stage'])
+LLM_REQUEST_SECONDS = Histogram('fiscal_llm_request_duration_seconds', 'Duration of LLM extraction calls per model.', ['model', 'outcome'])
+DOCUMENT_SECONDS = Histogram('fiscal_document_duration_seconds', 'End-to-end process_document duration.', ['status'])
+DOCUMENTS_TOTAL = Counter('fiscal_documents_processed_total', 'Documents that finished processing.', ['status'])
+CACHE_HITS = Counter('fiscal_cache_hits_total', 'Cache hits.', ['cache'])
+CACHE_MISSES = Counter('fiscal_cache_misses_total', 'Cache misses.', ['cache'])
+MODEL_FAILURES = Counter('fiscal_llm_model_failures_total', 'Failed LLM extraction calls per model.', ['model', 'reason'])
+RATE_LIMITED = Counter('fiscal_llm_rate_limited_total', 'LLM calls rejected with HTTP 429 / rate limit.', ['model'])
+BUDGET_SKIPS = Counter('fiscal_budget_skipped_stages_total', 'Stages skipped because the document budget ran low.', ['stage'])
+PROFILE_DOCUMENTS = Counter('fiscal_pipeline_profile_documents_total', 'Documents per pipeline profile and document type.', ['profile', 'type'])
+PROFILE_SECONDS = Histogram('fiscal_pipeline_profile_duration_seconds', 'process_document duration per pipeline profile.', ['profile'])
+REFINED_DOCUMENTS = Counter('fiscal_refinement_documents_total', 'Documents handled by the deferred LLM refinement worker.', ['outcome'])
+BATCHED_DOCUMENTS = Counter('fiscal_llm_batched_documents_total', 'Small documents offered to a batched extraction request.', ['outcome'])
+PARKED_DOCUMENTS = Counter('fiscal_retry_documents_total', 'Rate-limited documents parked, recovered or dead-lettered by the retry queue.', ['outcome'])
+FAILURES = Counter('fiscal_document_failures_total', 'Failed documents per structured failure reason (see retry_queue.REASONS).', ['reason'])
+QUEUE_DEPTH = Gauge('fiscal_queue_depth', 'Uploaded documents waiting for processing.')
+IN_FLIGHT = Gauge('fiscal_documents_in_flight', 'Documents currently in process_document.')
+
+
+class StageTimer:
+    """Times the stages of one document; `timings()` is the compact breakdown stored in the record."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self._stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name: str, seconds: float, observe: bool = True):
+        self._stages[name] = self._stages.get(name, 0.0) + seconds
+        if observe:
+            STAGE_SECONDS.observe(seconds, stage=name)
+
+    def get(self, name: str) -> float:
+        return self._stages.get(name, 0.0)
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def timings(self) -> Dict[str, float]:
+        out = {k: round(v, 4) for k, v in self._stages.items()}
+        out['total'] = round(self.total(), 4)
+        return out
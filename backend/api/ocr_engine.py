@@ -0,0 +1,168 @@
+"""OCR engine shared by every document of the process.
+
+`pytesseract.image_to_string` starts a new `tesseract` process for every page or image, and that
+process loads the `por` traineddata again each time. The pipeline also spawned
+`tesseract --version` for every PDF just to check that OCR was available. This module does both
+once per process:
+
+- 'tesserocr' engine: a pool of tesserocr.PyTessBaseAPI instances (OCR_WORKERS, default
+  min(2, CPUs)). Each instance keeps the language model loaded, and the pool is reused across
+  documents. tesserocr releases the GIL while recognizing, so the instances run in parallel
+  from the worker threads.
+- 'pytesseract' engine: the previous behaviour (one CLI call per image). It is used when tesserocr
+  is not installed or cannot load the language.
+
+OCR_ENGINE selects the engine: 'auto' (default; tesserocr when usable), 'tesserocr' or
+'pytesseract'. `get_engine()` returns the process-wide engine. Its `available()` result is cached,
+and a negative result is re-checked after OCR_RECHECK_SECONDS, so installing Tesseract does not
+need a restart. `image_to_string` has the pytesseract signature, and a timeout raises
+RuntimeError('Tesseract process timeout') like pytesseract.
+"""
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Optional
+
+OCR_ENGINE = os.environ.get('OCR_ENGINE', 'auto').lower()
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS') or min(2, os.cpu_count() or 1))
+OCR_RECHECK_SECONDS = float(os.environ.get('OCR_RECHECK_SECONDS', '300'))
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+class PytesseractEngine:
+    """One `tesseract` subprocess per image (pytesseract)."""
+
+    name = 'pytesseract'
+
+    def __init__(self, tesseract_cmd: Optional[str] = None):
+        import pytesseract
+        if tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+        self._pytesseract = pytesseract
+        self._available: Optional[bool] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _cached(self) -> Optional[bool]:
+        if self._available is False and time.monotonic() - self._checked_at >= OCR_RECHECK_SECONDS:
+            return None
+        return self._available
+
+    def available(self) -> bool:
+        """Whether `tesseract --version` works; checked once (negative results expire)."""
+        cached = self._cached()
+        if cached is not None:
+            return cached
+        with self._lock:
+            cached = self._cached()
+            if cached is not None:
+                return cached
+            try:
+                self._pytesseract.get_tesseract_version()
+                self._available = True
+            except Exception as e:
+                print(f"[OCR] tesseract not available: {e}", file=sys.stderr)
+                self._available = False
+            self._checked_at = time.monotonic()
+            return self._available
+
+    def image_to_string(self, image, lang: str = 'por', timeout: float = 0) -> str:
+        return self._pytesseract.image_to_string(image, lang=lang, timeout=timeout)
+
+    def close(self):
+        pass
+
+
+class TesserocrEngine:
+    """Pool of tesserocr API instances with the language model loaded once per instance."""
+
+    name = 'tesserocr'
+
+    def __init__(self, workers: int = OCR_WORKERS, lang: str = 'por'):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.path, langs = tesserocr.get_languages(os.environ.get('TESSDATA_PREFIX') or '')
+        if lang not in langs:
+            raise RuntimeError(f"tesserocr: language {lang!r} not found in {self.path!r} (available: {langs})")
+        self.lang = lang
+        self.workers = max(1, workers)
+        self._pool: 'queue.Queue' = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        # load the first model now so a broken install shows up here, not on the first document
+        self._pool.put(self._new_api())
+
+    def _new_api(self):
+        api = self._tesserocr.PyTessBaseAPI(path=self.path, lang=self.lang)
+        self._created += 1
+        return api
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.workers:
+                return self._new_api()
+        return self._pool.get()
+
+    def available(self) -> bool:
+        return True
+
+    def image_to_string(self, image, lang: str = 'por', timeout: float = 0) -> str:
+        if lang != self.lang:
+            # other languages are rare here; do not keep a second set of models loaded
+            with self._tesserocr.PyTessBaseAPI(path=self.path, lang=lang) as api:
+                return self._recognize(api, image, timeout)
+        api = self._acquire()
+        try:
+            return self._recognize(api, image, timeout)
+        finally:
+            api.Clear()
+            self._pool.put(api)
+
+    def _recognize(self, api, image, timeout: float) -> str:
+        api.SetImage(image)
+        if not api.Recognize(timeout=int((timeout or 0) * 1000)):
+            raise RuntimeError('Tesseract process timeout')
+        return api.GetUTF8Text()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().End()
+            except queue.Empty:
+                break
+
+
+def _create_engine(tesseract_cmd: Optional[str]):
+    if OCR_ENGINE in ('auto', 'tesserocr'):
+        try:
+            engine = TesserocrEngine()
+            print(f"[OCR] using tesserocr ({engine.workers} instance(s), tessdata {engine.path})", file=sys.stderr)
+            return engine
+        except Exception as e:
+            if OCR_ENGINE == 'tesserocr':
+                print(f"[OCR] OCR_ENGINE=tesserocr but it cannot be used ({e}); falling back to pytesseract", file=sys.stderr)
+            else:
+                print(f"[OCR] tesserocr not usable ({e}); using pytesseract", file=sys.stderr)
+    elif OCR_ENGINE != 'pytesseract':
+        print(f"[OCR] unknown OCR_ENGINE={OCR_ENGINE!r}; using pytesseract", file=sys.stderr)
+    return PytesseractEngine(tesseract_cmd)
+
+
+def get_engine(tesseract_cmd: Optional[str] = None):
+    """The process-wide OCR engine, created on first use. `tesseract_cmd` is only used by the
+    pytesseract engine (main.TESSERACT_CMD)."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = _create_engine(tesseract_cmd)
+    return _engine
+
@@ -0,0 +1,228 @@
+"""Per-page PDF text extraction with selective OCR.
+
+PDFs used to be all-or-nothing: if the text layer of the whole document was non-empty it was used
+as is, otherwise every page was rendered and OCRed. A mixed PDF (text cover page + scanned DANFE
+pages) therefore never OCRed the pages that needed it.
+
+`extract_pdf_text` reads the text layer page by page and checks each page (`check_page_text`):
+- enough characters (PDF_TEXT_MIN_CHARS, default 40);
+- a low share of garbage characters (PDF_TEXT_MAX_GARBAGE, default 0.25): replacement/control
+  characters, `(cid:NN)` glyph references, symbols outside the usual receipt punctuation;
+- at least one fiscal pattern (CNPJ, money, date, chave de acesso, fiscal keywords), unless the text
+  is long (PDF_TEXT_RICH_CHARS, default 600).
+
+Only the pages that fail are rendered and OCRed, at most PDF_MAX_OCR_PAGES per document (default
+20; the rest are marked as skipped). Each page's source, check results and seconds end up in the
+record under 'pages'.
+
+Rendering streams one page at a time (`render_pages`): pdftoppm writes a grayscale image of a
+single page to a temporary directory, the page is OCRed and the file is deleted before the next one
+is rendered, so memory stays flat however many pages the PDF has. The DPI is chosen per page from
+its size (`render_dpi`): PDF_RENDER_DPI (default 200, the pdf2image default used before) unless the
+longest side would exceed PDF_RENDER_MAX_SIDE pixels (default 3500), never below
+PDF_RENDER_MIN_DPI (default 150).
+"""
+import os
+import re
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+PDF_TEXT_MIN_CHARS = int(os.environ.get('PDF_TEXT_MIN_CHARS', '40'))
+PDF_TEXT_MAX_GARBAGE = float(os.environ.get('PDF_TEXT_MAX_GARBAGE', '0.25'))
+PDF_TEXT_RICH_CHARS = int(os.environ.get('PDF_TEXT_RICH_CHARS', '600'))
+PDF_MAX_OCR_PAGES = int(os.environ.get('PDF_MAX_OCR_PAGES', '20'))
+PDF_RENDER_DPI = int(os.environ.get('PDF_RENDER_DPI', '200'))
+PDF_RENDER_MIN_DPI = int(os.environ.get('PDF_RENDER_MIN_DPI', '150'))
+PDF_RENDER_MAX_SIDE = int(os.environ.get('PDF_RENDER_MAX_SIDE', '3500'))
+
+_FISCAL_PATTERNS = {
+    'cnpj': re.compile(r'\b\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}\b'),
+    'money': re.compile(r'\b\d{1,3}(?:\.\d{3})*,\d{2}\b'),
+    'date': re.compile(r'\b\d{2}/\d{2}/\d{2,4}\b'),
+    'chave': re.compile(r'(?:\d{4}\s?){10}\d{4}'),
+    'keyword': re.compile(r'CNPJ|ICMS|CFOP|NCM|DANFE|NF-?e|NOTA FISCAL|VALOR TOTAL|CUPOM', re.IGNORECASE),
+}
+_CID_RE = re.compile(r'\(cid:\d+\)')
+# characters expected in receipts besides letters/digits/whitespace
+_PLAIN_PUNCT = set('.,;:/\\-_()[]{}%$+*#@&\'"!?=<>|ºª°§')
+
+
+def check_page_text(text: str) -> Dict[str, Any]:
+    """Quality check of one page's text layer: {'ok', 'reason', 'chars', 'garbage_ratio', 'fiscal_hits'}."""
+    text = text or ''
+    cids = _CID_RE.findall(text)
+    clean = _CID_RE.sub('', text)
+    visible = [ch for ch in clean if not ch.isspace()]
+    garbage = sum(1 for ch in visible if not (ch.isalnum() or ch in _PLAIN_PUNCT)) + len(cids)
+    chars = len(visible)
+    garbage_ratio = garbage / max(1, chars + len(cids))
+    fiscal_hits = sum(1 for rx in _FISCAL_PATTERNS.values() if rx.search(clean))
+    if chars < PDF_TEXT_MIN_CHARS:
+        reason = 'too_short'
+    elif garbage_ratio > PDF_TEXT_MAX_GARBAGE:
+        reason = 'garbage'
+    elif fiscal_hits == 0 and chars < PDF_TEXT_RICH_CHARS:
+        reason = 'no_fiscal_patterns'
+    else:
+        reason = None
+    return {'ok': reason is None, 'reason': reason, 'chars': chars,
+            'garbage_ratio': round(garbage_ratio, 3), 'fiscal_hits': fiscal_hits}
+
+
+def read_text_layer(path: str) -> Optional[List[str]]:
+    """Text layer per page (PyPDF2, else pdfminer). None when neither can read the file."""
+    try:
+        from PyPDF2 import PdfReader
+        pages = []
+        with open(path, 'rb') as f:
+            reader = PdfReader(f)
+            for p in reader.pages:
+                try:
+                    pages.append(p.extract_text() or '')
+                except Exception:
+                    pages.append('')
+        return pages
+    except Exception:
+        pass
+    try:
+        from pdfminer.high_level import extract_text
+        # pdfminer separates pages with form feeds
+        pages = (extract_text(path) or '').split('\f')
+        if len(pages) > 1 and not pages[-1].strip():
+            pages.pop()
+        return pages
+    except Exception:
+        return None
+
+
+def _page_count(path: str, poppler_path: Optional[str]) -> int:
+    try:
+        import pdf2image
+        return int(pdf2image.pdfinfo_from_path(path, poppler_path=poppler_path).get('Pages') or 1)
+    except Exception:
+        return 1
+
+
+def page_sizes(path: str) -> Optional[List[Tuple[float, float]]]:
+    """(width, height) in points of each page (PyPDF2 mediabox); None when it cannot be read."""
+    try:
+        from PyPDF2 import PdfReader
+        with open(path, 'rb') as f:
+            return [(float(p.mediabox.width), float(p.mediabox.height)) for p in PdfReader(f).pages]
+    except Exception:
+        return None
+
+
+def render_dpi(size: Optional[Tuple[float, float]]) -> int:
+    """DPI for a page of `size` points: PDF_RENDER_DPI, lowered so the longest side stays within
+    PDF_RENDER_MAX_SIDE pixels, but not below PDF_RENDER_MIN_DPI."""
+    if not size or max(size) <= 0:
+        return PDF_RENDER_DPI
+    dpi = min(PDF_RENDER_DPI, int(PDF_RENDER_MAX_SIDE * 72 / max(size)))
+    return max(PDF_RENDER_MIN_DPI, dpi)
+
+
+def render_pages(path: str, page_numbers: List[int], poppler_path: Optional[str] = None,
+                 sizes: Optional[List[Tuple[float, float]]] = None):
+    """Yield (page number, grayscale PIL image or None, dpi) for `page_numbers`, one page at a time.
+
+    The image is closed and its temporary file deleted when the next page is requested (or the
+    generator is closed), so only one rendered page exists at any time.
+    """
+    import pdf2image
+    from PIL import Image
+    with tempfile.TemporaryDirectory(prefix='fiscal-render-') as tmp:
+        for no in page_numbers:
+            dpi = render_dpi(sizes[no - 1] if sizes and no <= len(sizes) else None)
+            files = pdf2image.convert_from_path(path, dpi=dpi, poppler_path=poppler_path, first_page=no, last_page=no,
+                                                grayscale=True, output_folder=tmp, paths_only=True)
+            if not files:
+                yield no, None, dpi
+                continue
+            img = Image.open(files[0])
+            try:
+                yield no, img, dpi
+            finally:
+                img.close()
+                for f in files:
+                    try:
+                        os.remove(f)
+                    except OSError:
+                        pass
+
+
+def extract_pdf_text(path: str, timer, poppler_path: Optional[str] = None,
+                     get_ocr: Optional[Callable[[], Any]] = None) -> Tuple[str, List[Dict[str, Any]]]:
+    """Text of the PDF plus one entry per page describing where it came from.
+
+    `timer` is the document's metrics.StageTimer and `get_ocr` returns the shared OCR engine
+    (main.get_ocr_engine, see ocr_engine.py). The latency budget does not apply here: every page that
+    needs OCR (up to PDF_MAX_OCR_PAGES) is OCRed. Raises RuntimeError when the PDF has no usable text
+    at all and OCR is unavailable.
+    """
+    t0 = time.perf_counter()
+    layer = read_text_layer(path)
+    timer.add('text_extraction', time.perf_counter() - t0)
+    if layer is None:
+        layer = [''] * _page_count(path, poppler_path)
+
+    pages: List[Dict[str, Any]] = []
+    texts: List[str] = []
+    for i, text in enumerate(layer):
+        check = check_page_text(text)
+        pages.append(dict(page=i + 1, source='text_layer' if check['ok'] else None, **check))
+        texts.append(text or '')
+
+    pending = [i for i, p in enumerate(pages) if not p['ok']]
+    engine = None
+    if pending and get_ocr is not None:
+        try:
+            engine = get_ocr()
+            if not engine.available():
+                engine = None
+        except Exception:
+            engine = None
+    if pending and engine is None:
+        if not any(t.strip() for t in texts):
+            raise RuntimeError(
+                "Nenhum texto selecionável encontrado no PDF e o Tesseract não está disponível. "
+                "Instale o Tesseract ou adicione PyPDF2/pdfminer.six ao ambiente."
+            )
+        for i in pending:
+            pages[i]['source'] = 'text_layer_unverified' if texts[i].strip() else 'empty'
+
+    if pending and engine is not None and len(pending) > PDF_MAX_OCR_PAGES:
+        print(f"[OCR] {os.path.basename(path)}: {len(pending)} pages need OCR; only the first {PDF_MAX_OCR_PAGES} are processed", file=sys.stderr)
+        for j in pending[PDF_MAX_OCR_PAGES:]:
+            pages[j]['source'] = 'text_layer_unverified' if texts[j].strip() else 'skipped'
+            pages[j]['skip_reason'] = 'page_cap'
+        pending = pending[:PDF_MAX_OCR_PAGES]
+
+    if pending and engine is not None:
+        renderer = render_pages(path, [i + 1 for i in pending], poppler_path, page_sizes(path))
+        try:
+            for i in pending:
+                page = pages[i]
+                page_t0 = time.perf_counter()
+                with timer.stage('pdf_render'):
+                    _, image, page['dpi'] = next(renderer)
+                with timer.stage('tesseract'):
+                    ocr = engine.image_to_string(image, lang="por") if image is not None else ''
+                page['seconds'] = round(time.perf_counter() - page_t0, 4)
+                page['ocr_chars'] = len(ocr.strip())
+                # keep the text layer when OCR found less than it (e.g. page failed only the pattern check)
+                if ocr.strip() and len(ocr.strip()) >= len(texts[i].strip()):
+                    texts[i] = ocr
+                    page['source'] = 'ocr'
+                else:
+                    page['source'] = 'text_layer_unverified' if texts[i].strip() else 'empty'
+        finally:
+            renderer.close()
+
+    by_source: Dict[str, int] = {}
+    for p in pages:
+        by_source[p['source']] = by_source.get(p['source'], 0) + 1
+    print(f"[OCR] {os.path.basename(path)}: {len(pages)} page(s) {by_source}", file=sys.stderr)
+    return "\n\n".join(t for t in texts).strip(), pages
@@ -1,10 +1,34 @@
+"""JSON document store shared by every API worker process.
+
+`documents_db` is an in-memory dict per process, persisted to DATA_STORE_PATH. Several processes
+(uvicorn --workers N, maintenance scripts) can use the same file:
+
+- Every write holds an exclusive lock on DATA_STORE_PATH + '.lock' (fcntl/msvcrt), so saves from
+  different processes are serialized.
+- Each process remembers a hash per record as of its last sync with the file. On save, when the file
+  changed since then, the save does a 3-way merge per record: records this process changed (hash
+  differs from the synced one) are written as they are in memory, and every other record, including
+  records added or deleted by other workers, is taken from the file. Two workers that change the
+  same record still race (the last save wins for that record), but neither drops the other's records.
+- Reads see other workers' updates through `refresh_if_changed()`. It stats the file, and when the
+  file changed it pulls in the records this process did not modify locally. main.py calls it before
+  serving each request.
+"""
 import os
 import json
 import threading
 import tempfile
 import shutil
 import sys
+from contextlib import contextmanager
 from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 # Path to the JSON DB file. Allow override via DOCUMENTS_DB_PATH env var for safe testing and recovery.
 DATA_STORE_PATH = os.environ.get('DOCUMENTS_DB_PATH') or os.path.join(os.path.dirname(__file__), 'documents_db.json')
@@ -12,15 +36,128 @@ DATA_STORE_PATH = os.environ.get('DOCUMENTS_DB_PATH') or os.path.join(os.path.di
 # In-memory store and lock
 documents_db = {}
 _db_lock = threading.Lock()
+# The store is loaded lazily (API startup, first request or first save) instead of at import time.
+# `_loaded` guards save_documents_db() from overwriting the file with a store that was never read.
+_loaded = False
+_load_lock = threading.RLock()
 
+# record hashes and file signature as of the last load/save/refresh of this process
+_synced_hashes: Dict[str, Optional[int]] = {}
+_synced_sig: Optional[Tuple[int, int, int]] = None
 
-def load_documents_db():
+
+def _file_sig(path: str = None) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path or DATA_STORE_PATH)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+@contextmanager
+def _file_lock():
+    """Exclusive cross-process lock on DATA_STORE_PATH + '.lock' (blocks until acquired)."""
+    path = DATA_STORE_PATH + '.lock'
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10 s; keep waiting like flock does
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
+
+
+def _dump_record(rec: Any) -> str:
+    """A record as it appears in the file (value of a top-level key, indent=2)."""
+    return json.dumps(rec, ensure_ascii=False, indent=2).replace('\n', '\n  ')
+
+
+def _hash(text: str) -> int:
+    # hashes never leave the process, so the (per-process salted) builtin hash is enough and much
+    # cheaper than hashing the UTF-8 bytes of a multi-MB store on every save
+    return hash(text)
+
+
+def _record_hash(rec: Any) -> Optional[int]:
+    try:
+        return _hash(_dump_record(rec))
+    except Exception:
+        # record being mutated by another thread / not serializable: treat it as locally modified
+        return None
+
+
+def _replace_store(data):
+    """Swap the store contents in place so references held by other modules stay valid."""
     global documents_db
+    if not isinstance(data, dict):
+        data = {}
+    if documents_db is data:
+        return
+    documents_db.clear()
+    documents_db.update(data)
+
+
+def _mark_synced():
+    global _synced_hashes, _synced_sig
+    _synced_hashes = {k: _record_hash(v) for k, v in list(documents_db.items())}
+    _synced_sig = _file_sig()
+
+
+def _read_disk() -> Dict[str, Any]:
+    with open(DATA_STORE_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data if isinstance(data, dict) else {}
+
+
+def is_loaded() -> bool:
+    return _loaded
+
+
+def ensure_loaded():
+    """Load the DB once. Records added to the in-memory store before the load (e.g. by a script
+    that imported main and saved right away) are kept on top of what is on disk."""
+    if _loaded:
+        return
+    with _load_lock:
+        if _loaded:
+            return
+        pending = dict(documents_db)
+        load_documents_db()
+        if pending:
+            documents_db.update(pending)
+            # pending records count as local changes for the next save
+            for k in pending:
+                _synced_hashes.pop(k, None)
+
+
+def load_documents_db():
+    global _loaded
+    with _load_lock:
+        _load_documents_db()
+        _mark_synced()
+        _loaded = True
+
+
+def _load_documents_db():
     try:
         if os.path.exists(DATA_STORE_PATH):
             try:
-                with open(DATA_STORE_PATH, 'r', encoding='utf-8') as f:
-                    documents_db = json.load(f)
+                _replace_store(_read_disk())
             except Exception as e_load:
                 # Move corrupted DB aside and attempt to recover from backup if present
                 ts = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -35,55 +172,148 @@ def load_documents_db():
                 if os.path.exists(bak):
                     try:
                         with open(bak, 'r', encoding='utf-8') as f2:
-                            documents_db = json.load(f2)
+                            _replace_store(json.load(f2))
                         # write recovered backup back to main path atomically
-                        save_documents_db()
+                        with _db_lock, _file_lock():
+                            _write_file({k: _dump_record(v) for k, v in documents_db.items()})
                         print(f"[PERSIST] recovered documents_db from backup {bak}", file=sys.stderr)
                         return
                     except Exception as e_bak:
                         print(f"[PERSIST] backup read failed: {e_bak}", file=sys.stderr)
-                documents_db = {}
+                _replace_store({})
         else:
-            documents_db = {}
+            _replace_store({})
     except Exception as e:
         print(f"[PERSIST] failed to load documents_db: {e}", file=sys.stderr)
-        documents_db = {}
+        _replace_store({})
+
+
+def _merge_from_disk(disk: Dict[str, Any], local_hashes: Dict[str, Optional[int]]) -> Tuple[int, Dict[str, Optional[int]]]:
+    """3-way merge of `disk` into the in-memory store, using the hashes of the last sync as base.
+
+    Records this process added, changed or deleted since the last sync are left alone; every other
+    record is taken from `disk` (including records other processes added or deleted). Returns how
+    many in-memory records changed and the synced hashes that now describe `disk`.
+    """
+    changed = 0
+    synced: Dict[str, Optional[int]] = {}
+    for doc_id in set(disk) | set(local_hashes) | set(_synced_hashes):
+        base = _synced_hashes.get(doc_id)
+        mine = local_hashes.get(doc_id)
+        locally_modified = doc_id in local_hashes and (mine is None or mine != base)
+        locally_deleted = doc_id not in local_hashes and doc_id in _synced_hashes
+        if locally_modified or locally_deleted:
+            # still pending locally: keep the old base so the next save writes our version
+            if doc_id in _synced_hashes and doc_id in disk:
+                synced[doc_id] = base
+            continue
+        if doc_id in disk:
+            theirs = _record_hash(disk[doc_id])
+            synced[doc_id] = theirs
+            if theirs != mine:
+                documents_db[doc_id] = disk[doc_id]
+                changed += 1
+        elif doc_id in documents_db:
+            # deleted by another process
+            documents_db.pop(doc_id, None)
+            changed += 1
+    return changed, synced
+
+
+def disk_changed() -> bool:
+    """Cheap check (one stat) whether another process saved since this one last synced."""
+    return _loaded and _file_sig() != _synced_sig
+
+
+def refresh_if_changed() -> int:
+    """Pull other processes' updates into the in-memory store. Returns the number of records changed."""
+    global _synced_hashes, _synced_sig
+    if not disk_changed():
+        return 0
+    with _db_lock, _file_lock():
+        sig = _file_sig()
+        if sig is None or sig == _synced_sig:
+            return 0
+        try:
+            disk = _read_disk()
+        except Exception as e:
+            print(f"[PERSIST] refresh failed to read {DATA_STORE_PATH}: {e}", file=sys.stderr)
+            return 0
+        local_hashes = {k: _record_hash(v) for k, v in list(documents_db.items())}
+        changed, _synced_hashes = _merge_from_disk(disk, local_hashes)
+        _synced_sig = sig
+    if changed:
+        print(f"[PERSIST] refreshed {changed} record(s) saved by another process", file=sys.stderr)
+    return changed
 
 
 def save_documents_db():
+    ensure_loaded()
+    _write_documents_db()
+
+
+def _write_documents_db():
+    global _synced_hashes, _synced_sig
     try:
-        with _db_lock:
-            dirpath = os.path.dirname(DATA_STORE_PATH)
-            fd, tmp = tempfile.mkstemp(prefix='documents_db_', suffix='.tmp', dir=dirpath)
-            try:
-                with os.fdopen(fd, 'w', encoding='utf-8') as f:
-                    json.dump(documents_db, f, ensure_ascii=False, indent=2)
-                    f.flush()
-                    try:
-                        os.fsync(f.fileno())
-                    except Exception:
-                        # not critical on some platforms
-                        pass
-                # Make a rotated backup of the previous DB (best-effort)
+        with _db_lock, _file_lock():
+            parts = {doc_id: _dump_record(rec) for doc_id, rec in list(documents_db.items())}
+            local_hashes = {k: _hash(v) for k, v in parts.items()}
+            if _file_sig() != _synced_sig and os.path.exists(DATA_STORE_PATH):
+                # another process saved since our last sync: keep its records unless we changed them
                 try:
-                    if os.path.exists(DATA_STORE_PATH):
-                        bak = DATA_STORE_PATH + '.bak'
-                        shutil.copy2(DATA_STORE_PATH, bak)
-                except Exception as e_bak:
-                    print(f"[PERSIST] warning: failed to write backup: {e_bak}", file=sys.stderr)
-                # replace atomically
-                os.replace(tmp, DATA_STORE_PATH)
-            finally:
-                # cleanup temp if still exists
-                try:
-                    if os.path.exists(tmp):
-                        os.remove(tmp)
-                except Exception:
-                    pass
+                    disk = _read_disk()
+                except Exception as e_read:
+                    print(f"[PERSIST] warning: could not read {DATA_STORE_PATH} for merge, overwriting: {e_read}", file=sys.stderr)
+                    disk = None
+                if disk is not None:
+                    changed, _ = _merge_from_disk(disk, local_hashes)
+                    if changed:
+                        parts = {doc_id: _dump_record(rec) for doc_id, rec in list(documents_db.items())}
+                        local_hashes = {k: _hash(v) for k, v in parts.items()}
+            _write_file(parts)
+            _synced_hashes = local_hashes
+            _synced_sig = _file_sig()
     except Exception as e:
         print(f"[PERSIST] failed to save documents_db: {e}", file=sys.stderr)
 
 
+def _write_file(parts: Dict[str, str]):
+    """Atomically replace DATA_STORE_PATH with the pre-serialized records (same layout as
+    json.dump(..., indent=2)). Caller holds the file lock."""
+    dirpath = os.path.dirname(DATA_STORE_PATH)
+    fd, tmp = tempfile.mkstemp(prefix='documents_db_', suffix='.tmp', dir=dirpath)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            if parts:
+                f.write('{\n')
+                f.write(',\n'.join(f'  {json.dumps(k, ensure_ascii=False)}: {v}' for k, v in parts.items()))
+                f.write('\n}')
+            else:
+                f.write('{}')
+            f.flush()
+            try:
+                os.fsync(f.fileno())
+            except Exception:
+                # not critical on some platforms
+                pass
+        # Make a rotated backup of the previous DB (best-effort)
+        try:
+            if os.path.exists(DATA_STORE_PATH):
+                bak = DATA_STORE_PATH + '.bak'
+                shutil.copy2(DATA_STORE_PATH, bak)
+        except Exception as e_bak:
+            print(f"[PERSIST] warning: failed to write backup: {e_bak}", file=sys.stderr)
+        # replace atomically
+        os.replace(tmp, DATA_STORE_PATH)
+    finally:
+        # cleanup temp if still exists
+        try:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        except Exception:
+            pass
+
+
 if __name__ == '__main__':
     # quick smoke test
     load_documents_db()
@@ -0,0 +1,224 @@
+"""Image preprocessing (OpenCV) before Tesseract, run in a process pool.
+
+Phone photos of receipts (the 4000 px JPGs in assets/) went straight to Tesseract. At that size
+OCR is slow, and the background, the skew and the uneven lighting cost accuracy. A pipeline is
+a named list of steps, each with its own parameters:
+
+- downscale: cap the longest side (IMAGE_MAX_SIDE, default 2000 px);
+- grayscale;
+- crop: keep the bounding box of the largest bright region (the paper) when it covers a sensible
+  share of the photo;
+- deskew: rotate by the angle of the text block (minAreaRect of dark pixels), within +-max_angle;
+- binarize: adaptive Gaussian threshold.
+
+PIPELINES holds the presets: 'receipt' (all steps), 'light' (downscale + grayscale) and 'none'.
+IMAGE_PREPROCESS_PIPELINE selects the preset, default 'receipt'. Resolved pipelines are cached.
+Results are cached on disk by image content and pipeline (PREPROCESS_CACHE_DIR), so reprocessing
+a document does not redo the work.
+
+The OpenCV work is CPU-bound, so `preprocess_image` runs it in a shared ProcessPoolExecutor
+(IMAGE_PREPROCESS_WORKERS, default min(4, CPUs)) and falls back to running inline if the pool
+fails.
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+IMAGE_PREPROCESS_PIPELINE = os.environ.get('IMAGE_PREPROCESS_PIPELINE', 'receipt')
+IMAGE_MAX_SIDE = int(os.environ.get('IMAGE_MAX_SIDE', '2000'))
+IMAGE_PREPROCESS_WORKERS = int(os.environ.get('IMAGE_PREPROCESS_WORKERS') or min(4, os.cpu_count() or 1))
+PREPROCESS_CACHE_DIR = os.environ.get('PREPROCESS_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'fiscal-preprocess-cache')
+
+PIPELINES: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {
+    'receipt': [
+        ('downscale', {'max_side': IMAGE_MAX_SIDE}),
+        ('grayscale', {}),
+        ('crop', {'min_area': 0.15, 'max_area': 0.97, 'pad': 0.01}),
+        ('deskew', {'min_angle': 0.5, 'max_angle': 10.0}),
+        ('binarize', {'block_size': 31, 'c': 15}),
+    ],
+    'light': [
+        ('downscale', {'max_side': IMAGE_MAX_SIDE}),
+        ('grayscale', {}),
+    ],
+    'none': [],
+}
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _downscale(img, max_side=2000):
+    import cv2
+    h, w = img.shape[:2]
+    if max(h, w) <= max_side:
+        return img, {}
+    scale = max_side / float(max(h, w))
+    img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    return img, {'scale': round(scale, 4)}
+
+
+def _grayscale(img):
+    import cv2
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img, {}
+
+
+def _crop(img, min_area=0.15, max_area=0.97, pad=0.01):
+    import cv2
+    h, w = img.shape[:2]
+    blur = cv2.GaussianBlur(img, (5, 5), 0)
+    _, paper = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    k = max(5, (min(h, w) // 40) | 1)
+    paper = cv2.morphologyEx(paper, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (k, k)))
+    contours, _ = cv2.findContours(paper, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return img, {}
+    x, y, cw, ch = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    share = (cw * ch) / float(w * h)
+    if share < min_area or share > max_area:
+        return img, {'crop_share': round(share, 3), 'cropped': False}
+    px, py = int(w * pad), int(h * pad)
+    x0, y0 = max(0, x - px), max(0, y - py)
+    x1, y1 = min(w, x + cw + px), min(h, y + ch + py)
+    return img[y0:y1, x0:x1], {'crop_box': [x0, y0, x1, y1], 'crop_share': round(share, 3), 'cropped': True}
+
+
+def _deskew(img, min_angle=0.5, max_angle=10.0):
+    import cv2
+    import numpy as np
+    _, ink = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    coords = cv2.findNonZero(ink)
+    if coords is None or len(coords) < 100:
+        return img, {}
+    # minAreaRect reports [-90, 0) or (0, 90] depending on the OpenCV version; fold to [-45, 45)
+    angle = ((float(cv2.minAreaRect(coords)[-1]) + 45.0) % 90.0) - 45.0
+    if abs(angle) < min_angle or abs(angle) > max_angle:
+        return img, {'angle': round(float(angle), 2), 'rotated': False}
+    h, w = img.shape[:2]
+    m = cv2.getRotationMatrix2D((w / 2.0, h / 2.0), angle, 1.0)
+    img = cv2.warpAffine(img, m, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return np.ascontiguousarray(img), {'angle': round(float(angle), 2), 'rotated': True}
+
+
+def _binarize(img, block_size=31, c=15):
+    import cv2
+    block_size = max(3, int(block_size) | 1)
+    return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, c), {}
+
+
+_STEPS = {
+    'downscale': _downscale,
+    'grayscale': _grayscale,
+    'crop': _crop,
+    'deskew': _deskew,
+    'binarize': _binarize,
+}
+
+
+@lru_cache(maxsize=32)
+def resolve_pipeline(name: str) -> Tuple[Tuple[str, Tuple[Tuple[str, Any], ...]], ...]:
+    """Validated, hashable form of PIPELINES[name] (cached)."""
+    if name not in PIPELINES:
+        raise ValueError(f"unknown preprocessing pipeline {name!r} (choose from {sorted(PIPELINES)})")
+    steps = []
+    for step, params in PIPELINES[name]:
+        if step not in _STEPS:
+            raise ValueError(f"unknown preprocessing step {step!r} in pipeline {name!r}")
+        steps.append((step, tuple(sorted(params.items()))))
+    return tuple(steps)
+
+
+def _pipeline_key(steps) -> str:
+    return hashlib.sha1(repr(steps).encode('utf-8')).hexdigest()[:12]
+
+
+def run_pipeline(src_path: str, steps, out_path: str) -> Dict[str, Any]:
+    """Apply `steps` to the image at `src_path` and write a PNG to `out_path` (runs in the pool)."""
+    import cv2
+    import numpy as np
+    t0 = time.perf_counter()
+    # imdecode handles non-ASCII paths on Windows and applies the EXIF orientation of phone photos
+    img = cv2.imdecode(np.fromfile(src_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"could not decode image {src_path}")
+    info: Dict[str, Any] = {'original_size': [int(img.shape[1]), int(img.shape[0])], 'steps': []}
+    for step, params in steps:
+        s0 = time.perf_counter()
+        img, details = _STEPS[step](img, **dict(params))
+        info['steps'].append(dict(step=step, seconds=round(time.perf_counter() - s0, 4), **details))
+    if not cv2.imwrite(out_path, img):
+        raise ValueError(f"could not write {out_path}")
+    info['size'] = [int(img.shape[1]), int(img.shape[0])]
+    info['seconds'] = round(time.perf_counter() - t0, 4)
+    return info
+
+
+def executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=max(1, IMAGE_PREPROCESS_WORKERS))
+    return _executor
+
+
+def preprocess_image(path: str, pipeline: Optional[str] = None, timeout: Optional[float] = None) -> Tuple[str, Dict[str, Any]]:
+    """Preprocessed copy of the image at `path` for OCR: (png path, info).
+
+    Returns (path, {'pipeline': 'none'}) when the pipeline has no steps. Raises when OpenCV cannot
+    process the image; callers then OCR the original.
+    """
+    name = pipeline or IMAGE_PREPROCESS_PIPELINE
+    steps = resolve_pipeline(name)
+    if not steps:
+        return path, {'pipeline': name}
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:20]
+    os.makedirs(PREPROCESS_CACHE_DIR, exist_ok=True)
+    base = os.path.join(PREPROCESS_CACHE_DIR, f"{digest}_{_pipeline_key(steps)}")
+    out_path, info_path = base + '.png', base + '.json'
+    if os.path.exists(out_path) and os.path.exists(info_path):
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+            info['cached'] = True
+            return out_path, info
+        except Exception:
+            pass
+
+    tmp_out = f"{base}.{os.getpid()}.{threading.get_ident()}.png"
+    try:
+        try:
+            info = executor().submit(run_pipeline, path, steps, tmp_out).result(timeout=timeout)
+        except FutureTimeout:
+            raise
+        except Exception as e:
+            if isinstance(e, ValueError):
+                raise
+            # broken pool (e.g. a worker was killed): run inline rather than fail the document
+            print(f"[PREPROC] process pool failed ({e}); running inline", file=sys.stderr)
+            info = run_pipeline(path, steps, tmp_out)
+        os.replace(tmp_out, out_path)
+    finally:
+        if os.path.exists(tmp_out):
+            try:
+                os.remove(tmp_out)
+            except Exception:
+                pass
+    info['pipeline'] = name
+    try:
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+    except Exception as e:
+        print(f"[PREPROC] could not cache info for {path}: {e}", file=sys.stderr)
+    info['cached'] = False
+    return out_path, info
@@ -0,0 +1,252 @@
+"""Deferred LLM refinement of missing / low-confidence fields (SQLite queue, stdlib only).
+
+With EXTRACTION_MODE=deferred a document is finished by the heuristics alone (the 'offline'
+route), so upload latency no longer depends on the LLM. The fields that its `quality` report
+(field_confidence.py) lists as missing or low are queued here. The same happens when the inline
+LLM extraction failed. A background worker in main.py drains the queue at the rate the free models
+allow (REFINE_RATE_PER_MINUTE, default 10 requests per minute):
+
+- `enqueue(doc_id, quality)` queues the document with its missing + low fields. The lowest mean
+  confidence goes first. A document without such fields leaves the queue.
+- `claim(limit)` hands out up to `limit` due documents and leases them for REFINE_LEASE_SECONDS.
+  Several API workers can drain the same queue, and the documents of a worker that died come back
+  once the lease expires.
+- `pack(claimed, texts)` keeps the documents whose text fits REFINE_BATCH_CHARS, for one prompt
+  with per-document ids (llm_helper.refine_documents_with_llm). The rest are released untouched.
+- `apply(extracted, fields, values)` writes the refined values of the requested fields only,
+  marked `llm_refinement` in `_meta`. main.py then normalizes again and updates the aggregates,
+  the quality report and the search index in place.
+- `complete()` / `fail()` close a claim. A failure is retried with exponential backoff, and after
+  REFINE_MAX_ATTEMPTS attempts the document is marked failed.
+
+The queue lives next to the JSON DB (override with REFINEMENT_PATH). REFINEMENT=0 disables the
+worker (documents are still queued).
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+_DEFAULT_DB = os.environ.get('DOCUMENTS_DB_PATH') or os.path.join(os.path.dirname(__file__), 'documents_db.json')
+REFINEMENT_PATH = os.environ.get('REFINEMENT_PATH') or os.path.join(os.path.dirname(os.path.abspath(_DEFAULT_DB)), 'refinement_queue.sqlite3')
+REFINEMENT = os.environ.get('REFINEMENT', '1') != '0'
+REFINE_RATE_PER_MINUTE = float(os.environ.get('REFINE_RATE_PER_MINUTE', '10'))
+REFINE_BATCH_DOCS = int(os.environ.get('REFINE_BATCH_DOCS', '4'))
+REFINE_BATCH_CHARS = int(os.environ.get('REFINE_BATCH_CHARS', '12000'))
+REFINE_MAX_ATTEMPTS = int(os.environ.get('REFINE_MAX_ATTEMPTS', '3'))
+REFINE_LEASE_SECONDS = float(os.environ.get('REFINE_LEASE_SECONDS', '300'))
+REFINE_RETRY_SECONDS = float(os.environ.get('REFINE_RETRY_SECONDS', '60'))
+
+REFINE_SOURCE = 'llm_refinement'
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is not None:
+        return _conn
+    with _lock:
+        if _conn is not None:
+            return _conn
+        conn = sqlite3.connect(REFINEMENT_PATH, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS refinement_queue ('
+            'doc_id TEXT PRIMARY KEY, fields TEXT, mean REAL, status TEXT, attempts INTEGER, '
+            'next_at REAL, enqueued_at TEXT, updated_at TEXT, last_error TEXT)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS refinement_due ON refinement_queue (status, next_at)')
+        conn.execute('CREATE TABLE IF NOT EXISTS refinement_stats (name TEXT PRIMARY KEY, value INTEGER)')
+        conn.commit()
+        _conn = conn
+        return _conn
+
+
+def _bump(conn: sqlite3.Connection, name: str, by: int = 1):
+    conn.execute('INSERT INTO refinement_stats (name, value) VALUES (?, ?) '
+                 'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value', (name, by))
+
+
+def fields_to_refine(quality: Optional[Dict[str, Any]]) -> List[str]:
+    if not isinstance(quality, dict):
+        return []
+    return list(dict.fromkeys((quality.get('missing') or []) + (quality.get('low') or [])))
+
+
+def enqueue(doc_id: str, quality: Optional[Dict[str, Any]]) -> bool:
+    """Queue the missing / low-confidence fields of a finished document. Returns True when queued. Never raises."""
+    fields = fields_to_refine(quality)
+    try:
+        with _lock:
+            conn = _connect()
+            if not fields:
+                conn.execute("DELETE FROM refinement_queue WHERE doc_id=? AND status != 'running'", (doc_id,))
+                conn.commit()
+                return False
+            now = datetime.now().isoformat()
+            conn.execute(
+                'INSERT INTO refinement_queue (doc_id, fields, mean, status, attempts, next_at, enqueued_at, updated_at, last_error) '
+                "VALUES (?, ?, ?, 'pending', 0, ?, ?, ?, NULL) "
+                "ON CONFLICT(doc_id) DO UPDATE SET fields=excluded.fields, mean=excluded.mean, status='pending', "
+                'attempts=0, next_at=excluded.next_at, updated_at=excluded.updated_at, last_error=NULL',
+                (doc_id, json.dumps(fields), float(quality.get('mean') or 0.0), time.time(), now, now),
+            )
+            _bump(conn, 'enqueued')
+            conn.commit()
+            return True
+    except Exception as e:
+        print(f"[REFINE] failed to enqueue {doc_id}: {e}", file=sys.stderr)
+        return False
+
+
+def claim(limit: int = REFINE_BATCH_DOCS) -> List[Dict[str, Any]]:
+    """Lease up to `limit` due documents (pending, or running with an expired lease)."""
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        # BEGIN IMMEDIATE: workers in other processes cannot claim the same rows in between
+        conn.execute('BEGIN IMMEDIATE')
+        rows = conn.execute(
+            "SELECT doc_id, fields, attempts FROM refinement_queue WHERE status IN ('pending', 'running') AND next_at <= ? "
+            'ORDER BY mean, enqueued_at LIMIT ?', (now, max(1, limit))).fetchall()
+        for doc_id, _, _ in rows:
+            conn.execute("UPDATE refinement_queue SET status='running', next_at=?, updated_at=? WHERE doc_id=?",
+                         (now + REFINE_LEASE_SECONDS, datetime.now().isoformat(), doc_id))
+        conn.commit()
+    return [{'doc_id': doc_id, 'fields': json.loads(fields or '[]'), 'attempts': attempts} for doc_id, fields, attempts in rows]
+
+
+def pack(claimed: List[Dict[str, Any]], texts: Dict[str, str], max_chars: int = REFINE_BATCH_CHARS) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Split claimed documents into (one prompt's worth, the rest). The first document always fits
+    (its text is cut to `max_chars`)."""
+    batch, rest, used = [], [], 0
+    for entry in claimed:
+        size = len(texts.get(entry['doc_id']) or '')
+        if batch and used + size > max_chars:
+            rest.append(entry)
+            continue
+        batch.append(entry)
+        used += min(size, max_chars)
+    return batch, rest
+
+
+def release(doc_ids: List[str]):
+    """Give claimed documents back without counting an attempt (not sent, or the quota ran out)."""
+    with _lock:
+        conn = _connect()
+        conn.executemany("UPDATE refinement_queue SET status='pending', next_at=? WHERE doc_id=? AND status='running'",
+                         [(time.time(), d) for d in doc_ids])
+        conn.commit()
+
+
+def remove(doc_id: str):
+    with _lock:
+        conn = _connect()
+        conn.execute('DELETE FROM refinement_queue WHERE doc_id=?', (doc_id,))
+        conn.commit()
+
+
+def complete(doc_id: str, filled: List[str]):
+    with _lock:
+        conn = _connect()
+        conn.execute("UPDATE refinement_queue SET status='done', updated_at=?, last_error=NULL WHERE doc_id=?",
+                     (datetime.now().isoformat(), doc_id))
+        _bump(conn, 'documents_refined')
+        _bump(conn, 'fields_filled', len(filled))
+        conn.commit()
+
+
+def fail(doc_id: str, error: str, delay: Optional[float] = None) -> str:
+    """Count a failed attempt. Returns the new status ('pending' with backoff, or 'failed')."""
+    with _lock:
+        conn = _connect()
+        row = conn.execute('SELECT attempts FROM refinement_queue WHERE doc_id=?', (doc_id,)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        status = 'failed' if attempts >= REFINE_MAX_ATTEMPTS else 'pending'
+        wait = REFINE_RETRY_SECONDS * 2 ** (attempts - 1) if delay is None else delay
+        conn.execute('UPDATE refinement_queue SET status=?, attempts=?, next_at=?, updated_at=?, last_error=? WHERE doc_id=?',
+                     (status, attempts, time.time() + wait, datetime.now().isoformat(), str(error)[:300], doc_id))
+        _bump(conn, 'failures')
+        conn.commit()
+    return status
+
+
+def count_request(documents: int):
+    with _lock:
+        conn = _connect()
+        _bump(conn, 'requests')
+        _bump(conn, 'documents_sent', documents)
+        conn.commit()
+
+
+def _get(data: Dict[str, Any], path: str) -> Any:
+    cur: Any = data
+    for part in path.split('.'):
+        if not isinstance(cur, dict):
+            return None
+        cur = cur.get(part)
+    return cur
+
+
+def _set(data: Dict[str, Any], path: str, value: Any):
+    parts = path.split('.')
+    cur = data
+    for part in parts[:-1]:
+        if not isinstance(cur.get(part), dict):
+            cur[part] = {}
+        cur = cur[part]
+    cur[parts[-1]] = value
+
+
+def apply(extracted: Dict[str, Any], fields: List[str], values: Dict[str, Any]) -> List[str]:
+    """Write the refined values of `fields` into `extracted` (in place). Returns the fields set."""
+    if not isinstance(values, dict):
+        return []
+    meta = extracted.setdefault('_meta', {})
+    filled = []
+    for path in fields:
+        value = _get(values, path)
+        if value in (None, '', [], {}):
+            continue
+        if path == 'itens' and not (isinstance(value, list) and all(isinstance(it, dict) for it in value)):
+            continue
+        _set(extracted, path, value)
+        if isinstance(meta, dict):
+            meta[path] = REFINE_SOURCE
+        filled.append(path)
+    return filled
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        conn = _connect()
+        counters = dict(conn.execute('SELECT name, value FROM refinement_stats').fetchall())
+        by_status = dict(conn.execute('SELECT status, count(*) FROM refinement_queue GROUP BY status').fetchall())
+        due = conn.execute("SELECT count(*) FROM refinement_queue WHERE status='pending' AND next_at <= ?", (time.time(),)).fetchone()[0]
+    requests_sent = counters.get('requests', 0)
+    return {
+        'queue': by_status,
+        'due': due,
+        'requests': requests_sent,
+        'documents_sent': counters.get('documents_sent', 0),
+        'documents_per_request': round(counters.get('documents_sent', 0) / requests_sent, 2) if requests_sent else None,
+        'documents_refined': counters.get('documents_refined', 0),
+        'fields_filled': counters.get('fields_filled', 0),
+        'failures': counters.get('failures', 0),
+        'enqueued': counters.get('enqueued', 0),
+    }
+
+
+def clear():
+    with _lock:
+        conn = _connect()
+        conn.execute('DELETE FROM refinement_queue')
+        conn.execute('DELETE FROM refinement_stats')
+        conn.commit()
@@ -0,0 +1,289 @@
+"""Delay queue for rate-limited documents and dead-letter store for failed ones (SQLite, stdlib only).
+
+The model rotation in process_document used to sleep between rate-limited attempts
+(time.sleep(min(5, 0.5 * 2**idx))). The worker thread sat idle while other uploads waited. Now the
+rotation moves straight on to the next model, and the shared rate limiter
+(agents/rate_limiter.py) does the pacing. A document whose every model attempt was rate limited
+is parked here and its worker is released:
+
+- `park(doc_id, temp_path, file_name, reason, error)` counts an attempt and schedules the next
+  one after RETRY_BASE_SECONDS * 2**(attempts - 1) (at most RETRY_MAX_DELAY_SECONDS), +/-
+  RETRY_JITTER, so the documents parked by one burst of 429s do not all come back together. The
+  record shows status 'aguardando' and its `retry` entry.
+- `claim(limit)` hands due documents to the retry worker in main.py and leases them for
+  RETRY_LEASE_SECONDS. The worker runs process_document again with a fresh latency budget; the
+  stored OCR text is reused.
+- After RETRY_MAX_ATTEMPTS parked attempts, `park()` moves the document to the dead-letter list
+  (status 'dead') instead. The document is then finished with the heuristic fallback, as before,
+  and stays listed in `dead_letters()`.
+- `remove(doc_id)` drops the entry once the document finished.
+
+Documents whose processing raised (status 'erro') are dead-lettered right away by
+`dead_letter()`, with a structured reason from `classify()` (REASONS: ocr_unavailable,
+llm_rate_limited, parse_error, unsupported_format, internal_error). Every failure is also logged
+as an event, so `failure_counts()` gives the counts per hour or day. `reopen(reason)` takes dead
+letters back out (attempts reset) for the admin retry endpoint, which runs them in parallel
+batches. `backfill()` indexes the 'erro' records stored before this index existed.
+
+The queue lives next to the JSON DB (override with RETRY_QUEUE_PATH). RETRY_QUEUE=0 disables
+parking (rate-limited documents fall back to the heuristics right away).
+"""
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+_DEFAULT_DB = os.environ.get('DOCUMENTS_DB_PATH') or os.path.join(os.path.dirname(__file__), 'documents_db.json')
+RETRY_QUEUE_PATH = os.environ.get('RETRY_QUEUE_PATH') or os.path.join(os.path.dirname(os.path.abspath(_DEFAULT_DB)), 'retry_queue.sqlite3')
+RETRY_QUEUE = os.environ.get('RETRY_QUEUE', '1') != '0'
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', '4'))
+RETRY_BASE_SECONDS = float(os.environ.get('RETRY_BASE_SECONDS', '30'))
+RETRY_MAX_DELAY_SECONDS = float(os.environ.get('RETRY_MAX_DELAY_SECONDS', '900'))
+RETRY_JITTER = float(os.environ.get('RETRY_JITTER', '0.25'))
+RETRY_LEASE_SECONDS = float(os.environ.get('RETRY_LEASE_SECONDS', '600'))
+RETRY_POLL_SECONDS = float(os.environ.get('RETRY_POLL_SECONDS', '5'))
+
+REASONS = ('ocr_unavailable', 'llm_rate_limited', 'parse_error', 'unsupported_format', 'internal_error')
+
+_OCR_UNAVAILABLE_RE = re.compile(r'tesseract.*(not installed|not in your path|não está disponível|not found)|poppler|unable to get page count')
+# an HTTP 429 answer, not any '429' in the message (a file name, CNPJ or amount can contain it)
+_RATE_LIMITED_RE = re.compile(r'(?:status(?:_code| code)?|error code|http(?:/[\d.]+)?)\W{0,3}429\b|'
+                              r'too many requests|rate limit exceeded|free-models-per-(?:min|day)')
+_PARSE_ERROR_RE = re.compile(r'not well-formed|syntax error|no element found|codec can\'t decode|expecting value|'
+                             r'eof marker|invalid pdf|pdfreaderror|cannot identify image file|truncated')
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+_rng = random.Random()
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is not None:
+        return _conn
+    with _lock:
+        if _conn is not None:
+            return _conn
+        conn = sqlite3.connect(RETRY_QUEUE_PATH, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS retry_queue ('
+            'doc_id TEXT PRIMARY KEY, temp_path TEXT, file_name TEXT, reason TEXT, status TEXT, attempts INTEGER, '
+            'next_at REAL, parked_at TEXT, updated_at TEXT, last_error TEXT)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS retry_due ON retry_queue (status, next_at)')
+        conn.execute('CREATE TABLE IF NOT EXISTS retry_stats (name TEXT PRIMARY KEY, value INTEGER)')
+        conn.execute('CREATE TABLE IF NOT EXISTS failure_events (doc_id TEXT, reason TEXT, at REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS failure_events_at ON failure_events (at)')
+        conn.commit()
+        _conn = conn
+        return _conn
+
+
+def _bump(conn: sqlite3.Connection, name: str, by: int = 1):
+    conn.execute('INSERT INTO retry_stats (name, value) VALUES (?, ?) '
+                 'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value', (name, by))
+
+
+def _log_failure(conn: sqlite3.Connection, doc_id: str, reason: str, at: Optional[float] = None):
+    conn.execute('INSERT INTO failure_events (doc_id, reason, at) VALUES (?, ?, ?)', (doc_id, reason, at or time.time()))
+
+
+def classify(error: Any) -> str:
+    """Failure reason (one of REASONS) of an exception raised by process_document, or of its stored
+    `extracted_error` text."""
+    name = type(error).__name__ if isinstance(error, BaseException) else ''
+    msg = str(error or '').lower()
+    if 'formato de arquivo não suportado' in msg or 'unsupported file' in msg:
+        return 'unsupported_format'
+    if name == 'TesseractNotFoundError' or _OCR_UNAVAILABLE_RE.search(msg):
+        return 'ocr_unavailable'
+    response = getattr(error, 'response', None)
+    status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if status == 429 or name == 'RateLimitError' or _RATE_LIMITED_RE.search(msg):
+        return 'llm_rate_limited'
+    if name in ('ParseError', 'JSONDecodeError', 'UnicodeDecodeError', 'PdfReadError', 'UnidentifiedImageError') or _PARSE_ERROR_RE.search(msg):
+        return 'parse_error'
+    return 'internal_error'
+
+
+def backoff(attempts: int) -> float:
+    """Seconds until attempt `attempts + 1`: exponential, capped, with +/- RETRY_JITTER."""
+    delay = min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return max(0.0, delay * (1 + _rng.uniform(-RETRY_JITTER, RETRY_JITTER)))
+
+
+def park(doc_id: str, temp_path: str, file_name: str, reason: str, error: Optional[str] = None) -> Dict[str, Any]:
+    """Count a failed attempt and schedule the next one, or dead-letter the document after
+    RETRY_MAX_ATTEMPTS. Returns the record's `retry` entry (status 'waiting' or 'dead')."""
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        row = conn.execute('SELECT attempts, parked_at FROM retry_queue WHERE doc_id=?', (doc_id,)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        dead = attempts >= RETRY_MAX_ATTEMPTS
+        next_at = None if dead else now + backoff(attempts)
+        stamp = datetime.now().isoformat()
+        conn.execute(
+            'INSERT INTO retry_queue (doc_id, temp_path, file_name, reason, status, attempts, next_at, parked_at, updated_at, last_error) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(doc_id) DO UPDATE SET temp_path=excluded.temp_path, file_name=excluded.file_name, reason=excluded.reason, '
+            'status=excluded.status, attempts=excluded.attempts, next_at=excluded.next_at, updated_at=excluded.updated_at, '
+            'last_error=excluded.last_error',
+            (doc_id, temp_path, file_name, reason, 'dead' if dead else 'waiting', attempts, next_at or now,
+             row[1] if row else stamp, stamp, (error or '')[:300]),
+        )
+        _bump(conn, 'dead_lettered' if dead else 'parked')
+        _log_failure(conn, doc_id, reason)
+        conn.commit()
+    entry = {'status': 'dead' if dead else 'waiting', 'reason': reason, 'attempts': attempts}
+    if next_at is not None:
+        entry['next_attempt_at'] = datetime.fromtimestamp(next_at).isoformat()
+    return entry
+
+
+def dead_letter(doc_id: str, temp_path: str, file_name: str, reason: str, error: Optional[str] = None,
+                at: Optional[float] = None) -> Dict[str, Any]:
+    """Put a failed document on the dead-letter list (no automatic retry). Returns the record's `retry` entry."""
+    reason = reason if reason in REASONS else 'internal_error'
+    stamp = datetime.fromtimestamp(at).isoformat() if at else datetime.now().isoformat()
+    with _lock:
+        conn = _connect()
+        row = conn.execute('SELECT attempts, parked_at FROM retry_queue WHERE doc_id=?', (doc_id,)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        conn.execute(
+            'INSERT INTO retry_queue (doc_id, temp_path, file_name, reason, status, attempts, next_at, parked_at, updated_at, last_error) '
+            "VALUES (?, ?, ?, ?, 'dead', ?, ?, ?, ?, ?) "
+            "ON CONFLICT(doc_id) DO UPDATE SET temp_path=excluded.temp_path, file_name=excluded.file_name, reason=excluded.reason, "
+            "status='dead', attempts=excluded.attempts, next_at=excluded.next_at, updated_at=excluded.updated_at, last_error=excluded.last_error",
+            (doc_id, temp_path, file_name, reason, attempts, at or time.time(), row[1] if row else stamp, stamp, (error or '')[:300]),
+        )
+        _bump(conn, 'dead_lettered')
+        _log_failure(conn, doc_id, reason, at)
+        conn.commit()
+    return {'status': 'dead', 'reason': reason, 'attempts': attempts}
+
+
+def claim(limit: int = 4) -> List[Dict[str, Any]]:
+    """Lease up to `limit` due documents (waiting, or running with an expired lease)."""
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        # BEGIN IMMEDIATE: workers in other processes cannot claim the same rows in between
+        conn.execute('BEGIN IMMEDIATE')
+        rows = conn.execute(
+            "SELECT doc_id, temp_path, file_name, attempts FROM retry_queue WHERE status IN ('waiting', 'running') AND next_at <= ? "
+            'ORDER BY next_at LIMIT ?', (now, max(1, limit))).fetchall()
+        for row in rows:
+            conn.execute("UPDATE retry_queue SET status='running', next_at=?, updated_at=? WHERE doc_id=?",
+                         (now + RETRY_LEASE_SECONDS, datetime.now().isoformat(), row[0]))
+        if rows:
+            _bump(conn, 'retried', len(rows))
+        conn.commit()
+    return [{'doc_id': d, 'temp_path': p, 'file_name': f, 'attempts': a} for d, p, f, a in rows]
+
+
+def remove(doc_id: str, recovered: bool = False):
+    with _lock:
+        conn = _connect()
+        cur = conn.execute("DELETE FROM retry_queue WHERE doc_id=? AND status != 'dead'", (doc_id,))
+        if recovered and cur.rowcount:
+            _bump(conn, 'recovered')
+        conn.commit()
+
+
+def dead_letters(reason: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    with _lock:
+        conn = _connect()
+        rows = conn.execute("SELECT doc_id, file_name, reason, attempts, parked_at, updated_at, last_error FROM retry_queue "
+                            "WHERE status='dead' AND (? IS NULL OR reason=?) ORDER BY updated_at DESC LIMIT ?",
+                            (reason, reason, max(1, limit))).fetchall()
+    keys = ('doc_id', 'file_name', 'reason', 'attempts', 'parked_at', 'dead_at', 'last_error')
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def reopen(reason: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    """Take up to `limit` dead letters (of `reason`, or any) back for a retry: leased as running,
+    with the attempt count reset so a rate-limited one can be parked again."""
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        conn.execute('BEGIN IMMEDIATE')
+        rows = conn.execute("SELECT doc_id, temp_path, file_name, reason FROM retry_queue WHERE status='dead' "
+                            'AND (? IS NULL OR reason=?) ORDER BY updated_at LIMIT ?', (reason, reason, max(1, limit))).fetchall()
+        for row in rows:
+            conn.execute("UPDATE retry_queue SET status='running', attempts=0, next_at=?, updated_at=? WHERE doc_id=?",
+                         (now + RETRY_LEASE_SECONDS, datetime.now().isoformat(), row[0]))
+        if rows:
+            _bump(conn, 'reopened', len(rows))
+        conn.commit()
+    return [{'doc_id': d, 'temp_path': p, 'file_name': f, 'reason': r} for d, p, f, r in rows]
+
+
+def backfill(records: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """Dead-letter the stored 'erro' records that are not indexed yet (reason from `extracted_error`,
+    failure time from `uploaded_at`). Returns the count per reason."""
+    with _lock:
+        known = {r[0] for r in _connect().execute("SELECT doc_id FROM retry_queue WHERE status='dead'").fetchall()}
+    added: Dict[str, int] = {}
+    for rec in records:
+        if not isinstance(rec, dict) or rec.get('status') != 'erro' or not rec.get('id') or rec['id'] in known:
+            continue
+        try:
+            at = datetime.fromisoformat(rec['uploaded_at']).timestamp() if rec.get('uploaded_at') else None
+        except (TypeError, ValueError):
+            at = None
+        reason = classify(rec.get('extracted_error'))
+        dead_letter(rec['id'], rec.get('tmp_path'), rec.get('filename'), reason, rec.get('extracted_error'), at=at)
+        added[reason] = added.get(reason, 0) + 1
+    return added
+
+
+def failure_counts(bucket: str = 'hour', hours: float = 24) -> Dict[str, Any]:
+    """Failures per reason in each hour (or day) of the last `hours` hours, oldest first."""
+    fmt = '%Y-%m-%d' if bucket == 'day' else '%Y-%m-%dT%H:00'
+    with _lock:
+        conn = _connect()
+        rows = conn.execute(
+            "SELECT strftime(?, at, 'unixepoch', 'localtime') AS b, reason, count(*) FROM failure_events "
+            'WHERE at >= ? GROUP BY b, reason ORDER BY b', (fmt, time.time() - hours * 3600)).fetchall()
+    series: Dict[str, Dict[str, Any]] = {}
+    totals: Dict[str, int] = {}
+    for b, reason, n in rows:
+        series.setdefault(b, {'at': b})[reason] = n
+        totals[reason] = totals.get(reason, 0) + n
+    return {'bucket': 'day' if bucket == 'day' else 'hour', 'hours': hours, 'totals': totals, 'series': list(series.values())}
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        conn = _connect()
+        counters = dict(conn.execute('SELECT name, value FROM retry_stats').fetchall())
+        by_status = dict(conn.execute('SELECT status, count(*) FROM retry_queue GROUP BY status').fetchall())
+        dead_by_reason = dict(conn.execute("SELECT reason, count(*) FROM retry_queue WHERE status='dead' GROUP BY reason").fetchall())
+        nxt = conn.execute("SELECT min(next_at) FROM retry_queue WHERE status='waiting'").fetchone()[0]
+    return {
+        'queue': by_status,
+        'next_attempt_in_s': round(max(0.0, nxt - time.time()), 1) if nxt else None,
+        'parked': counters.get('parked', 0),
+        'retried': counters.get('retried', 0),
+        'recovered': counters.get('recovered', 0),
+        'dead_lettered': counters.get('dead_lettered', 0),
+        'dead_by_reason': dead_by_reason,
+        'reopened': counters.get('reopened', 0),
+        'max_attempts': RETRY_MAX_ATTEMPTS,
+    }
+
+
+def clear():
+    with _lock:
+        conn = _connect()
+        conn.execute('DELETE FROM retry_queue')
+        conn.execute('DELETE FROM retry_stats')
+        conn.execute('DELETE FROM failure_events')
+        conn.commit()
@@ -0,0 +1,228 @@
+"""Full-text search over stored documents (SQLite FTS5, stdlib only).
+
+Indexed per document: filename, parties (emitente/destinatario razao_social + endereco), CNPJs
+(digits only, from the parties and from any CNPJ-like token in the text), item descriptions and
+ocr_text. Each document's indexed content is fingerprinted, so `index_document` is a cheap no-op
+when nothing searchable changed; callers invoke it whenever they write a record.
+
+The index lives next to the JSON DB (override with SEARCH_INDEX_PATH) and is reconciled with the
+store at startup by `sync`.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict, List, Optional
+
+_DEFAULT_DB = os.environ.get('DOCUMENTS_DB_PATH') or os.path.join(os.path.dirname(__file__), 'documents_db.json')
+SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH') or os.path.join(os.path.dirname(os.path.abspath(_DEFAULT_DB)), 'search_index.sqlite3')
+
+# column order matters for bm25 weights and snippet() column numbers
+_COLUMNS = ['doc_id', 'filename', 'parties', 'cnpjs', 'itens', 'ocr_text']
+_WEIGHTS = (0.0, 2.0, 8.0, 10.0, 4.0, 1.0)
+_SNIPPET_COLUMNS = {'filename': 1, 'parties': 2, 'cnpjs': 3, 'itens': 4, 'ocr_text': 5}
+_OCR_TEXT_LIMIT = 200_000
+
+_cnpj_re = re.compile(r'(?<!\d)(\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2})(?!\d)')
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is not None:
+        return _conn
+    with _lock:
+        if _conn is not None:
+            return _conn
+        conn = sqlite3.connect(SEARCH_INDEX_PATH, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5("
+            "doc_id UNINDEXED, filename, parties, cnpjs, itens, ocr_text, "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        conn.execute('CREATE TABLE IF NOT EXISTS docs_sig (doc_id TEXT PRIMARY KEY, fts_rowid INTEGER, sig TEXT)')
+        conn.commit()
+        _conn = conn
+        return _conn
+
+
+def _party_text(p: Any) -> List[str]:
+    if not isinstance(p, dict):
+        return []
+    return [str(p.get(k)) for k in ('razao_social', 'endereco') if p.get(k)]
+
+
+def _document_fields(rec: Dict[str, Any]) -> Dict[str, str]:
+    ed = rec.get('extracted_data') if isinstance(rec.get('extracted_data'), dict) else {}
+    ocr = rec.get('ocr_text') or ''
+    if not isinstance(ocr, str):
+        ocr = str(ocr)
+    ocr = ocr[:_OCR_TEXT_LIMIT]
+    parties = _party_text(ed.get('emitente')) + _party_text(ed.get('destinatario'))
+    cnpjs = []
+    for p in (ed.get('emitente'), ed.get('destinatario')):
+        if isinstance(p, dict) and p.get('cnpj'):
+            d = re.sub(r'\D', '', str(p.get('cnpj')))
+            if d and d not in cnpjs:
+                cnpjs.append(d)
+    for m in _cnpj_re.finditer(ocr):
+        d = re.sub(r'\D', '', m.group(1))
+        if len(d) == 14 and d not in cnpjs:
+            cnpjs.append(d)
+    itens = []
+    for it in (ed.get('itens') or []):
+        if isinstance(it, dict):
+            itens.append(' '.join(str(it.get(k)) for k in ('codigo', 'descricao') if it.get(k)))
+    return {
+        'filename': str(rec.get('filename') or ''),
+        'parties': '\n'.join(parties),
+        'cnpjs': ' '.join(cnpjs),
+        'itens': '\n'.join(i for i in itens if i),
+        'ocr_text': ocr,
+    }
+
+
+def _signature(fields: Dict[str, str]) -> str:
+    h = hashlib.sha1()
+    for k in _COLUMNS[1:]:
+        h.update(fields.get(k, '').encode('utf-8', 'replace'))
+        h.update(b'\x00')
+    return h.hexdigest()
+
+
+def _upsert(conn: sqlite3.Connection, doc_id: str, rec: Dict[str, Any]) -> bool:
+    fields = _document_fields(rec)
+    sig = _signature(fields)
+    row = conn.execute('SELECT fts_rowid, sig FROM docs_sig WHERE doc_id=?', (doc_id,)).fetchone()
+    if row and row[1] == sig:
+        return False
+    if row:
+        conn.execute('DELETE FROM docs_fts WHERE rowid=?', (row[0],))
+    cur = conn.execute(
+        'INSERT INTO docs_fts (doc_id, filename, parties, cnpjs, itens, ocr_text) VALUES (?, ?, ?, ?, ?, ?)',
+        (doc_id, fields['filename'], fields['parties'], fields['cnpjs'], fields['itens'], fields['ocr_text']),
+    )
+    conn.execute('INSERT OR REPLACE INTO docs_sig (doc_id, fts_rowid, sig) VALUES (?, ?, ?)', (doc_id, cur.lastrowid, sig))
+    return True
+
+
+def index_document(doc_id: str, rec: Dict[str, Any]) -> bool:
+    """(Re)index one record. Returns True when the index changed. Never raises."""
+    try:
+        if not isinstance(rec, dict):
+            return False
+        with _lock:
+            conn = _connect()
+            changed = _upsert(conn, doc_id, rec)
+            if changed:
+                conn.commit()
+            return changed
+    except Exception as e:
+        print(f"[SEARCH] failed to index {doc_id}: {e}", file=sys.stderr)
+        return False
+
+
+def remove_document(doc_id: str):
+    try:
+        with _lock:
+            conn = _connect()
+            row = conn.execute('SELECT fts_rowid FROM docs_sig WHERE doc_id=?', (doc_id,)).fetchone()
+            if row:
+                conn.execute('DELETE FROM docs_fts WHERE rowid=?', (row[0],))
+                conn.execute('DELETE FROM docs_sig WHERE doc_id=?', (doc_id,))
+                conn.commit()
+    except Exception as e:
+        print(f"[SEARCH] failed to remove {doc_id}: {e}", file=sys.stderr)
+
+
+def clear():
+    with _lock:
+        conn = _connect()
+        conn.execute('DELETE FROM docs_fts')
+        conn.execute('DELETE FROM docs_sig')
+        conn.commit()
+
+
+def sync(store: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    """Reconcile the index with `store`: index new/changed records, drop deleted ones."""
+    indexed = 0
+    removed = 0
+    with _lock:
+        conn = _connect()
+        known = {r[0] for r in conn.execute('SELECT doc_id FROM docs_sig')}
+        for doc_id in list(store.keys()):
+            rec = store.get(doc_id)
+            if not isinstance(rec, dict):
+                continue
+            try:
+                if _upsert(conn, doc_id, rec):
+                    indexed += 1
+            except Exception as e:
+                print(f"[SEARCH] failed to index {doc_id}: {e}", file=sys.stderr)
+            known.discard(doc_id)
+        for doc_id in known:
+            row = conn.execute('SELECT fts_rowid FROM docs_sig WHERE doc_id=?', (doc_id,)).fetchone()
+            if row:
+                conn.execute('DELETE FROM docs_fts WHERE rowid=?', (row[0],))
+            conn.execute('DELETE FROM docs_sig WHERE doc_id=?', (doc_id,))
+            removed += 1
+        conn.commit()
+    return {'indexed': indexed, 'removed': removed}
+
+
+def build_match_query(q: str) -> Optional[str]:
+    """Turn free text into an FTS5 MATCH expression: every term must match (prefix search).
+
+    CNPJ/CPF-like tokens ("12.345.678/0001-90") are reduced to digits so they hit the `cnpjs`
+    column and the digit tokens in ocr_text.
+    """
+    if not q:
+        return None
+    terms = []
+    for raw in q.split():
+        digits = re.sub(r'\D', '', raw)
+        if len(digits) >= 8 and re.fullmatch(r'[\d\.\-/]+', raw):
+            terms.append(digits)
+            continue
+        for tok in re.findall(r'\w+', raw):
+            terms.append(tok)
+    terms = [t for t in terms if t]
+    if not terms:
+        return None
+    return ' '.join('"' + t.replace('"', '') + '"*' for t in terms)
+
+
+def search(q: str, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+    """Ranked (bm25) search with highlighted snippets. Returns {'total', 'results'}."""
+    match = build_match_query(q)
+    if not match:
+        return {'total': 0, 'results': []}
+    limit = max(1, min(int(limit or 20), 200))
+    offset = max(0, int(offset or 0))
+    weights = ', '.join(str(w) for w in _WEIGHTS)
+    snippets = ', '.join(
+        f"snippet(docs_fts, {col}, '<mark>', '</mark>', '…', 12)" for col in _SNIPPET_COLUMNS.values()
+    )
+    with _lock:
+        conn = _connect()
+        total = conn.execute('SELECT count(*) FROM docs_fts WHERE docs_fts MATCH ?', (match,)).fetchone()[0]
+        rows = conn.execute(
+            f'SELECT doc_id, bm25(docs_fts, {weights}) AS score, {snippets} FROM docs_fts '
+            f'WHERE docs_fts MATCH ? ORDER BY score LIMIT ? OFFSET ?',
+            (match, limit, offset),
+        ).fetchall()
+    results = []
+    for row in rows:
+        highlights = {}
+        for name, snip in zip(_SNIPPET_COLUMNS.keys(), row[2:]):
+            if snip and '<mark>' in snip:
+                highlights[name] = snip
+        # bm25 is "lower is better"; expose a positive score
+        results.append({'doc_id': row[0], 'score': round(-row[1], 4), 'highlights': highlights})
+    return {'total': total, 'results': results}
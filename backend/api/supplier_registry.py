@@ -0,0 +1,255 @@
+"""Supplier registry: canonical emitente data keyed by CNPJ (SQLite, stdlib only).
+
+Most notas come from a small set of suppliers, yet every document extracted the emitente
+razao_social / inscricao_estadual / endereco again (LLM + heuristics) and parsed the address
+(specialist_agent._extract_address_parts). The registry keeps what finalized documents said about
+each supplier:
+
+- `observe(doc_id, extracted)` records the emitente fields of a finalized document under its CNPJ
+  (only CNPJs whose check digits are valid). Values are compared normalized (case, accents,
+  punctuation). Each observation adds a weight by source ('llm' 1.0, 'fallback' 0.5), and first
+  decays the weights already stored for that field by SUPPLIER_DECAY (default 0.7). Newer
+  documents that disagree therefore take over after a couple of observations. Address parts
+  (cep, uf, municipio, bairro) are parsed once here instead of on every document. Values the
+  registry itself filled are not observed again.
+- `lookup(cnpj)` is one indexed query. For each field it returns the canonical value (highest
+  weight), its confidence (share of the field's weight) and how many documents support it. Lookups
+  and hits are counted for `stats()`.
+- `fill_party(party, entry)` fills the missing party fields whose confidence is at least
+  SUPPLIER_MIN_CONFIDENCE (default 0.6). It can also replace heuristic values.
+- `sync(store)` observes the finalized records not seen yet, oldest first (run at startup).
+
+The registry lives next to the JSON DB (override with SUPPLIER_REGISTRY_PATH).
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+_DEFAULT_DB = os.environ.get('DOCUMENTS_DB_PATH') or os.path.join(os.path.dirname(__file__), 'documents_db.json')
+SUPPLIER_REGISTRY_PATH = os.environ.get('SUPPLIER_REGISTRY_PATH') or os.path.join(os.path.dirname(os.path.abspath(_DEFAULT_DB)), 'supplier_registry.sqlite3')
+SUPPLIER_DECAY = float(os.environ.get('SUPPLIER_DECAY', '0.7'))
+SUPPLIER_MIN_CONFIDENCE = float(os.environ.get('SUPPLIER_MIN_CONFIDENCE', '0.6'))
+
+FIELDS = ('razao_social', 'inscricao_estadual', 'endereco')
+ADDRESS_PARTS = ('cep', 'uf', 'municipio', 'bairro')
+_SOURCE_WEIGHTS = {'llm': 1.0, 'fallback': 0.5}
+REGISTRY_SOURCE = 'supplier_registry'
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is not None:
+        return _conn
+    with _lock:
+        if _conn is not None:
+            return _conn
+        conn = sqlite3.connect(SUPPLIER_REGISTRY_PATH, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS supplier_values ('
+            'cnpj TEXT, field TEXT, norm TEXT, value TEXT, weight REAL, count INTEGER, last_seen TEXT, '
+            'PRIMARY KEY (cnpj, field, norm))'
+        )
+        conn.execute('CREATE TABLE IF NOT EXISTS supplier_docs (doc_id TEXT PRIMARY KEY, cnpj TEXT, sig TEXT, observed_at TEXT)')
+        conn.execute('CREATE TABLE IF NOT EXISTS supplier_stats (name TEXT PRIMARY KEY, value INTEGER)')
+        conn.commit()
+        _conn = conn
+        return _conn
+
+
+def _valid_cnpj(cnpj: Optional[str]) -> Optional[str]:
+    digits = re.sub(r'\D', '', str(cnpj or ''))
+    try:
+        from backend.agents import chave_acesso
+    except ImportError:
+        try:
+            # API launched from backend/ (uvicorn api.main:app)
+            from agents import chave_acesso
+        except ImportError:
+            return digits if len(digits) == 14 else None
+    return digits if chave_acesso.cnpj_is_valid(digits) else None
+
+
+def _norm(value: str) -> str:
+    s = unicodedata.normalize('NFKD', str(value)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^0-9A-Za-z]+', ' ', s).upper().split())
+
+
+def _bump(conn: sqlite3.Connection, name: str):
+    conn.execute('INSERT INTO supplier_stats (name, value) VALUES (?, 1) '
+                 'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+
+def _address_parts(endereco: str) -> Dict[str, str]:
+    try:
+        try:
+            from backend.agents import specialist_agent
+        except ImportError:
+            # API launched from backend/ (uvicorn api.main:app)
+            from agents import specialist_agent
+        parts = specialist_agent._extract_address_parts(endereco) or {}
+    except Exception:
+        return {}
+    return {k: parts[k] for k in ADDRESS_PARTS if parts.get(k)}
+
+
+def lookup(cnpj: Optional[str], count: bool = True) -> Optional[Dict[str, Any]]:
+    """Canonical fields of the supplier with this CNPJ, or None (miss / invalid CNPJ). `count=False`
+    keeps the lookup out of the hit-rate stats (API inspection)."""
+    cnpj = _valid_cnpj(cnpj)
+    if not cnpj:
+        return None
+    try:
+        with _lock:
+            conn = _connect()
+            rows = conn.execute('SELECT field, value, weight, count FROM supplier_values WHERE cnpj=?', (cnpj,)).fetchall()
+            if count:
+                _bump(conn, 'lookups')
+                if rows:
+                    _bump(conn, 'hits')
+                conn.commit()
+    except Exception as e:
+        print(f"[SUPPLIER] lookup failed for {cnpj}: {e}", file=sys.stderr)
+        return None
+    if not rows:
+        return None
+    totals: Dict[str, float] = {}
+    best: Dict[str, tuple] = {}
+    for field, value, weight, docs in rows:
+        totals[field] = totals.get(field, 0.0) + weight
+        if field not in best or weight > best[field][1]:
+            best[field] = (value, weight, docs)
+    fields = {
+        field: {'value': value, 'confidence': round(weight / totals[field], 3) if totals[field] else 0.0, 'documents': docs}
+        for field, (value, weight, docs) in best.items()
+    }
+    return {'cnpj': cnpj, 'fields': fields}
+
+
+def fill_party(party: Dict[str, Any], entry: Optional[Dict[str, Any]], min_confidence: Optional[float] = None,
+               overwrite: bool = False) -> List[str]:
+    """Fill missing fields of `party` (in place) from a lookup() entry; with `overwrite`, also replace
+    differing values (used for the regex fallback, which the registry beats). Returns the fields set."""
+    if not entry or not isinstance(party, dict):
+        return []
+    min_confidence = SUPPLIER_MIN_CONFIDENCE if min_confidence is None else min_confidence
+    filled = []
+    for field, info in entry['fields'].items():
+        if info['confidence'] < min_confidence:
+            continue
+        current = party.get(field)
+        if current in (None, '') or (overwrite and _norm(current) != _norm(info['value'])):
+            party[field] = info['value']
+            filled.append(field)
+    if filled and not party.get('cnpj'):
+        party['cnpj'] = entry['cnpj']
+    return filled
+
+
+def _signature(cnpj: str, values: Dict[str, str]) -> str:
+    return hashlib.sha1(json.dumps([cnpj, sorted(values.items())], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _observe(conn: sqlite3.Connection, doc_id: str, extracted: Dict[str, Any]) -> bool:
+    party = extracted.get('emitente') if isinstance(extracted, dict) else None
+    if not isinstance(party, dict):
+        return False
+    cnpj = _valid_cnpj(party.get('cnpj'))
+    if not cnpj:
+        return False
+    meta = extracted.get('_meta') if isinstance(extracted.get('_meta'), dict) else {}
+    weight = _SOURCE_WEIGHTS.get(meta.get('emitente'), 0.75)
+    values = {}
+    for field in FIELDS:
+        value = party.get(field)
+        # values the registry filled would only reinforce themselves
+        if value and meta.get(f'emitente.{field}') != REGISTRY_SOURCE and _norm(value):
+            values[field] = str(value).strip()
+    if values.get('endereco'):
+        values.update(_address_parts(values['endereco']))
+    if not values:
+        return False
+    sig = _signature(cnpj, values)
+    row = conn.execute('SELECT sig FROM supplier_docs WHERE doc_id=?', (doc_id,)).fetchone()
+    if row and row[0] == sig:
+        return False
+    now = datetime.now().isoformat()
+    for field, value in values.items():
+        conn.execute('UPDATE supplier_values SET weight = weight * ? WHERE cnpj=? AND field=?', (SUPPLIER_DECAY, cnpj, field))
+        conn.execute(
+            'INSERT INTO supplier_values (cnpj, field, norm, value, weight, count, last_seen) VALUES (?, ?, ?, ?, ?, 1, ?) '
+            'ON CONFLICT(cnpj, field, norm) DO UPDATE SET weight = weight + excluded.weight, count = count + 1, '
+            'value = excluded.value, last_seen = excluded.last_seen',
+            (cnpj, field, _norm(value), value, weight, now),
+        )
+    conn.execute('INSERT OR REPLACE INTO supplier_docs (doc_id, cnpj, sig, observed_at) VALUES (?, ?, ?, ?)', (doc_id, cnpj, sig, now))
+    return True
+
+
+def observe(doc_id: str, extracted: Dict[str, Any]) -> bool:
+    """Record the emitente of a finalized document. Returns True when the registry changed. Never raises."""
+    try:
+        with _lock:
+            conn = _connect()
+            changed = _observe(conn, doc_id, extracted)
+            if changed:
+                conn.commit()
+            return changed
+    except Exception as e:
+        print(f"[SUPPLIER] failed to observe {doc_id}: {e}", file=sys.stderr)
+        return False
+
+
+def sync(store: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    """Observe the finalized records of `store` that are new or changed, oldest first."""
+    observed = 0
+    records = [(doc_id, rec) for doc_id, rec in list(store.items())
+               if isinstance(rec, dict) and rec.get('status') == 'finalizado' and isinstance(rec.get('extracted_data'), dict)]
+    records.sort(key=lambda item: str(item[1].get('uploaded_at') or ''))
+    with _lock:
+        conn = _connect()
+        for doc_id, rec in records:
+            try:
+                if _observe(conn, doc_id, rec['extracted_data']):
+                    observed += 1
+            except Exception as e:
+                print(f"[SUPPLIER] failed to observe {doc_id}: {e}", file=sys.stderr)
+        conn.commit()
+    return {'observed': observed}
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        conn = _connect()
+        counters = dict(conn.execute('SELECT name, value FROM supplier_stats').fetchall())
+        suppliers = conn.execute('SELECT count(DISTINCT cnpj) FROM supplier_values').fetchone()[0]
+        documents = conn.execute('SELECT count(*) FROM supplier_docs').fetchone()[0]
+    lookups = counters.get('lookups', 0)
+    hits = counters.get('hits', 0)
+    return {
+        'suppliers': suppliers,
+        'documents_observed': documents,
+        'lookups': lookups,
+        'hits': hits,
+        'hit_rate': round(hits / lookups, 3) if lookups else None,
+    }
+
+
+def clear():
+    with _lock:
+        conn = _connect()
+        conn.execute('DELETE FROM supplier_values')
+        conn.execute('DELETE FROM supplier_docs')
+        conn.execute('DELETE FROM supplier_stats')
+        conn.commit()
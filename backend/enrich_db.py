@@ -4,6 +4,7 @@ Usage: python backend/enrich_db.py
 
 It will load backend/api/documents_db.json, apply enrichment heuristics to each record
 that appears to have missing fields, update extracted_data and aggregates, and write the DB back.
+Its LLM lookups share the API server's rate-limit buckets (backend/agents/rate_limiter.py).
 """
 import os
 import json
@@ -7,6 +7,8 @@ Notes:
 - Run this script from the project root or backend folder where Python environment is configured.
 - Make sure the process that serves the API (uvicorn) is stopped before running this script to avoid file contention.
 - Ensure OPENROUTER_API_KEY (or equivalent) is exported in the environment for LLM calls.
+- LLM requests draw from the same rate-limit buckets as the API server (backend/agents/rate_limiter.py),
+  so running this next to a live server spends the shared quota instead of collecting 429s.
 """
 import os
 import json
@@ -17,7 +17,7 @@ class FiscalCrewOrchestrator:
         OPENROUTER_MODEL = os.environ.get('OPENROUTER_MODEL', "gpt-4")
         if not OPENROUTER_API_KEY:
             print('[CONFIG] Warning: OPENROUTER_API_KEY not set for orchestrator. LLM calls may fail.', file=sys.stderr)
-        self.llm = ChatOpenAI(api_key=OPENROUTER_API_KEY, base_url="https://openrouter.ai/api/v1", model=OPENROUTER_MODEL, temperature=0.1)
+        self.llm = ChatOpenAI(api_key=OPENROUTER_API_KEY, base_url=os.environ.get('OPENROUTER_BASE_URL', "https://openrouter.ai/api/v1"), model=OPENROUTER_MODEL, temperature=0.1)
 
         # Inicializar 5 agentes
         self.retrieval = DocumentRetrievalAgent(self.llm)
@@ -0,0 +1,30 @@
+"""Temporary stores for the check scripts in backend/ (test_*.py).
+
+`use_temp_stores()` points every file the API keeps on disk at a fresh temporary directory, so a
+check never reads or writes the real ones. Call it before importing api/agents modules (they read
+the paths at import time). A new store only needs its variable added to STORES.
+"""
+import os
+import tempfile
+
+# environment variable -> file name inside the temporary directory
+STORES = {
+    'DOCUMENTS_DB_PATH': 'documents_db.json',
+    'SEARCH_INDEX_PATH': 'search_index.sqlite3',
+    'SUPPLIER_REGISTRY_PATH': 'supplier_registry.sqlite3',
+    'LAYOUT_TEMPLATES_PATH': 'layout_templates.sqlite3',
+    'REFINEMENT_PATH': 'refinement.sqlite3',
+    'RATE_LIMITS_PATH': 'rate_limits.sqlite3',
+    'RETRY_QUEUE_PATH': 'retry_queue.sqlite3',
+}
+
+
+def use_temp_stores(prefix: str = 'check_') -> str:
+    """Set every STORES variable to a file in a new temporary directory, with an empty documents DB.
+    Returns the directory."""
+    tmp = tempfile.mkdtemp(prefix=prefix)
+    for name, file_name in STORES.items():
+        os.environ[name] = os.path.join(tmp, file_name)
+    with open(os.environ['DOCUMENTS_DB_PATH'], 'w', encoding='utf-8') as f:
+        f.write('{}')
+    return tmp
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Check of the chave de acesso decoder (agents/chave_acesso.py) and of its use in process_document.
+
+Run from backend/, like the API (cd backend; python test_chave_acesso.py). Uses a temporary DB and
+EXTRACTION_MODE=heuristic, so no LLM or OCR is needed.
+"""
+import os
+import sys
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, HERE)
+from temp_stores import use_temp_stores
+
+use_temp_stores('test_chave_')
+os.environ['EXTRACTION_MODE'] = 'heuristic'
+
+from agents import chave_acesso, enrichment_agent
+
+# SP, 2024-06, CNPJ 11.222.333/0001-81, NF-e (55), serie 1, nNF 12345, tpEmis 1, cNF 12345678
+body = '35' + '2406' + '11222333000181' + '55' + '001' + '000012345' + '1' + '12345678'
+chave = body + str(chave_acesso.check_digit(body))
+print('chave:', chave)
+
+decoded = chave_acesso.decode(chave)
+print('decoded:', decoded)
+assert decoded and decoded['uf'] == 'SP' and decoded['ano'] == 2024 and decoded['mes'] == 6
+assert decoded['cnpj'] == '11222333000181' and decoded['cnpj_valido']
+assert decoded['tipo'] == 'NF-e' and decoded['serie'] == '1' and decoded['numero'] == '12345'
+
+# a single misread digit breaks the mod-11 check
+wrong = chave[:10] + str((int(chave[10]) + 1) % 10) + chave[11:]
+assert chave_acesso.decode(wrong) is None, 'a key with a wrong digit was accepted'
+assert chave_acesso.decode(chave[:43]) is None
+
+# DANFE prints the key in groups of 4
+grouped = ' '.join(chave[i:i + 4] for i in range(0, 44, 4))
+found = chave_acesso.find_valid('Protocolo 135240000012345\nCHAVE DE ACESSO\n' + grouped)
+assert found and found['chave'] == chave, found
+assert chave_acesso.matches_date(decoded, '2024-06-30') and not chave_acesso.matches_date(decoded, '15/07/2024')
+
+# the key wins over conflicting values
+extracted = {'numero_nota': '999', 'emitente': {'cnpj': '00.000.000/0000-00'}, 'data_emissao': None}
+report = {'filled': {}, 'notes': []}
+enrichment_agent.apply_chave({'ocr_text': 'Emissão 21/06/2024\n' + grouped}, extracted, report=report)
+print('apply_chave:', extracted, report['notes'])
+assert extracted['numero_nota'] == '12345' and extracted['emitente']['cnpj'] == '11222333000181'
+assert extracted['chave_acesso'] == chave and extracted['data_emissao'] == '2024-06-21'
+
+# the whole pipeline, imported the way uvicorn api.main:app imports it
+from fastapi.testclient import TestClient
+from api import main
+
+client = TestClient(main.app)
+csv_text = 'NOTA FISCAL ELETRONICA,\nCHAVE DE ACESSO,' + grouped + '\nVALOR TOTAL,R$ 10,00\n'
+r = client.post('/api/v1/documents/upload', files=[('files', ('nota.csv', csv_text.encode('utf-8'), 'text/csv'))])
+assert r.status_code == 200, r.text
+doc_id = r.json()['document_ids'][0]
+rec = main.documents_db[doc_id]
+print('status:', rec['status'], '| chave:', rec.get('chave'))
+assert rec['status'] == 'finalizado', rec.get('extracted_error')
+assert (rec.get('chave') or {}).get('numero') == '12345', 'chave de acesso lookup did not run'
+assert rec['extracted_data'].get('numero_nota') == '12345'
+print('OK')
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Check of the dead-letter index (api/retry_queue.py) and of the admin endpoints that list and
+retry failed documents by reason.
+
+Run from backend/, like the API (cd backend; python test_dead_letters.py). Uses a temporary DB and
+uploads two files that always fail (a broken XML and an unsupported format); no LLM or OCR is
+needed.
+"""
+import os
+import sys
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, HERE)
+from temp_stores import use_temp_stores
+
+use_temp_stores('test_dead_letters_')
+os.environ['EXTRACTION_MODE'] = 'heuristic'
+
+from fastapi.testclient import TestClient
+from api import main, retry_queue
+
+client = TestClient(main.app)
+r = client.post('/api/v1/documents/upload', files=[
+    ('files', ('quebrado.xml', b'<nfeProc><NFe>', 'application/xml')),
+    ('files', ('planilha.docx', b'PK\x03\x04', 'application/octet-stream')),
+])
+assert r.status_code == 200, r.text
+xml_id, docx_id = r.json()['document_ids']
+assert main.documents_db[xml_id]['status'] == 'erro' and main.documents_db[xml_id]['retry']['reason'] == 'parse_error'
+assert main.documents_db[docx_id]['retry'] == {'status': 'dead', 'reason': 'unsupported_format', 'attempts': 1}
+
+listed = client.get('/api/v1/admin/dead_letters').json()
+print('dead letters:', listed['counts'])
+assert listed['counts'] == {'parse_error': 1, 'unsupported_format': 1}
+assert [d['doc_id'] for d in client.get('/api/v1/admin/dead_letters?reason=parse_error').json()['documents']] == [xml_id]
+assert client.get('/api/v1/admin/dead_letters?reason=bogus').status_code == 400
+
+failures = client.get('/api/v1/failures?bucket=hour&hours=1').json()
+print('failures:', failures)
+assert failures['totals'] == {'parse_error': 1, 'unsupported_format': 1} and failures['series']
+
+# retry one reason: only those documents are reopened; the XML fails again and is listed again
+assert client.post('/api/v1/admin/dead_letters/retry?reason=bogus').status_code == 400
+retried = client.post('/api/v1/admin/dead_letters/retry?reason=parse_error&concurrency=2').json()
+print('retry:', retried)
+assert retried['scheduled'] == 1 and retried['document_ids'] == [xml_id]
+assert main.documents_db[xml_id]['status'] == 'erro' and main.documents_db[xml_id]['retry']['status'] == 'dead'
+stats = retry_queue.stats()
+assert stats['reopened'] == 1 and stats['dead_by_reason'] == {'parse_error': 1, 'unsupported_format': 1}
+assert client.get('/api/v1/failures?hours=1').json()['totals']['parse_error'] == 2
+
+# reopen() leases what it hands out: a second call gets nothing until they are dead again
+reopened = retry_queue.reopen(reason='unsupported_format')
+assert [e['doc_id'] for e in reopened] == [docx_id] and retry_queue.reopen(reason='unsupported_format') == []
+retry_queue.dead_letter(docx_id, reopened[0]['temp_path'], 'planilha.docx', 'unsupported_format', 'again')
+
+# backfill indexes 'erro' records stored before the index existed (failure time = upload time)
+retry_queue.clear()
+added = client.post('/api/v1/admin/dead_letters/backfill').json()['added']
+print('backfill:', added)
+assert added == {'parse_error': 1, 'unsupported_format': 1}
+assert client.post('/api/v1/admin/dead_letters/backfill').json()['added'] == {}
+day = client.get('/api/v1/failures?bucket=day&hours=48').json()
+assert day['bucket'] == 'day' and sum(day['totals'].values()) == 2
+print('OK')
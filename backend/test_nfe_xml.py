@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Check of the native NF-e XML parser (agents/nfe_xml.py) and of the 'native' pipeline profile.
+
+Run from backend/, like the API (cd backend; python test_nfe_xml.py). Uses a temporary DB; no LLM
+or OCR is needed.
+"""
+import os
+import sys
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, HERE)
+from temp_stores import use_temp_stores
+
+use_temp_stores('test_nfe_xml_')
+
+from agents import nfe_xml
+
+NFE = """<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">
+ <NFe><infNFe Id="NFe35240611222333000181550010000123451123456780" versao="4.00">
+  <ide><cUF>35</cUF><natOp>VENDA DE MERCADORIA</natOp><mod>55</mod><serie>1</serie><nNF>12345</nNF>
+   <dhEmi>2024-06-21T10:15:00-03:00</dhEmi></ide>
+  <emit><CNPJ>11222333000181</CNPJ><xNome>COMERCIO EXEMPLO LTDA</xNome><IE>123456789</IE>
+   <enderEmit><xLgr>RUA EXEMPLO</xLgr><nro>100</nro><xBairro>CENTRO</xBairro><xMun>SAO PAULO</xMun><UF>SP</UF><CEP>01000000</CEP></enderEmit></emit>
+  <dest><CNPJ>98765432000110</CNPJ><xNome>CLIENTE EXEMPLO SA</xNome></dest>
+  <det nItem="1"><prod><cProd>A1</cProd><xProd>PRODUTO A</xProd><NCM>84713012</NCM><CFOP>5102</CFOP><uCom>UN</uCom>
+    <qCom>2.0000</qCom><vUnCom>50.00</vUnCom><vProd>100.00</vProd></prod>
+   <imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><vBC>100.00</vBC><pICMS>18.00</pICMS><vICMS>18.00</vICMS></ICMS00></ICMS></imposto></det>
+  <det nItem="2"><prod><cProd>B2</cProd><xProd>PRODUTO B</xProd><NCM>84713012</NCM><CFOP>5102</CFOP><uCom>UN</uCom>
+    <qCom>1.0000</qCom><vUnCom>25.50</vUnCom><vProd>25.50</vProd></prod>
+   <imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><vBC>25.50</vBC><pICMS>18.00</pICMS><vICMS>4.59</vICMS></ICMS00></ICMS></imposto></det>
+  <total><ICMSTot><vBC>125.50</vBC><vICMS>22.59</vICMS><vIPI>0.00</vIPI><vPIS>0.82</vPIS><vCOFINS>3.77</vCOFINS><vNF>125.50</vNF></ICMSTot></total>
+  <pag><detPag><tPag>17</tPag><vPag>125.50</vPag></detPag></pag>
+ </infNFe></NFe>
+</nfeProc>
+"""
+
+parsed = nfe_xml.parse(NFE.encode('utf-8'))
+print('parsed:', {k: parsed[k] for k in ('numero_nota', 'chave_acesso', 'data_emissao', 'forma_pagamento', 'valor_total')})
+assert parsed['numero_nota'] == '12345' and parsed['data_emissao'] == '2024-06-21'
+assert parsed['chave_acesso'] == '35240611222333000181550010000123451123456780'
+assert parsed['forma_pagamento'] == 'PIX' and parsed['valor_total'] == 125.5
+assert parsed['emitente']['cnpj'] == '11222333000181' and parsed['destinatario']['razao_social'] == 'CLIENTE EXEMPLO SA'
+assert len(parsed['itens']) == 2 and parsed['itens'][0]['quantidade'] == 2.0 and parsed['itens'][1]['valor_total'] == 25.5
+assert parsed['impostos']['icms']['valor'] == 22.59 and parsed['impostos']['icms']['aliquota'] == 18.0
+assert parsed['codigos_fiscais']['cfop'] == '5102' and parsed['codigos_fiscais']['ncm'] == '84713012'
+
+# any other XML (or a broken one) goes back to the text pipeline
+assert nfe_xml.parse(b'<config><item>1</item></config>') is None
+assert nfe_xml.parse(b'<nfeProc><NFe>') is None
+
+# the whole pipeline, imported the way uvicorn api.main:app imports it
+from fastapi.testclient import TestClient
+from api import main
+
+client = TestClient(main.app)
+r = client.post('/api/v1/documents/upload', files=[('files', ('nota.xml', NFE.encode('utf-8'), 'application/xml'))])
+assert r.status_code == 200, r.text
+doc_id = r.json()['document_ids'][0]
+rec = main.documents_db[doc_id]
+print('status:', rec['status'], '| route:', rec.get('route'))
+assert rec['status'] == 'finalizado', rec.get('extracted_error')
+assert rec['route']['profile'] == 'native', 'the native XML parser was not used'
+assert rec['extracted_data']['numero_nota'] == '12345' and rec['extracted_data']['valor_total'] == 125.5
+print('OK')
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Check of the shared OpenRouter token buckets (agents/rate_limiter.py).
+
+Run from backend/, like the API (cd backend; python test_rate_limiter.py). Uses a temporary bucket
+file with a limit of 3 requests per minute; nothing is sent to OpenRouter.
+"""
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, HERE)
+from temp_stores import use_temp_stores
+
+use_temp_stores('test_rate_limiter_')
+os.environ['RATE_LIMIT_PER_MINUTE'] = '3'
+os.environ['RATE_LIMIT_MODEL_PER_MINUTE'] = '0'
+os.environ.pop('RATE_LIMIT_PER_DAY', None)
+os.environ['RATE_LIMIT_BACKOFF_SECONDS'] = '60'
+
+from agents import rate_limiter
+
+MODEL = 'deepseek/deepseek-chat-v3.1:free'
+
+# 3 tokens per minute: the 4th request has to wait ~20s, more than the 0.5s it may wait
+assert all(rate_limiter.acquire(MODEL, 'key-a', timeout=0.5) for _ in range(3))
+assert not rate_limiter.acquire(MODEL, 'key-a', timeout=0.5), '4th request of the minute was not throttled'
+# buckets are per key
+assert rate_limiter.acquire(MODEL, 'key-b', timeout=0.5)
+
+# another process on the same file sees the same buckets
+code = ('import sys; sys.path.insert(0, %r); from agents import rate_limiter; '
+        'print(rate_limiter.acquire(%r, "key-a", timeout=0.5), rate_limiter.acquire(%r, "key-c", timeout=0.5))') % (HERE, MODEL, MODEL)
+out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=os.environ.copy()).stdout.split()
+print('other process (key-a, key-c):', out)
+assert out == ['False', 'True'], out
+
+# the daily bucket is unlimited by default: the X-RateLimit headers do not cap it ...
+reset_day = str(int((time.time() + 6 * 3600) * 1000))
+assert rate_limiter.acquire(MODEL, 'key-d', timeout=0.5)
+rate_limiter.observe(MODEL, 'key-d', 200, {'X-RateLimit-Remaining': '900', 'X-RateLimit-Reset': reset_day})
+day = rate_limiter.stats()['buckets'][f'day:{rate_limiter.key_id("key-d")}']
+assert day['capacity'] >= 1e9 and day['tokens'] > 1e8, day
+# ... but 0 remaining blocks it until the reset
+rate_limiter.observe(MODEL, 'key-d', 200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': reset_day})
+assert not rate_limiter.acquire(MODEL, 'key-d', timeout=0.5), 'a used-up daily window was not blocked'
+
+# a per-day 429 blocks the key; a provider 429 blocks only that model
+rate_limiter.observe(MODEL, 'key-e', 429, {}, 'Rate limit exceeded: free-models-per-day')
+assert not rate_limiter.acquire('minimax/minimax-m2:free', 'key-e', timeout=0.5)
+rate_limiter.observe(MODEL, 'key-f', 429, {}, 'Provider returned error: upstream rate limited')
+assert not rate_limiter.acquire(MODEL, 'key-f', timeout=0.5)
+assert rate_limiter.acquire('minimax/minimax-m2:free', 'key-f', timeout=0.5), 'a provider 429 blocked every model'
+
+stats = rate_limiter.stats()
+print({k: stats[k] for k in ('acquired', 'denied', 'throttled_429', 'header_adjustments')})
+assert stats['throttled_429'] == 2 and stats['denied'] >= 4
+
+# the API reaches the same module when launched from backend/ (uvicorn api.main:app)
+from api import main
+
+assert main._import_agent('rate_limiter') is rate_limiter
+assert main.llm_rate_limits()['acquired'] == stats['acquired']
+print('OK')
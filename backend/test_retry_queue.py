@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Check of the delay queue for rate-limited documents (api/retry_queue.py).
+
+Run from backend/, like the API (cd backend; python test_retry_queue.py). Uses a temporary queue
+file with 1-second delays and leases, so it takes a few seconds.
+"""
+import os
+import sys
+import time
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, HERE)
+from temp_stores import use_temp_stores
+
+use_temp_stores('test_retry_queue_')
+os.environ['RETRY_BASE_SECONDS'] = '1'
+os.environ['RETRY_MAX_DELAY_SECONDS'] = '3'
+os.environ['RETRY_JITTER'] = '0'
+os.environ['RETRY_MAX_ATTEMPTS'] = '3'
+os.environ['RETRY_LEASE_SECONDS'] = '1'
+
+from api import retry_queue
+
+# exponential backoff, capped
+assert [retry_queue.backoff(n) for n in (1, 2, 3, 4, 10)] == [1, 2, 3, 3, 3]
+
+# a parked document is not handed out before its time
+entry = retry_queue.park('doc-1', '/tmp/doc-1.pdf', 'doc-1.pdf', 'llm_rate_limited', 'Error code: 429')
+print('parked:', entry)
+assert entry['status'] == 'waiting' and entry['attempts'] == 1 and entry['next_attempt_at']
+assert retry_queue.claim() == []
+time.sleep(1.1)
+claimed = retry_queue.claim()
+assert [c['doc_id'] for c in claimed] == ['doc-1'] and claimed[0]['file_name'] == 'doc-1.pdf'
+
+# leased: no second worker gets it until the lease expires
+assert retry_queue.claim() == []
+time.sleep(1.1)
+assert [c['doc_id'] for c in retry_queue.claim()] == ['doc-1'], 'an expired lease was not reclaimed'
+
+# every park counts an attempt; the last one dead-letters the document
+assert retry_queue.park('doc-1', '/tmp/doc-1.pdf', 'doc-1.pdf', 'llm_rate_limited')['attempts'] == 2
+dead = retry_queue.park('doc-1', '/tmp/doc-1.pdf', 'doc-1.pdf', 'llm_rate_limited')
+print('after max attempts:', dead)
+assert dead['status'] == 'dead' and 'next_attempt_at' not in dead
+time.sleep(3.1)
+assert retry_queue.claim() == [], 'a dead letter was retried automatically'
+assert [d['doc_id'] for d in retry_queue.dead_letters()] == ['doc-1']
+retry_queue.remove('doc-1', recovered=True)
+assert [d['doc_id'] for d in retry_queue.dead_letters()] == ['doc-1'], 'remove() dropped a dead letter'
+
+# a recovered document leaves the queue
+retry_queue.park('doc-2', '/tmp/doc-2.pdf', 'doc-2.pdf', 'llm_rate_limited')
+retry_queue.remove('doc-2', recovered=True)
+stats = retry_queue.stats()
+print('stats:', stats)
+assert stats['queue'] == {'dead': 1} and stats['recovered'] == 1 and stats['parked'] == 3 and stats['retried'] == 2
+
+# only a real HTTP 429 counts as a rate limit
+for error, reason in [
+    ('Error code: 429 - {"error": {"message": "Rate limit exceeded: free-models-per-min"}}', 'llm_rate_limited'),
+    ('HTTP 429 Too Many Requests', 'llm_rate_limited'),
+    ('Erro: arquivo nota_429.pdf corrompido', 'internal_error'),
+    ('CNPJ 12.429.000/0001-00 inválido', 'internal_error'),
+    ('Formato de arquivo não suportado: .docx', 'unsupported_format'),
+    ('no element found: line 1, column 14', 'parse_error'),
+    ("tesseract is not installed or it's not in your PATH", 'ocr_unavailable'),
+]:
+    assert retry_queue.classify(error) == reason, (error, retry_queue.classify(error))
+print('OK')
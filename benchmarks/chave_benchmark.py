@@ -0,0 +1,110 @@
+"""Benchmark: what the chave de acesso decoder settles across the stored corpus.
+
+For every record of the documents DB (read only), it looks for a valid key (mod-11 check) in the
+OCR text, the file name and the stored chave_acesso. It then runs enrichment_agent.apply_chave on a
+copy of the stored extracted_data and counts, per field (chave_acesso, numero_nota,
+emitente.cnpj, data_emissao), whether the key:
+- confirmed the stored value;
+- filled a value that was missing;
+- corrected a value that was wrong.
+
+With a key, the extraction prompt no longer asks the LLM for these fields, and enrich_record skips
+their regex lookups. 'LLM field lookups avoided' counts the fields that a key settles. 'LLM
+re-extractions avoided' counts the documents that had a missing or wrong value, which previously
+needed another LLM pass (reprocessing) to fix.
+
+Usage: python benchmarks/chave_benchmark.py [--db backend/api/documents_db.json] [--output out.json]
+"""
+import argparse
+import copy
+import json
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+FIELDS = ('chave_acesso', 'numero_nota', 'emitente.cnpj', 'data_emissao')
+
+
+def _get(extracted, path):
+    cur = extracted
+    for part in path.split('.'):
+        cur = cur.get(part) if isinstance(cur, dict) else None
+    return cur
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--db', default=os.path.join(ROOT, 'backend', 'api', 'documents_db.json'))
+    ap.add_argument('--output', help='write the results as JSON')
+    args = ap.parse_args()
+
+    from backend.agents import chave_acesso, enrichment_agent
+
+    with open(args.db, 'r', encoding='utf-8') as f:
+        db = json.load(f)
+
+    counts = {field: {'confirmed': 0, 'filled': 0, 'corrected': 0} for field in FIELDS}
+    with_key, lookups_avoided, reextractions_avoided = 0, 0, 0
+    decode_s = 0.0
+    per_doc = []
+    for doc_id, rec in db.items():
+        stored = rec.get('extracted_data') if isinstance(rec.get('extracted_data'), dict) else {}
+        t0 = time.perf_counter()
+        decoded = (chave_acesso.find_valid(rec.get('ocr_text'), rec.get('filename'))
+                   or chave_acesso.decode(stored.get('chave_acesso')))
+        decode_s += time.perf_counter() - t0
+        row = {'doc_id': doc_id, 'filename': rec.get('filename'), 'key': bool(decoded)}
+        if decoded:
+            with_key += 1
+            extracted = copy.deepcopy(stored)
+            report = {'filled': {}, 'notes': []}
+            enrichment_agent.apply_chave({'ocr_text': rec.get('ocr_text'), 'filename': rec.get('filename')},
+                                         extracted, report=report, decoded=decoded)
+            changed = False
+            for field in FIELDS:
+                before, after = _get(stored, field), _get(extracted, field)
+                if field == 'emitente.cnpj' and not decoded['cnpj_valido']:
+                    continue
+                if field == 'data_emissao' and not chave_acesso.matches_date(decoded, after):
+                    continue
+                lookups_avoided += 1
+                if before in (None, ''):
+                    outcome = 'filled'
+                elif re.sub(r'\D', '', str(before)) == re.sub(r'\D', '', str(after)) or (
+                        field == 'numero_nota' and re.sub(r'\D', '', str(before)).lstrip('0') == str(after)):
+                    outcome = 'confirmed'
+                else:
+                    outcome = 'corrected'
+                counts[field][outcome] += 1
+                row[field] = outcome
+                changed = changed or outcome != 'confirmed'
+            reextractions_avoided += int(changed)
+        per_doc.append(row)
+
+    results = {
+        'documents': len(db),
+        'with_valid_key': with_key,
+        'fields': counts,
+        'llm_field_lookups_avoided': lookups_avoided,
+        'llm_reextractions_avoided': reextractions_avoided,
+        'decode_ms_per_doc': round(decode_s * 1000 / max(1, len(db)), 3),
+    }
+    print(f"{with_key}/{len(db)} stored documents have a valid chave de acesso "
+          f"(decode {results['decode_ms_per_doc']} ms/doc)")
+    for field, c in counts.items():
+        print(f"  {field:<14} confirmed {c['confirmed']:3d}  filled {c['filled']:3d}  corrected {c['corrected']:3d}")
+    print(f"LLM field lookups avoided: {lookups_avoided}")
+    print(f"documents whose stored values the key fills or corrects (LLM re-extractions avoided): {reextractions_avoided}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(dict(results, documents_detail=per_doc), f, indent=2, ensure_ascii=False)
+        print('results written to', args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
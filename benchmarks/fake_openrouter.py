@@ -0,0 +1,238 @@
+"""Local stand-in for the OpenRouter API, for offline and repeatable benchmarks.
+
+Serves the two endpoints the backend uses:
+- GET  /models (and /api/v1/models): a fixed list of free models.
+- POST /chat/completions (and /api/v1/chat/completions): canned JSON answers in the OpenAI
+  chat-completions shape.
+
+The answer is picked from the prompt. Each prompt the backend sends has its own marker:
+- main extraction: "Extraia os principais campos fiscais"
+- items: "items (array de objetos)"
+- verify_total: "decision (keep_top"
+- field lookups: the field description, e.g. "natureza da operação"
+- batched refinement: "Documentos para refinamento", and batched extraction: "Lote de documentos".
+  The answer carries the canned extraction under every <documento id="..."> of the prompt.
+
+Each request waits `--latency` seconds (+/- `--jitter`). A `--rate-429` fraction of the requests
+gets an OpenRouter-style HTTP 429 instead. With `--rate-limit N`, requests beyond N per minute get a
+"free-models-per-min" 429. Every completion carries X-RateLimit-Limit / -Remaining / -Reset headers.
+`--canned file.json` replaces or extends the answers:
+{"rules": [{"match": "substring of the prompt", "response": {...}}], "default": {...}}.
+
+Usage:
+    python benchmarks/fake_openrouter.py --port 8765 --latency 0.8 --rate-429 0.05
+    OPENROUTER_BASE_URL=http://127.0.0.1:8765 OPENROUTER_API_KEY=fake uvicorn backend.api.main:app
+
+`FakeOpenRouter` runs the same server on a background thread (used by run_pipeline_benchmark.py).
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+MODELS = [
+    'deepseek/deepseek-chat-v3.1:free',
+    'minimax/minimax-m2:free',
+    'deepseek/deepseek-chat-v3.0:free',
+    'minimax/minimax-m1:free',
+]
+
+_EXTRACTION = {
+    'emitente': {'razao_social': 'COMERCIO EXEMPLO LTDA', 'cnpj': '12.345.678/0001-95', 'inscricao_estadual': '123456789', 'endereco': 'RUA EXEMPLO, 100'},
+    'destinatario': {'razao_social': 'CLIENTE EXEMPLO SA', 'cnpj': '98.765.432/0001-10', 'inscricao_estadual': None, 'endereco': None},
+    'itens': [
+        {'descricao': 'PRODUTO A', 'quantidade': 2, 'unidade': 'UN', 'valor_unitario': 50.0, 'valor_total': 100.0},
+        {'descricao': 'PRODUTO B', 'quantidade': 1, 'unidade': 'UN', 'valor_unitario': 25.5, 'valor_total': 25.5},
+    ],
+    'impostos': {'icms': {'aliquota': 18, 'base_calculo': 125.5, 'valor': 22.59}, 'ipi': {'valor': None}, 'pis': {'valor': 0.82}, 'cofins': {'valor': 3.77}},
+    'codigos_fiscais': {'cfop': '5102', 'cst': '00', 'ncm': '84713012', 'csosn': None},
+    'numero_nota': '12345',
+    'chave_acesso': None,
+    'data_emissao': '2025-06-24',
+    'natureza_operacao': 'VENDA DE MERCADORIA',
+    'forma_pagamento': 'PIX',
+    'valor_total': 125.5,
+}
+
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    {'match': 'Extraia os principais campos fiscais', 'response': _EXTRACTION},
+    {'match': 'items (array de objetos)', 'response': {'items': _EXTRACTION['itens'], 'confidence': 0.9, 'explanation': 'itens da seção de produtos'}},
+    {'match': 'decision (keep_top', 'response': {'decision': 'keep_top', 'llm_total': 125.5, 'confidence': 0.9, 'explanation': 'soma confere'}},
+    {'match': 'natureza da operação', 'response': {'value': 'VENDA DE MERCADORIA', 'confidence': 0.9, 'explanation': 'campo natureza da operação'}},
+    {'match': 'forma de pagamento', 'response': {'value': 'PIX', 'confidence': 0.8, 'explanation': 'campo forma de pagamento'}},
+    {'match': 'alíquota do ICMS', 'response': {'value': 18, 'confidence': 0.8, 'explanation': 'campo alíquota'}},
+    {'match': 'código CFOP', 'response': {'value': '5102', 'confidence': 0.8, 'explanation': 'campo CFOP'}},
+    {'match': 'código NCM', 'response': {'value': '84713012', 'confidence': 0.8, 'explanation': 'campo NCM'}},
+    {'match': 'código CSOSN', 'response': {'value': None, 'confidence': 0.0, 'explanation': 'não encontrado'}},
+    {'match': 'código CST', 'response': {'value': '00', 'confidence': 0.8, 'explanation': 'campo CST'}},
+]
+DEFAULT_RESPONSE = {'value': None, 'confidence': 0.0, 'explanation': 'não encontrado'}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'FakeOpenRouter/1.0'
+
+    def log_message(self, fmt, *args):  # keep benchmark output clean
+        pass
+
+    def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if path.endswith('/models'):
+            self._send(200, {'data': [{'id': m, 'pricing': {'prompt': '0', 'completion': '0'}} for m in MODELS]})
+        else:
+            self._send(404, {'error': {'message': f'unknown path {self.path}', 'code': 404}})
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0].rstrip('/')
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except Exception:
+            self._send(400, {'error': {'message': 'invalid JSON body', 'code': 400}})
+            return
+        if not path.endswith('/chat/completions'):
+            self._send(404, {'error': {'message': f'unknown path {self.path}', 'code': 404}})
+            return
+        self.server.fake.handle_completion(self, body)
+
+
+class FakeOpenRouter:
+    """Threaded fake OpenRouter server; `base_url` is what OPENROUTER_BASE_URL should be set to."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 rate_429: float = 0.0, canned: Optional[Dict[str, Any]] = None, seed: Optional[int] = None,
+                 rate_limit: int = 0):
+        self.latency = max(0.0, latency)
+        self.rate_limit = max(0, rate_limit)
+        self._window = (0.0, 0)
+        self.jitter = max(0.0, jitter)
+        self.rate_429 = min(1.0, max(0.0, rate_429))
+        canned = canned or {}
+        self.rules = list(canned.get('rules') or []) + DEFAULT_RULES
+        self.default = canned.get('default') or DEFAULT_RESPONSE
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'rate_limited': 0, 'by_rule': {}}
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _pick(self, prompt: str):
+        # multi-document prompts (refinement queue, batched extraction): one object per <documento id>
+        ids = re.findall(r'<documento id="([^"]+)">', prompt)
+        if ids:
+            rule = 'refinement' if 'Documentos para refinamento' in prompt else 'batch_extraction'
+            return rule, {'documentos': {doc_id: _EXTRACTION for doc_id in ids}}
+        for rule in self.rules:
+            if rule.get('match') and rule['match'] in prompt:
+                return rule['match'], rule.get('response')
+        return 'default', self.default
+
+    def handle_completion(self, handler: _Handler, body: Dict[str, Any]):
+        with self._lock:
+            delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+            limited = self._rng.random() < self.rate_429
+            self.stats['requests'] += 1
+            now = time.time()
+            start, used = self._window if now - self._window[0] < 60 else (now, 0)
+            over = bool(self.rate_limit) and used >= self.rate_limit
+            self._window = (start, used + (not over))
+            limit = self.rate_limit or 1000
+            quota = {'X-RateLimit-Limit': str(limit), 'X-RateLimit-Remaining': str(max(0, limit - self._window[1])),
+                     'X-RateLimit-Reset': str(int((start + 60) * 1000))}
+        model = body.get('model') or MODELS[0]
+        if over:
+            with self._lock:
+                self.stats['rate_limited'] += 1
+            handler._send(429, {'error': {'message': f'Rate limit exceeded: free-models-per-min ({model})', 'code': 429}}, quota)
+            return
+        if delay > 0:
+            time.sleep(max(0.0, delay))
+        if limited:
+            with self._lock:
+                self.stats['rate_limited'] += 1
+            handler._send(429, {'error': {'message': f'Rate limit exceeded: free-models-per-day ({model})', 'code': 429}})
+            return
+        prompt = '\n'.join(str(m.get('content') or '') for m in (body.get('messages') or []) if isinstance(m, dict))
+        rule, response = self._pick(prompt)
+        with self._lock:
+            self.stats['by_rule'][rule] = self.stats['by_rule'].get(rule, 0) + 1
+        content = response if isinstance(response, str) else json.dumps(response, ensure_ascii=False)
+        handler._send(200, {
+            'id': f'fake-{int(time.time() * 1000)}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4, 'total_tokens': (len(prompt) + len(content)) // 4},
+        }, quota)
+
+    def start(self) -> 'FakeOpenRouter':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-openrouter', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def load_canned(path: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not path:
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--latency', type=float, default=0.5, help='seconds per chat completion')
+    ap.add_argument('--jitter', type=float, default=0.0, help='+/- seconds added to the latency')
+    ap.add_argument('--rate-429', type=float, default=0.0, help='fraction of completions answered with HTTP 429')
+    ap.add_argument('--rate-limit', type=int, default=0, help='completions allowed per minute (0 = unlimited)')
+    ap.add_argument('--canned', help='JSON file with extra {"rules": [...], "default": {...}}')
+    ap.add_argument('--seed', type=int)
+    args = ap.parse_args()
+
+    fake = FakeOpenRouter(args.host, args.port, args.latency, args.jitter, args.rate_429, load_canned(args.canned), args.seed,
+                          args.rate_limit)
+    print(f'fake OpenRouter on {fake.base_url} (latency={args.latency}s, 429 rate={args.rate_429})')
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.httpd.server_close()
+        print(json.dumps(fake.stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
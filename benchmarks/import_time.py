@@ -0,0 +1,132 @@
+"""Import-time and cold-start benchmark for the API.
+
+Each measurement runs in a fresh interpreter, so nothing is cached in-process:
+- import: wall time of `python -c "import backend.api.main"` (median of --repeat runs), plus the
+  slowest top-level imports reported by `python -X importtime`;
+- cold start: time from launching `uvicorn backend.api.main:app` until GET /health answers 200.
+
+The documents DB and search index point at a temporary copy, so the run does not touch
+backend/api/documents_db.json. OPENROUTER_BASE_URL points at an unused local port, so the
+background LLM probe fails fast instead of reaching the network.
+
+Usage: python benchmarks/import_time.py [--repeat 5] [--output results.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MODULE = 'backend.api.main'
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _env(workdir: str):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    env['DOCUMENTS_DB_PATH'] = os.path.join(workdir, 'documents_db.json')
+    env['SEARCH_INDEX_PATH'] = os.path.join(workdir, 'search_index.sqlite3')
+    env['OPENROUTER_BASE_URL'] = f'http://127.0.0.1:{_free_port()}'
+    return env
+
+
+def time_import(env, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {MODULE}'], cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def slowest_imports(env, top: int = 10):
+    """Top-level modules imported by MODULE, by cumulative import time (python -X importtime)."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {MODULE}'], cwd=ROOT, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        parts = line.split('|')
+        if not line.startswith('import time:') or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        # direct children of MODULE are indented by exactly two spaces after the separator
+        if name.startswith('   ') and not name.startswith('    '):
+            rows.append((int(parts[1]) / 1e6, name.strip()))
+    return [{'module': n, 'cumulative_s': round(s, 4)} for s, n in sorted(rows, reverse=True)[:top]]
+
+
+def time_cold_start(env, timeout: float = 60.0):
+    port = _free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-m', 'uvicorn', f'{MODULE}:app', '--host', '127.0.0.1', '--port', str(port)],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as r:
+                    if r.status == 200:
+                        return time.perf_counter() - t0
+            except Exception:
+                if proc.poll() is not None:
+                    raise RuntimeError(f'uvicorn exited with code {proc.returncode}')
+                time.sleep(0.01)
+        raise RuntimeError(f'/health did not answer within {timeout}s')
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--db', default=os.path.join(ROOT, 'backend', 'api', 'documents_db.json'),
+                    help='DB copied into the temporary workdir (default: backend/api/documents_db.json)')
+    ap.add_argument('--output', help='write the results as JSON')
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fiscal-import-')
+    if os.path.exists(args.db):
+        shutil.copyfile(args.db, os.path.join(workdir, 'documents_db.json'))
+    env = _env(workdir)
+
+    imports = time_import(env, args.repeat)
+    cold = [time_cold_start(env) for _ in range(args.repeat)]
+    results = {
+        'python': sys.version.split()[0],
+        'db_bytes': os.path.getsize(args.db) if os.path.exists(args.db) else 0,
+        'import_s': {'median': round(statistics.median(imports), 4), 'min': round(min(imports), 4), 'max': round(max(imports), 4)},
+        'cold_start_to_health_s': {'median': round(statistics.median(cold), 4), 'min': round(min(cold), 4), 'max': round(max(cold), 4)},
+        'slowest_imports': slowest_imports(env),
+    }
+    print(f"import {MODULE}: median {results['import_s']['median']:.3f}s (min {results['import_s']['min']:.3f}s)")
+    print(f"cold start -> /health 200: median {results['cold_start_to_health_s']['median']:.3f}s (min {results['cold_start_to_health_s']['min']:.3f}s)")
+    print('slowest top-level imports:')
+    for row in results['slowest_imports']:
+        print(f"  {row['cumulative_s']:8.3f}s  {row['module']}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print('results written to', args.output)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
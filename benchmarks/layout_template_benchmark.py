@@ -0,0 +1,213 @@
+"""Benchmark: deterministic extraction from learned layout templates.
+
+Generates documents for two synthetic layouts, with a random customer, items, values, numero and
+a valid chave de acesso for each document:
+- 'nfce': a receipt with one line per item;
+- 'danfe': a DANFE text layer with one value per line, a single item and the customer's name in
+  the canhoto, so the header hash changes per document and the CNPJ fallback is used.
+
+The first LEARN documents of each layout are learned as verified documents, using their ground
+truth as extracted_data. Every other document goes through what process_document does before
+calling the LLM: match → extract → check. The script reports:
+- the template hit rate;
+- per-field accuracy against the ground truth;
+- the time per document.
+It also reports how many records of the stored documents DB (read only) pass check() and would
+seed templates.
+
+Usage: python benchmarks/layout_template_benchmark.py [--docs 50] [--learn 1] [--seed 7] [--output out.json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+PRODUCTS = ['PARAFUSO SEXTAVADO 8MM', 'TINTA ACRILICA FOSCA 18L', 'CABO FLEXIVEL 2,5MM 100M', 'LAMPADA LED 9W BIVOLT',
+            'TORNEIRA COZINHA PAREDE', 'FITA ISOLANTE 20M', 'ARGAMASSA AC III 20KG', 'DISJUNTOR BIPOLAR 32A',
+            'LUVA DE PROTECAO NITRILICA', 'ESCADA ALUMINIO 6 DEGRAUS', 'MANGUEIRA JARDIM 30M', 'SERROTE 20 POL']
+NAMES = ['MARIA SILVA', 'JOAO PEREIRA', 'ANA SOUZA LIMA', 'CARLOS OLIVEIRA', 'PAULA COSTA', 'RAFAEL ALVES']
+
+
+def _cnpj(base12):
+    for n in (12, 13):
+        weights = list(range(n - 7, 1, -1)) + list(range(9, 1, -1))
+        r = sum(int(d) * w for d, w in zip(base12, weights)) % 11
+        base12 += str(0 if r < 2 else 11 - r)
+    return base12
+
+
+def _chave(cnpj, numero, modelo, yy, mm, rng):
+    from backend.agents import chave_acesso
+    body = f"35{yy:02d}{mm:02d}{cnpj}{modelo}{1:03d}{numero:09d}1{rng.randrange(10 ** 8):08d}"
+    return body + str(chave_acesso.check_digit(body))
+
+
+def _brl(v):
+    return f"{v:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+
+
+def _items(rng, n):
+    out = []
+    for code in rng.sample(range(100000, 999999), n):
+        qty = rng.randint(1, 5)
+        unit = round(rng.uniform(3, 300), 2)
+        out.append({'codigo': str(code), 'descricao': rng.choice(PRODUCTS), 'quantidade': float(qty), 'unidade': 'UN',
+                    'valor_unitario': unit, 'valor_total': round(qty * unit, 2)})
+    return out
+
+
+def nfce(rng, cnpj):
+    numero, day = rng.randint(1, 999999), rng.randint(1, 28)
+    items = _items(rng, rng.randint(1, 6))
+    total = round(sum(i['valor_total'] for i in items), 2)
+    chave = _chave(cnpj, numero, '65', 25, 10, rng)
+    cpf = ''.join(str(rng.randint(0, 9)) for _ in range(11))
+    lines = [
+        f"CNPJ: {cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]} CASA DAS FERRAMENTAS",
+        'COMERCIO DE FERRAMENTAS EXEMPLO LTDA',
+        'Avenida Exemplo, 1000 Centro Sao Paulo - SP',
+        'Documento Auxiliar da Nota Fiscal de Consumidor Eletronica',
+        'Codigo Descricao Qtd UN Vl Unit Vl Total',
+    ]
+    for it in items:
+        lines.append(f"{it['codigo']} {it['descricao']} {int(it['quantidade'])} UN {_brl(it['valor_unitario'])} {_brl(it['valor_total'])}")
+    lines += [
+        f"Qtde. total de itens {len(items)}",
+        f"Valor total R$ {_brl(total)}",
+        'FORMA DE PAGAMENTO', 'Cartao de Credito', f"VALOR PAGO R$ {_brl(total)}",
+        'Consulte pela chave de acesso em', 'https://www.nfce.fazenda.sp.gov.br/consulta',
+        ' '.join(chave[i:i + 4] for i in range(0, 44, 4)),
+        f"CONSUMIDOR - CPF - {cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]} - {rng.choice(NAMES)}",
+        f"NFC-e n {numero:09d} Serie 1 {day:02d}/10/2025 12:02:45 Via Consumidor",
+    ]
+    truth = {'numero_nota': str(numero), 'chave_acesso': chave, 'data_emissao': f"2025-10-{day:02d}", 'valor_total': total,
+             'forma_pagamento': 'Cartao de Credito', 'emitente': {'cnpj': cnpj}, 'itens': items}
+    return '\n'.join(lines), truth
+
+
+def danfe(rng, cnpj):
+    numero, day = rng.randint(1, 999999), rng.randint(1, 28)
+    item = _items(rng, 1)[0]
+    total = item['valor_total']
+    chave = _chave(cnpj, numero, '55', 25, 9, rng)
+    customer = rng.choice(NAMES)
+    lines = [
+        'RECEBEMOS DE DISTRIBUIDORA MODELO S/A OS PRODUTOS CONSTANTES DA NOTA FISCAL INDICADA ABAIXO',
+        'DATA DE RECEBIMENTO', customer, 'NF-e', 'N', f"{numero:09d}", 'DISTRIBUIDORA MODELO S/A',
+        'RUA DAS INDUSTRIAS, 500', 'DISTRITO INDUSTRIAL', 'CAMPINAS - SP - CEP: 13000000',
+        'DANFE', 'DOCUMENTO AUXILIAR', 'DA NOTA FISCAL', 'ELETRONICA',
+        'NATUREZA DA OPERACAO', 'VENDA DE MERCADORIA', 'CHAVE DE ACESSO',
+        ' '.join(chave[i:i + 4] for i in range(0, 44, 4)),
+        'CNPJ', f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}",
+        'DESTINATARIO / REMETENTE', 'NOME/RAZAO SOCIAL', customer,
+        'DATA DA EMISSAO', f"{day:02d}/09/2025",
+        'VALOR TOTAL DOS PRODUTOS', _brl(item['valor_total']), 'VALOR DO FRETE', '0,00',
+        'VALOR TOTAL DA NOTA', _brl(total),
+        'DADOS DO PRODUTO / SERVICO', 'COD.PROD.', 'DESCRICAO DO PRODUTO / SERVICO', item['codigo'], item['descricao'],
+        'NCM/SH', 'CST CFOP UNID', 'QTDE', 'VL. UNITARIO', 'VL. TOTAL',
+        '84713019', '060', '5405', 'UN', f"{item['quantidade']:.4f}", f"{item['valor_unitario']:.4f}", _brl(item['valor_total']),
+        'DADOS ADICIONAIS', 'RESERVADO AO FISCO',
+    ]
+    truth = {'numero_nota': str(numero), 'chave_acesso': chave, 'data_emissao': f"2025-09-{day:02d}", 'valor_total': total,
+             'natureza_operacao': 'VENDA DE MERCADORIA', 'emitente': {'cnpj': cnpj, 'razao_social': 'DISTRIBUIDORA MODELO S/A'},
+             'destinatario': {'razao_social': customer}, 'itens': [item]}
+    return '\n'.join(lines), truth
+
+
+FIELDS = ('numero_nota', 'data_emissao', 'valor_total', 'emitente.cnpj', 'forma_pagamento',
+          'natureza_operacao', 'emitente.razao_social', 'destinatario.razao_social')
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--docs', type=int, default=50, help='documents per layout')
+    ap.add_argument('--learn', type=int, default=1, help='verified documents learned per layout before matching')
+    ap.add_argument('--seed', type=int, default=7)
+    ap.add_argument('--db', default=os.path.join(ROOT, 'backend', 'api', 'documents_db.json'))
+    ap.add_argument('--output', help='write the results as JSON')
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fiscal-layouts-')
+    os.environ['LAYOUT_TEMPLATES_PATH'] = os.path.join(workdir, 'layout_templates.sqlite3')
+    from backend.api import layout_templates as lt
+    from backend.agents import chave_acesso
+
+    rng = random.Random(args.seed)
+    results = {}
+    for name, make, cnpj in (('nfce', nfce, _cnpj('123456780001')), ('danfe', danfe, _cnpj('987654320001'))):
+        hits, rejected, misses, times = 0, 0, 0, []
+        fields = {f: {'right': 0, 'wrong': 0, 'missing': 0} for f in FIELDS}
+        items_right = 0
+        for n in range(args.docs):
+            text, truth = make(rng, cnpj)
+            if n < args.learn:
+                if truth['itens']:
+                    lt.learn(f'{name}-{n}', {'status': 'finalizado', 'ocr_text': text, 'extracted_data': truth})
+                continue
+            t0 = time.perf_counter()
+            chave = chave_acesso.find_valid(text)
+            found = lt.match(text, cnpj=chave['cnpj'] if chave else None)
+            extracted, issues = None, None
+            if found:
+                extracted = lt.extract(found['template'], text)
+                issues = lt.check(extracted, chave, found['template'])
+            times.append((time.perf_counter() - t0) * 1000)
+            if not found:
+                misses += 1
+                continue
+            if issues:
+                rejected += 1
+                continue
+            hits += 1
+            for f in FIELDS:
+                want = lt._get(truth, f)
+                if want is None:
+                    continue
+                got = lt._get(extracted, f)
+                kind = lt.FIELD_KINDS.get(f, 'text')
+                fields[f]['missing' if got is None else 'right' if lt._same(kind, got, want) else 'wrong'] += 1
+            items_right += int(lt._same_items(extracted['itens'], truth['itens']))
+        matched = args.docs - args.learn
+        results[name] = {
+            'documents': matched, 'hits': hits, 'rejected': rejected, 'misses': misses,
+            'hit_rate': round(hits / matched, 3) if matched else None,
+            'items_exact': items_right,
+            'fields': {f: c for f, c in fields.items() if sum(c.values())},
+            'ms_p50': round(statistics.median(times), 3) if times else None,
+        }
+        r = results[name]
+        print(f"{name}: {hits}/{matched} template hits ({rejected} rejected by check, {misses} misses), "
+              f"items exact {items_right}/{hits}, p50 {r['ms_p50']} ms/doc")
+        for f, c in r['fields'].items():
+            print(f"  {f:<26} right {c['right']:3d}  wrong {c['wrong']:3d}  missing {c['missing']:3d}")
+
+    if os.path.exists(args.db):
+        with open(args.db, 'r', encoding='utf-8') as f:
+            db = json.load(f)
+        lt.clear()
+        finalized = [r for r in db.values() if isinstance(r, dict) and r.get('status') == 'finalizado']
+        verified = sum(1 for r in finalized if isinstance(r.get('extracted_data'), dict)
+                       and not lt.check(r['extracted_data'], lt._chave(r)))
+        synced = lt.sync(db)
+        results['stored_db'] = {'finalized': len(finalized), 'verified': verified, 'learned': synced['learned'],
+                                'templates': lt.stats()['templates']}
+        print(f"stored DB: {verified}/{len(finalized)} finalized records pass check(); "
+              f"{results['stored_db']['templates']} template(s) learned from them")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print('results written to', args.output)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
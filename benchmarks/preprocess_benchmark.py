@@ -0,0 +1,123 @@
+"""Benchmark: Tesseract time per image with and without OpenCV preprocessing.
+
+For every image in assets/ (or --files) and each pipeline in backend/api/preprocess.py ('none',
+'light', 'receipt'), it measures:
+- preprocessing seconds and the output size in megapixels;
+- Tesseract seconds and characters recognized (skipped when Tesseract is not installed).
+
+It also compares preprocessing the whole set serially and in the process pool. Each run uses a
+fresh cache directory, so the numbers do not come from the result cache.
+
+Usage: python benchmarks/preprocess_benchmark.py [--pipelines none,light,receipt] [--output out.json]
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+
+def tesseract():
+    try:
+        import pytesseract
+        cmd = os.environ.get('TESSERACT_CMD') or shutil.which('tesseract')
+        if cmd:
+            pytesseract.pytesseract.tesseract_cmd = cmd
+        pytesseract.get_tesseract_version()
+        return pytesseract
+    except Exception as e:
+        print(f'Tesseract not available ({e}); reporting preprocessing only')
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--files', default=os.path.join(ROOT, 'assets', '*.jpg'))
+    ap.add_argument('--pipelines', default='none,light,receipt')
+    ap.add_argument('--output', help='write the results as JSON')
+    args = ap.parse_args()
+
+    files = sorted(glob.glob(args.files))
+    if not files:
+        print('no images match', args.files)
+        return 1
+    pipelines = [p for p in args.pipelines.split(',') if p]
+    cache_root = tempfile.mkdtemp(prefix='fiscal-preproc-bench-')
+    os.environ['PREPROCESS_CACHE_DIR'] = os.path.join(cache_root, 'warm')
+    from backend.api import preprocess
+    from PIL import Image
+
+    ocr = tesseract()
+    rows = []
+    for name in pipelines:
+        for path in files:
+            preprocess.PREPROCESS_CACHE_DIR = os.path.join(cache_root, f'{name}-{os.path.basename(path)}')
+            t0 = time.perf_counter()
+            out, info = preprocess.preprocess_image(path, pipeline=name)
+            prep_s = time.perf_counter() - t0
+            with Image.open(out) as im:
+                w, h = im.size
+                row = {'pipeline': name, 'file': os.path.basename(path), 'preprocess_s': round(prep_s, 4),
+                       'megapixels': round(w * h / 1e6, 2)}
+                if ocr is not None:
+                    t0 = time.perf_counter()
+                    text = ocr.image_to_string(im, lang='por')
+                    row['tesseract_s'] = round(time.perf_counter() - t0, 3)
+                    row['chars'] = len(text.strip())
+            rows.append(row)
+            print(row)
+
+    summary = {}
+    for name in pipelines:
+        sub = [r for r in rows if r['pipeline'] == name]
+        summary[name] = {
+            'preprocess_s_mean': round(statistics.mean(r['preprocess_s'] for r in sub), 4),
+            'megapixels_mean': round(statistics.mean(r['megapixels'] for r in sub), 2),
+        }
+        if ocr is not None:
+            summary[name]['tesseract_s_mean'] = round(statistics.mean(r['tesseract_s'] for r in sub), 3)
+            summary[name]['chars_mean'] = round(statistics.mean(r['chars'] for r in sub), 1)
+
+    # whole set: serial (inline) vs process pool, cold cache each time
+    steps = preprocess.resolve_pipeline('receipt')
+    serial_dir = os.path.join(cache_root, 'serial')
+    os.makedirs(serial_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    for i, path in enumerate(files):
+        preprocess.run_pipeline(path, steps, os.path.join(serial_dir, f'{i}.png'))
+    serial_s = time.perf_counter() - t0
+    preprocess.PREPROCESS_CACHE_DIR = os.path.join(cache_root, 'pool')
+    preprocess.executor()  # start the workers outside the timing
+    from concurrent.futures import ThreadPoolExecutor
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(files)) as pool:
+        list(pool.map(lambda p: preprocess.preprocess_image(p, pipeline='receipt'), files))
+    pool_s = time.perf_counter() - t0
+
+    print('\nper pipeline (means per image):')
+    for name, s in summary.items():
+        print(f'  {name:<8} {s}')
+    print(f'receipt pipeline over {len(files)} images: serial {serial_s:.2f}s, process pool '
+          f'({preprocess.IMAGE_PREPROCESS_WORKERS} workers) {pool_s:.2f}s')
+    if ocr is not None and 'none' in summary and 'receipt' in summary and summary['receipt']['tesseract_s_mean']:
+        print(f"Tesseract time per image: none {summary['none']['tesseract_s_mean']}s -> receipt "
+              f"{summary['receipt']['tesseract_s_mean']}s ({summary['none']['tesseract_s_mean'] / summary['receipt']['tesseract_s_mean']:.2f}x)")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'rows': rows, 'summary': summary, 'serial_s': round(serial_s, 3), 'pool_s': round(pool_s, 3),
+                       'workers': preprocess.IMAGE_PREPROCESS_WORKERS}, f, indent=2)
+        print('results written to', args.output)
+    shutil.rmtree(cache_root, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
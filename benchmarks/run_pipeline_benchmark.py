@@ -0,0 +1,214 @@
+"""Throughput benchmark: upload -> finalizado for the sample files, against a fake OpenRouter.
+
+Starts benchmarks/fake_openrouter.py on a local port and points the backend at it
+(OPENROUTER_BASE_URL, fake key), with the documents DB and search index in a temporary directory.
+It then imports the FastAPI app in-process and, for each concurrency level, uploads the sample
+files through POST /api/v1/documents/upload from that many client threads. The TestClient runs the
+upload's background processing before returning, so each upload call covers the whole pipeline.
+Each record is then read back through /results.
+
+Reported per level:
+- docs/sec and end-to-end latency p50/p95/p99;
+- p50/p95/p99 of every stage in the record's 'timings' (see backend/api/metrics.py);
+- final status counts, budget-skipped stages and the fake server's request/429 counts;
+- peak RSS of the process so far (resource.getrusage, not available on Windows).
+
+Results are written as JSON. `--baseline old.json` prints the change against an earlier run.
+
+Usage:
+    python benchmarks/run_pipeline_benchmark.py --concurrency 1,2,4 --docs 8 --latency 0.5 --rate-429 0.05
+"""
+import argparse
+import glob
+import json
+import mimetypes
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openrouter import FakeOpenRouter, load_canned  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of `values` (p in 0-100); None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+    return round(ordered[k], 4)
+
+
+def summarize(values):
+    return {'n': len(values), 'p50': percentile(values, 50), 'p95': percentile(values, 95), 'p99': percentile(values, 99),
+            'max': round(max(values), 4) if values else None}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0, 1)
+
+
+def run_level(client, files, concurrency, n_docs, fake):
+    requests_before = fake.stats['requests']
+    limited_before = fake.stats['rate_limited']
+    jobs = [files[i % len(files)] for i in range(n_docs)]
+
+    def one(path):
+        with open(path, 'rb') as f:
+            content = f.read()
+        mime = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        t0 = time.perf_counter()
+        r = client.post('/api/v1/documents/upload', files=[('files', (os.path.basename(path), content, mime))])
+        elapsed = time.perf_counter() - t0
+        if r.status_code != 200:
+            return {'file': os.path.basename(path), 'error': f'upload http {r.status_code}', 'latency': elapsed}
+        doc_id = r.json()['document_ids'][0]
+        rec = client.get(f'/api/v1/documents/{doc_id}/results').json()
+        return {'file': os.path.basename(path), 'status': rec.get('status'), 'latency': elapsed,
+                'timings': rec.get('timings') or {}, 'budget': rec.get('budget') or {}}
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, jobs))
+    wall = time.perf_counter() - t0
+
+    statuses, skipped, stages = {}, {}, {}
+    for res in results:
+        st = res.get('status') or res.get('error') or 'unknown'
+        statuses[st] = statuses.get(st, 0) + 1
+        for entry in (res.get('budget') or {}).get('skipped_stages') or []:
+            skipped[entry.get('stage')] = skipped.get(entry.get('stage'), 0) + 1
+        for stage, secs in (res.get('timings') or {}).items():
+            if stage.startswith('llm:'):  # per-model breakdown; 'llm' has the sum
+                continue
+            stages.setdefault(stage, []).append(secs)
+
+    return {
+        'concurrency': concurrency,
+        'docs': n_docs,
+        'wall_s': round(wall, 3),
+        'docs_per_s': round(n_docs / wall, 3) if wall > 0 else None,
+        'latency_s': summarize([r['latency'] for r in results]),
+        'stages_s': {k: summarize(v) for k, v in sorted(stages.items())},
+        'statuses': statuses,
+        'budget_skips': skipped,
+        'llm_requests': fake.stats['requests'] - requests_before,
+        'llm_rate_limited': fake.stats['rate_limited'] - limited_before,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def print_level(level):
+    lat = level['latency_s']
+    print(f"concurrency={level['concurrency']:<3} docs={level['docs']:<4} {level['docs_per_s']} docs/s  "
+          f"latency p50={lat['p50']}s p95={lat['p95']}s p99={lat['p99']}s  peak RSS={level['peak_rss_mb']} MB  "
+          f"LLM requests={level['llm_requests']} (429: {level['llm_rate_limited']})  statuses={level['statuses']}")
+    for stage, s in level['stages_s'].items():
+        print(f"    {stage:<16} p50={s['p50']:<8} p95={s['p95']:<8} p99={s['p99']}")
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    old = {lvl['concurrency']: lvl for lvl in baseline.get('levels', [])}
+    print(f'\ncompared with {baseline_path}:')
+    for lvl in results['levels']:
+        prev = old.get(lvl['concurrency'])
+        if not prev:
+            continue
+
+        def delta(new, before):
+            if not new or not before:
+                return 'n/a'
+            return f'{(new - before) / before * 100:+.1f}%'
+        print(f"  concurrency={lvl['concurrency']}: docs/s {prev['docs_per_s']} -> {lvl['docs_per_s']} ({delta(lvl['docs_per_s'], prev['docs_per_s'])}), "
+              f"p95 {prev['latency_s']['p95']} -> {lvl['latency_s']['p95']} ({delta(lvl['latency_s']['p95'], prev['latency_s']['p95'])}), "
+              f"peak RSS {prev.get('peak_rss_mb')} -> {lvl.get('peak_rss_mb')} MB")
+
+
+def main():
+    ap = argparse.ArgumentParser(description='upload -> finalizado throughput against a fake OpenRouter')
+    ap.add_argument('--files', default=os.path.join(ROOT, 'assets', '*'), help='glob of sample files (default: assets/*)')
+    ap.add_argument('--concurrency', default='1,2,4', help='comma-separated client thread counts')
+    ap.add_argument('--docs', type=int, default=0, help='documents per level (default: one per sample file)')
+    ap.add_argument('--warmup', type=int, default=1, help='documents processed before measuring (imports, caches)')
+    ap.add_argument('--latency', type=float, default=0.5, help='fake LLM latency per completion (s)')
+    ap.add_argument('--jitter', type=float, default=0.1)
+    ap.add_argument('--rate-429', type=float, default=0.0, help='fraction of completions answered with HTTP 429')
+    ap.add_argument('--canned', help='extra canned responses for the fake server (see fake_openrouter.py)')
+    ap.add_argument('--budget', type=float, help='DOCUMENT_BUDGET_SECONDS for the run')
+    ap.add_argument('--seed', type=int, default=1234)
+    ap.add_argument('--output', help='results JSON (default: benchmarks/results/pipeline-<timestamp>.json)')
+    ap.add_argument('--baseline', help='earlier results JSON to compare against')
+    args = ap.parse_args()
+
+    files = sorted(p for p in glob.glob(args.files) if os.path.isfile(p))
+    if not files:
+        print('no sample files match', args.files)
+        return 1
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    n_docs = args.docs or len(files)
+
+    fake = FakeOpenRouter(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                          canned=load_canned(args.canned), seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix='fiscal-bench-')
+    # must be set before the backend modules are imported: they read the environment at import time
+    os.environ['OPENROUTER_BASE_URL'] = fake.base_url
+    os.environ['OPENROUTER_API_KEY'] = 'fake-benchmark-key'
+    os.environ['DOCUMENTS_DB_PATH'] = os.path.join(workdir, 'documents_db.json')
+    os.environ['SEARCH_INDEX_PATH'] = os.path.join(workdir, 'search_index.sqlite3')
+    if args.budget is not None:
+        os.environ['DOCUMENT_BUDGET_SECONDS'] = str(args.budget)
+
+    t0 = time.perf_counter()
+    from fastapi.testclient import TestClient
+    from backend.api import main as api_main
+    import_s = time.perf_counter() - t0
+    print(f'fake OpenRouter at {fake.base_url}; backend imported in {import_s:.2f}s; {len(files)} sample file(s); workdir {workdir}')
+
+    results = {
+        'started_at': datetime.now().isoformat(),
+        'files': [os.path.basename(p) for p in files],
+        'fake_llm': {'latency_s': args.latency, 'jitter_s': args.jitter, 'rate_429': args.rate_429},
+        'budget_s': args.budget,
+        'import_s': round(import_s, 3),
+        'levels': [],
+    }
+    try:
+        with TestClient(api_main.app) as client:
+            if args.warmup:
+                run_level(client, files, 1, args.warmup, fake)
+            for c in levels:
+                level = run_level(client, files, c, n_docs, fake)
+                print_level(level)
+                results['levels'].append(level)
+    finally:
+        fake.stop()
+
+    out = args.output or os.path.join(ROOT, 'benchmarks', 'results', f"pipeline-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print('results written to', out)
+    if args.baseline:
+        compare(results, args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,82 @@
+"""Benchmark: supplier registry hit rate replaying the stored corpus in upload order.
+
+Each finalized record of the documents DB (read only) is replayed as a new document. The script
+looks its emitente CNPJ up in a fresh registry (temporary SQLite file), as process_document does
+before extraction, and then observes it. It reports:
+- the hit rate;
+- per field, how often the registry would have filled the value and whether the canonical value
+  agreed with what the document's own extraction produced;
+- the lookup latency.
+
+Usage: python benchmarks/supplier_registry_benchmark.py [--db backend/api/documents_db.json] [--output out.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--db', default=os.path.join(ROOT, 'backend', 'api', 'documents_db.json'))
+    ap.add_argument('--output', help='write the results as JSON')
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fiscal-suppliers-')
+    os.environ['SUPPLIER_REGISTRY_PATH'] = os.path.join(workdir, 'supplier_registry.sqlite3')
+    from backend.api import supplier_registry
+
+    with open(args.db, 'r', encoding='utf-8') as f:
+        db = json.load(f)
+    records = [(k, r) for k, r in db.items()
+               if isinstance(r, dict) and r.get('status') == 'finalizado' and isinstance(r.get('extracted_data'), dict)]
+    records.sort(key=lambda item: str(item[1].get('uploaded_at') or ''))
+
+    fields = {f: {'filled': 0, 'agree': 0, 'disagree': 0} for f in supplier_registry.FIELDS}
+    lookup_ms = []
+    for doc_id, rec in records:
+        emitente = rec['extracted_data'].get('emitente') or {}
+        t0 = time.perf_counter()
+        entry = supplier_registry.lookup(emitente.get('cnpj'))
+        lookup_ms.append((time.perf_counter() - t0) * 1000)
+        if entry:
+            for field in supplier_registry.FIELDS:
+                info = entry['fields'].get(field)
+                if not info or info['confidence'] < supplier_registry.SUPPLIER_MIN_CONFIDENCE:
+                    continue
+                fields[field]['filled'] += 1
+                own = emitente.get(field)
+                if own:
+                    same = supplier_registry._norm(own) == supplier_registry._norm(info['value'])
+                    fields[field]['agree' if same else 'disagree'] += 1
+        supplier_registry.observe(doc_id, rec['extracted_data'])
+
+    stats = supplier_registry.stats()
+    results = {
+        'documents': len(records),
+        'registry': stats,
+        'fields': fields,
+        'lookup_ms_p50': round(statistics.median(lookup_ms), 3) if lookup_ms else None,
+    }
+    print(f"{len(records)} finalized documents, {stats['suppliers']} suppliers with a valid CNPJ")
+    print(f"lookups {stats['lookups']}, hits {stats['hits']}, hit rate {stats['hit_rate']}, "
+          f"lookup p50 {results['lookup_ms_p50']} ms")
+    for field, c in fields.items():
+        print(f"  {field:<20} filled {c['filled']:3d}  agrees with extraction {c['agree']:3d}  differs {c['disagree']:3d}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print('results written to', args.output)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
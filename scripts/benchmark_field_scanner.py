@@ -0,0 +1,130 @@
+"""Benchmark: legacy find_* helpers vs field_scanner (equivalence check and timings).
+
+Corpus: the text sources of every record in the documents DB (DOCUMENTS_DB_PATH or
+backend/api/documents_db.json) plus the text layer of assets/nota_exemplo.pdf. For each text it
+runs the same lookups enrich_record needs (CNPJ, all CNPJs, chave, date, numero, money, tax
+totals, ICMS, lines) both ways, checks that the results agree and prints the timings.
+
+Usage: python scripts/benchmark_field_scanner.py [--repeat 5]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from backend.agents import enrichment_agent, field_scanner  # noqa: E402
+
+_ICMS_RE = r'ICMS\s*[:\-]?\s*R?\$?\s*([0-9]+[\.,][0-9]{2})'
+_ALL_CNPJS_RE = r'(?:\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}|\d{14})'
+
+
+def load_corpus():
+    texts = []
+    db_path = os.environ.get('DOCUMENTS_DB_PATH') or os.path.join(ROOT, 'backend', 'api', 'documents_db.json')
+    if os.path.exists(db_path):
+        with open(db_path, 'r', encoding='utf-8') as f:
+            db = json.load(f)
+        for rec in db.values():
+            if isinstance(rec, dict):
+                texts.append(enrichment_agent._to_text_sources(rec))
+    sample = os.path.join(ROOT, 'assets', 'nota_exemplo.pdf')
+    try:
+        from PyPDF2 import PdfReader
+        reader = PdfReader(sample)
+        texts.append('\n'.join((p.extract_text() or '') for p in reader.pages))
+    except Exception as e:
+        print('skipping', sample, '-', e)
+    return [t for t in texts if t]
+
+
+def legacy(text):
+    m = re.search(_ICMS_RE, text, re.IGNORECASE)
+    icms = None
+    if m:
+        try:
+            icms = float(m.group(1).replace('.', '').replace(',', '.'))
+        except Exception:
+            pass
+    return {
+        'cnpj': enrichment_agent.find_cnpj(text),
+        'all_cnpjs': re.findall(_ALL_CNPJS_RE, text),
+        'chave': enrichment_agent.find_chave(text),
+        'date': enrichment_agent.find_date(text),
+        'numero_nota': enrichment_agent.find_numero_nota(text),
+        'money': enrichment_agent.find_money(text),
+        'total_impostos': enrichment_agent.find_total_impostos(text),
+        'valor_total_impostos': enrichment_agent.find_valor_total_impostos(text),
+        'icms_valor': icms,
+        'lines': len([l.strip() for l in text.splitlines() if l.strip()]),
+    }
+
+
+def single_pass(text):
+    r = field_scanner.scan(text)
+    return {
+        'cnpj': r.cnpj(),
+        'all_cnpjs': r.all_cnpjs(),
+        'chave': r.chave(),
+        'date': r.date(),
+        'numero_nota': r.numero_nota(),
+        'money': r.money(),
+        'total_impostos': r.total_impostos(),
+        'valor_total_impostos': r.valor_total_impostos(),
+        'icms_valor': r.icms_valor(),
+        'lines': len(r.lines),
+    }
+
+
+def timed(fn, texts, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for t in texts:
+            fn(t)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    texts = load_corpus()
+    if not texts:
+        print('no corpus found')
+        return 1
+    chars = sum(len(t) for t in texts)
+    print(f'corpus: {len(texts)} texts, {chars} chars')
+
+    # first run, reported separately from the steady state
+    t0 = time.perf_counter()
+    for t in texts:
+        single_pass(t)
+    cold = time.perf_counter() - t0
+
+    mismatches = 0
+    for i, t in enumerate(texts):
+        a, b = legacy(t), single_pass(t)
+        if a != b:
+            mismatches += 1
+            print(f'  mismatch in text {i}:', {k: (a[k], b[k]) for k in a if a[k] != b[k]})
+    print('mismatches:', mismatches)
+
+    t_legacy = timed(legacy, texts, args.repeat)
+    t_scan = timed(single_pass, texts, args.repeat)
+    print(f'legacy find_* scans : {t_legacy * 1000:8.1f} ms/corpus')
+    print(f'field_scanner.scan  : {t_scan * 1000:8.1f} ms/corpus (first run: {cold * 1000:.1f} ms)')
+    if t_scan > 0:
+        print(f'speedup             : {t_legacy / t_scan:8.2f}x')
+    return 0 if mismatches == 0 else 2
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())